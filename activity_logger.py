@@ -0,0 +1,203 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+from db_pool import get_pool
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INSERT_SQL = "INSERT INTO user_activity (user_id, action_type, action_details, action_at) VALUES %s"
+
+
+class ActivityLogger:
+    """
+    Асинхронная запись user_activity пачками.
+
+    log() кладет событие в ограниченную очередь и сразу возвращается;
+    фоновый поток забирает события и вставляет их одним многострочным
+    INSERT, когда набралось batch_size событий или прошло flush_interval
+    секунд. Если очередь заполнена, log() ждет до put_timeout секунд
+    (обратное давление на обработчики), после чего событие отбрасывается
+    и учитывается в статистике. При завершении процесса очередь
+    дописывается в БД.
+
+    Для событий, которые должны зафиксироваться вместе с бизнес-операцией
+    (заказ, отмена), служит write(), пишущий в транзакции вызывающего.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue=None, put_timeout=None):
+        """
+        Args:
+            batch_size: максимум событий в одном INSERT
+            flush_interval: сколько секунд событие может ждать записи
+            max_queue: размер очереди событий
+            put_timeout: сколько log() ждет места в заполненной очереди
+        """
+        self.batch_size = batch_size or int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "500"))
+        self.flush_interval = flush_interval or float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", "1.0"))
+        self.put_timeout = put_timeout if put_timeout is not None else float(os.getenv("ACTIVITY_LOG_PUT_TIMEOUT", "0.5"))
+        self._queue = queue.Queue(maxsize=max_queue or int(os.getenv("ACTIVITY_LOG_QUEUE_SIZE", "10000")))
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._pid = None
+        self._enqueued = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+
+    def log(self, user_id, action_type, action_details=None):
+        """Постановка события в очередь на фоновую запись"""
+        self._ensure_worker()
+        event = (user_id, action_type, action_details, datetime.now())
+        try:
+            self._queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            logger.warning("Очередь активности заполнена, событие %s пользователя %s отброшено",
+                           action_type, user_id)
+            return
+        with self._lock:
+            self._enqueued += 1
+
+    def write(self, cursor, user_id, action_type, action_details=None):
+        """Синхронная запись события в транзакции курсора (для аудита)"""
+        cursor.execute(
+            "INSERT INTO user_activity (user_id, action_type, action_details) VALUES (%s, %s, %s)",
+            (user_id, action_type, action_details)
+        )
+
+    def flush(self, timeout=None):
+        """Ожидание записи всех поставленных событий"""
+        if self._worker is None or not self._worker.is_alive():
+            self._drain()
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+
+    def stop(self, timeout=None):
+        """Остановка фонового потока с записью оставшихся событий"""
+        self._stopping.set()
+        if self._worker is not None and self._pid == os.getpid():
+            self._worker.join(timeout)
+        self._drain()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'max_queue': self._queue.maxsize,
+                'enqueued': self._enqueued,
+                'written': self._written,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'batches': self._batches,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval
+            }
+
+    def _ensure_worker(self):
+        # Поток запускается лениво в каждом процессе (после fork он не наследуется)
+        if self._pid == os.getpid() and self._worker is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._worker is not None:
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='activity-logger', daemon=True)
+            self._pid = os.getpid()
+            self._worker.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect()
+            if batch:
+                self._write_batch(batch)
+
+    def _collect(self):
+        """Сбор пачки: первое событие ждем до flush_interval, остальные - до его истечения"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        """Запись всего, что осталось в очереди, в текущем потоке"""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        try:
+            self._insert(batch)
+        except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+            # Одно некорректное событие не должно терять всю пачку:
+            # повторяем по одному, чтобы отбросить только его
+            if len(batch) > 1:
+                logger.warning("Пачка активности не записана (%s), повтор по одному событию", e)
+                for event in batch:
+                    self._write_single(event)
+            else:
+                self._record_failure(batch, e)
+        except Exception as e:
+            self._record_failure(batch, e)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write_single(self, event):
+        try:
+            self._insert([event])
+        except Exception as e:
+            self._record_failure([event], e)
+
+    def _insert(self, batch):
+        with get_pool().connection() as conn:
+            with conn.cursor() as cursor:
+                execute_values(cursor, INSERT_SQL, batch, page_size=self.batch_size)
+            conn.commit()
+        with self._lock:
+            self._written += len(batch)
+            self._batches += 1
+
+    def _record_failure(self, batch, error):
+        with self._lock:
+            self._failed += len(batch)
+        logger.error("Не удалось записать %s событий активности: %s", len(batch), error)
+
+
+# Общий журнал активности процесса
+activity_logger = ActivityLogger()
+atexit.register(activity_logger.stop)
@@ -0,0 +1,154 @@
+import numpy as np
+from scipy import sparse
+
+
+class RandomProjectionLSH:
+    """
+    Приближенный поиск ближайших по косинусной схожести (random-projection LSH).
+
+    В каждой из n_tables таблиц строки проецируются на n_bits случайных
+    гиперплоскостей, знаки проекций образуют код корзины. Кандидатами
+    для запроса становятся строки с тем же кодом хотя бы в одной таблице
+    (при probes - и с кодами, отличающимися от кода запроса одним битом),
+    среди кандидатов схожесть считается точно.
+
+    Полнота и латентность настраиваются параметрами: больше таблиц и
+    probes - выше полнота и больше кандидатов, больше бит - мельче
+    корзины, быстрее запрос и ниже полнота.
+
+    Гиперплоскости не хранятся: они генерируются блоками признаков из
+    seed, поэтому память индекса - коды строк (строки x n_tables) и их
+    порядок, даже если признаков миллионы (столбцы товаров - пользователи).
+    """
+
+    # Размер блока строк и признаков при вычислении кодов
+    BLOCK_SIZE = 65536
+
+    def __init__(self, n_tables=8, n_bits=12, probes=True, seed=0):
+        """
+        Args:
+            n_tables: количество хэш-таблиц
+            n_bits: бит в коде корзины (до 62)
+            probes: проверять соседние корзины (коды с одним измененным битом)
+            seed: зерно генератора гиперплоскостей
+        """
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.probes = probes
+        self.seed = seed
+        self.vectors = None
+        self.codes = None
+        self._order = None
+        self._sorted_codes = None
+        # Маски запроса: сам код и, при probes, коды с одним измененным битом
+        flips = np.int64(1) << np.arange(n_bits, dtype=np.int64) if probes else np.empty(0, dtype=np.int64)
+        self._masks = np.concatenate([np.zeros(1, dtype=np.int64), flips])
+
+    def fit(self, vectors):
+        """
+        Построение таблиц
+
+        Args:
+            vectors: CSR-матрица с L2-нормированными строками
+        """
+        vectors = vectors.tocsr()
+        self._index(vectors, self.hash(vectors))
+        return self
+
+    def with_rows(self, vectors, rows):
+        """
+        Новый индекс после изменения строк rows и добавления строк в конец
+
+        Коды остальных строк не пересчитываются.
+
+        Args:
+            vectors: CSR-матрица всех строк (прежние строки сохраняют номера)
+            rows: номера изменившихся строк
+        """
+        updated = RandomProjectionLSH(self.n_tables, self.n_bits, self.probes, self.seed)
+        vectors = vectors.tocsr()
+        codes = np.empty((vectors.shape[0], self.n_tables), dtype=np.int64)
+        codes[:len(self.codes)] = self.codes
+        rows = np.union1d(np.asarray(rows, dtype=np.int64), np.arange(len(self.codes), vectors.shape[0]))
+        if len(rows):
+            codes[rows] = updated.hash(vectors[rows])
+        updated._index(vectors, codes)
+        return updated
+
+    def hash(self, vectors):
+        """Коды корзин строк vectors: массив (строки, n_tables)"""
+        weights = np.int64(1) << np.arange(self.n_bits, dtype=np.int64)
+        codes = np.empty((vectors.shape[0], self.n_tables), dtype=np.int64)
+        for row_start in range(0, vectors.shape[0], self.BLOCK_SIZE):
+            projected = self._project(vectors[row_start:row_start + self.BLOCK_SIZE])
+            bits = (projected > 0).reshape(-1, self.n_tables, self.n_bits)
+            codes[row_start:row_start + len(bits)] = bits.astype(np.int64) @ weights
+        return codes
+
+    def _project(self, vectors):
+        # Проекции строк на все гиперплоскости, по блокам признаков
+        n_features = vectors.shape[1]
+        projected = np.zeros((vectors.shape[0], self.n_tables * self.n_bits), dtype=np.float32)
+        for start in range(0, n_features, self.BLOCK_SIZE):
+            projected += np.asarray(vectors[:, start:start + self.BLOCK_SIZE] @ self._planes(start, n_features))
+        return projected
+
+    def candidates(self, row):
+        """Номера строк из корзин строки row (без повторов, включая ее саму)"""
+        found = []
+        for table in range(self.n_tables):
+            column = self._sorted_codes[:, table]
+            probes = self.codes[row, table] ^ self._masks
+            starts = np.searchsorted(column, probes, side='left')
+            stops = np.searchsorted(column, probes, side='right')
+            found.extend(self._order[start:stop, table] for start, stop in zip(starts, stops) if stop > start)
+        return np.unique(np.concatenate(found))
+
+    def query(self, row, k):
+        """
+        До k приближенно ближайших строк к строке row с положительной схожестью
+
+        Returns:
+            (номера строк, схожести) по убыванию схожести, без самой строки
+        """
+        rows = self.candidates(row)
+        rows = rows[rows != row]
+        if not len(rows):
+            return rows, np.empty(0)
+        similarity = (self.vectors[rows] @ self.vectors[row].T).toarray().ravel()
+        keep = similarity > 0
+        rows, similarity = rows[keep], similarity[keep]
+        if k < len(rows):
+            top = np.argpartition(-similarity, k - 1)[:k]
+            rows, similarity = rows[top], similarity[top]
+        order = np.argsort(-similarity, kind='stable')
+        return rows[order], similarity[order]
+
+    def neighbors(self, k):
+        """Приближенные top-k соседей всех строк: CSR (строки x строки)"""
+        n_rows = self.vectors.shape[0]
+        rows, cols, values = [], [], []
+        for row in range(n_rows):
+            neighbors, similarity = self.query(row, k)
+            rows.append(np.full(len(neighbors), row))
+            cols.append(neighbors)
+            values.append(similarity)
+        if not n_rows:
+            return sparse.csr_matrix((0, 0))
+        return sparse.csr_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(n_rows, n_rows)
+        )
+
+    def _planes(self, start, n_features):
+        # Гиперплоскости для признаков [start, start + BLOCK_SIZE) - одни и те же при каждом вызове
+        rng = np.random.default_rng((self.seed, start))
+        size = min(self.BLOCK_SIZE, n_features - start)
+        return rng.standard_normal((size, self.n_tables * self.n_bits), dtype=np.float32)
+
+    def _index(self, vectors, codes):
+        # Для каждой таблицы строки упорядочены по коду: корзина - отрезок, ищется бинарным поиском
+        self.vectors = vectors
+        self.codes = codes
+        self._order = np.argsort(codes, axis=0, kind='stable')
+        self._sorted_codes = np.take_along_axis(codes, self._order, axis=0)
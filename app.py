@@ -1,7 +1,8 @@
-from flask import Flask, request, jsonify, session, render_template, send_from_directory, redirect, url_for
+from flask import Flask, request, jsonify, session, render_template, send_from_directory, redirect, url_for, g, make_response
 from werkzeug.security import generate_password_hash, check_password_hash
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError
 from flask_cors import CORS
 import uuid
 import os
@@ -11,14 +12,25 @@ from werkzeug.utils import secure_filename
 import time
 from functools import wraps
 from recommendation_system import RecommendationSystem
+from recommender_updater import RecommenderUpdater
+from db_pool import get_pool
+from promotion_index import promotion_index
+from catalog_cache import catalog_cache
+from recommendation_cache import recommendation_cache
+from price_forecast import price_forecaster
+from activity_logger import activity_logger
+from stock_reservation import InsufficientStockError, StockConflictError, reserve_stock, run_in_transaction
+from pagination import (NEXT_CURSOR_HEADER, PaginationError, cursor_datetime, cursor_decimal, cursor_int,
+                        cursor_str, decode_cursor, encode_cursor, parse_date_range, parse_limit, parse_number)
 from datetime import datetime, timezone
+from price_prediction import forecast_dates
 
 # Загрузка переменных окружения
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = str(uuid.uuid4())
-CORS(app)
+CORS(app, expose_headers=[NEXT_CURSOR_HEADER])
 
 
 # Декоратор для проверки прав администратора
@@ -75,20 +87,27 @@ def upload_file():
     return jsonify({'error': 'File type not allowed'}), 400
 
 
-# Функция для создания соединения с базой данных
+# Соединение с базой данных на время запроса (берется из общего пула)
 def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME", "alcohol_shop"),
-            user=os.getenv("DB_USER", "postgres"),
-            password=os.getenv("DB_PASSWORD", "123"),
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432")
-        )
-        return conn
-    except psycopg2.Error as e:
-        app.logger.error(f"Failed to connect to database: {e}")
-        raise
+    if 'db_conn' not in g:
+        try:
+            g.db_conn = get_pool().getconn()
+        except (psycopg2.Error, PoolError) as e:
+            app.logger.error(f"Failed to connect to database: {e}")
+            raise
+    return g.db_conn
+
+
+# Возврат соединения запроса в пул (незавершенная транзакция откатывается)
+def release_db_connection():
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        get_pool().putconn(conn)
+
+
+@app.teardown_appcontext
+def teardown_db_connection(exception):
+    release_db_connection()
 
 
 # Маршрут для рендеринга index.html
@@ -127,20 +146,14 @@ def admin_panel():
 
 
 # Вспомогательная функция для логирования активности
-def log_user_activity(user_id, action_type, action_details=None):
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "INSERT INTO user_activity (user_id, action_type, action_details) VALUES (%s, %s, %s)",
-                (user_id, action_type, action_details)
-            )
-            conn.commit()
-    except psycopg2.Error as e:
-        app.logger.error(f"Failed to log user activity: {e}")
-        raise
-    finally:
-        conn.close()
+# По умолчанию событие ставится в очередь и записывается фоновым потоком пачками.
+# Для событий аудита передается cursor: запись идет в транзакции вызывающего
+# и фиксируется или откатывается вместе с ней.
+def log_user_activity(user_id, action_type, action_details=None, cursor=None):
+    if cursor is not None:
+        activity_logger.write(cursor, user_id, action_type, action_details)
+    else:
+        activity_logger.log(user_id, action_type, action_details)
 
 
 # Регистрация пользователя
@@ -185,7 +198,7 @@ def register():
         app.logger.error(f"Failed to register user: {e}")
         return jsonify({'error': 'Registration failed'}), 500
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Авторизация пользователя
@@ -212,7 +225,7 @@ def login():
 
             return jsonify({'message': 'Logged in', 'user_id': user['id'], 'role': user['role']}), 200
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Выход из системы
@@ -229,26 +242,152 @@ def logout():
     return jsonify({'message': 'Logged out'}), 200
 
 
+# Кэширование ответов на чтение каталога
+# Ключ - путь и параметры запроса (для цен со скидками еще и поколение акций),
+# записи сбрасываются при изменении каталога через catalog_cache.bump(),
+# а при изменении остатков - только ответы с затронутыми товарами
+# (обработчик перечисляет их в g.catalog_product_ids).
+# Ответ получает сильный ETag и Last-Modified, поэтому браузер и обратный
+# прокси получают 304 на повторные условные запросы.
+def catalog_cached(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        if request.args.get('with_discounts', '0').lower() in ('1', 'true', 'yes'):
+            # Соединение берется из пула, только если индекс акций нужно перечитать
+            key += (promotion_index.current(get_db_connection).generation,)
+
+        version = catalog_cache.version
+        entry = catalog_cache.get(key)
+        if entry is None:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            headers = {name: response.headers[name] for name in (NEXT_CURSOR_HEADER,) if name in response.headers}
+            entry = catalog_cache.put(version, key, response.get_data(), response.mimetype, headers,
+                                      g.get('catalog_product_ids', ()), g.get('catalog_stock_filtered', False))
+
+        response = app.response_class(entry.body, mimetype=entry.mimetype, headers=entry.headers)
+        response.set_etag(entry.etag)
+        response.last_modified = entry.last_modified
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+        if response.status_code == 304:
+            catalog_cache.record_not_modified()
+        return response
+    return decorated_function
+
+
+# Ответ со страницей выборки: тело - список, курсор следующей страницы - в заголовке
+def paginated_response(rows, next_cursor):
+    response = jsonify(rows)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
+
+
+# Ключи сортировки каталога: столбец и направление; вторым ключом всегда идет id,
+# поэтому порядок однозначен и подходит для keyset-пагинации
+PRODUCT_SORTS = {
+    'id': ('id', 'ASC', 'integer'),
+    'newest': ('id', 'DESC', 'integer'),
+    'price': ('price', 'ASC', 'numeric'),
+    '-price': ('price', 'DESC', 'numeric'),
+    'name': ('name', 'ASC', 'text'),
+    '-name': ('name', 'DESC', 'text'),
+}
+
+# Разбор значения ключа сортировки из курсора по типу столбца
+CURSOR_VALUE_PARSERS = {'integer': cursor_int, 'numeric': cursor_decimal, 'text': cursor_str}
+
+
+# Страница каталога с фильтрами из параметров запроса:
+# category_id, brand_id, min_price/max_price, min_strength/max_strength,
+# min_volume/max_volume, in_stock, sort, limit и cursor
+def fetch_products_page(cursor):
+    args = request.args
+    sort = args.get('sort', 'id')
+    if sort not in PRODUCT_SORTS:
+        raise PaginationError(f"sort must be one of: {', '.join(PRODUCT_SORTS)}")
+    column, direction, sql_type = PRODUCT_SORTS[sort]
+    limit = parse_limit(args.get('limit'))
+    after = decode_cursor(args.get('cursor'),
+                          {'sort': cursor_str, 'value': CURSOR_VALUE_PARSERS[sql_type], 'id': cursor_int})
+    if after and after['sort'] != sort:
+        raise PaginationError('Cursor does not match sort')
+
+    # Decimal, а не float: сравнение numeric со float8 не использует индекс
+    filters = [
+        ('p.category_id = %s', parse_number(args.get('category_id'), 'category_id', int)),
+        ('p.brand_id = %s', parse_number(args.get('brand_id'), 'brand_id', int)),
+        ('p.price >= %s', parse_number(args.get('min_price'), 'min_price', Decimal)),
+        ('p.price <= %s', parse_number(args.get('max_price'), 'max_price', Decimal)),
+        ('p.strength >= %s', parse_number(args.get('min_strength'), 'min_strength', Decimal)),
+        ('p.strength <= %s', parse_number(args.get('max_strength'), 'max_strength', Decimal)),
+        ('p.volume >= %s', parse_number(args.get('min_volume'), 'min_volume', int)),
+        ('p.volume <= %s', parse_number(args.get('max_volume'), 'max_volume', int)),
+    ]
+    conditions = [condition for condition, value in filters if value is not None]
+    params = [value for _, value in filters if value is not None]
+    if args.get('in_stock', '0').lower() in ('1', 'true', 'yes'):
+        conditions.append('p.stock > 0')
+    if after:
+        comparison = '>' if direction == 'ASC' else '<'
+        if column == 'id':
+            conditions.append(f'p.id {comparison} %s')
+            params.append(after['id'])
+        else:
+            conditions.append(f'(p.{column}, p.id) {comparison} (%s::{sql_type}, %s)')
+            params.extend([after['value'], after['id']])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order_by = f'p.id {direction}' if column == 'id' else f'p.{column} {direction}, p.id {direction}'
+
+    cursor.execute(f"""
+        SELECT p.*, c.name as category_name, b.name as brand_name
+        FROM products p
+        JOIN categories c ON p.category_id = c.id
+        JOIN brands b ON p.brand_id = b.id
+        {where}
+        ORDER BY {order_by}
+        LIMIT %s
+    """, params + [limit + 1])
+    products = cursor.fetchall()
+
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor({'sort': sort, 'value': last[column], 'id': last['id']})
+    return products, next_cursor
+
+
 # Получение списка товаров
+# С параметром with_discounts=1 для каждого товара возвращается лучшая активная скидка
+# из индекса акций, без отдельных запросов на каждый товар
 @app.route('/api/products', methods=['GET'])
+@catalog_cached
 def get_products():
+    with_discounts = request.args.get('with_discounts', '0').lower() in ('1', 'true', 'yes')
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT p.*, c.name as category_name, b.name as brand_name
-                FROM products p
-                JOIN categories c ON p.category_id = c.id
-                JOIN brands b ON p.brand_id = b.id
-            """)
-            products = cursor.fetchall()
-            return jsonify(products), 200
+            products, next_cursor = fetch_products_page(cursor)
+            g.catalog_product_ids = [product['id'] for product in products]
+            g.catalog_stock_filtered = request.args.get('in_stock', '0').lower() in ('1', 'true', 'yes')
+            if with_discounts:
+                promotions = promotion_index.current(conn)
+                for product in products:
+                    product['discount_percent'] = promotions.discount_for(product['id'], product['category_id'])
+            return paginated_response(products, next_cursor)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Получение данных о товаре
 @app.route('/api/products/<int:product_id>', methods=['GET'])
+@catalog_cached
 def get_product(product_id):
     conn = get_db_connection()
     try:
@@ -263,13 +402,15 @@ def get_product(product_id):
             product = cursor.fetchone()
             if not product:
                 return jsonify({'error': 'Product not found'}), 404
+            g.catalog_product_ids = [product_id]
             return jsonify(product), 200
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Получение списка брендов
 @app.route('/api/brands', methods=['GET'])
+@catalog_cached
 def get_brands():
     conn = get_db_connection()
     try:
@@ -278,7 +419,7 @@ def get_brands():
             brands = cursor.fetchall()
             return jsonify(brands), 200
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Добавление нового бренда
@@ -301,12 +442,13 @@ def add_brand():
             )
             brand_id = cursor.fetchone()[0]
             conn.commit()
+            catalog_cache.bump()
             return jsonify({'message': 'Brand added successfully', 'id': brand_id}), 201
     except Exception as e:
         conn.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Обновление маршрута добавления товара
@@ -344,12 +486,23 @@ def add_product():
                 (name, category_id, brand_id, price, volume, strength, stock, image_url)
             )
             conn.commit()
+            catalog_cache.bump()
             return jsonify({'message': 'Product added successfully'}), 201
     except Exception as e:
         conn.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        release_db_connection()
+
+
+# Расчет цен позиций корзины по активным акциям
+def price_cart_items(conn, cart_items):
+    return promotion_index.current(conn).pricing.price_cart(
+        [item['product_id'] for item in cart_items],
+        [item['category_id'] for item in cart_items],
+        [item['price'] for item in cart_items],
+        [item['quantity'] for item in cart_items]
+    )
 
 
 # Добавление товара в корзину
@@ -398,9 +551,8 @@ def add_to_cart():
                 )
                 cart_id = cursor.fetchone()['id']
 
-            log_user_activity(session['user_id'], 'add_to_cart', f'Added product_id: {product_id} ({product["name"]})')
-
             conn.commit()
+            log_user_activity(session['user_id'], 'add_to_cart', f'Added product_id: {product_id} ({product["name"]})')
             app.logger.info(f'Cart updated successfully. Cart item id: {cart_id}')
             return jsonify({'message': 'Added to cart', 'cart_id': cart_id}), 201
     except Exception as e:
@@ -408,7 +560,7 @@ def add_to_cart():
         app.logger.error(f"Failed to add to cart: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Получение содержимого корзины
@@ -428,90 +580,33 @@ def get_cart():
             """, (session['user_id'],))
             cart_items = cursor.fetchall()
 
-            # --- Расчет цен с учетом скидок в корзине ---
-            processed_cart_items = []
             # Если корзина пуста, возвращаем пустой список
             if not cart_items:
                 return jsonify([]), 200
 
-            # Сначала сгруппируем товары по product_id, чтобы учесть общее количество для акций типа 'N по цене M'
-            items_by_product = {}
-            for item in cart_items:
-                if item['product_id'] not in items_by_product:
-                    items_by_product[item['product_id']] = []
-                items_by_product[item['product_id']].append(item)
-
-            for product_id, items in items_by_product.items():
-                total_quantity = sum(item['quantity'] for item in items)
-                # Предполагаем, что все позиции одного product_id имеют одинаковую базовую цену
-                original_price_per_item = float(items[0]['price'])
-
-                # Поиск активной акции для товара
-                cursor.execute('''
-                    SELECT id, name, discount_percent FROM promotions
-                    WHERE (
-                        (product_id = %s) OR
-                        (id IN (SELECT promotion_id FROM promotion_categories WHERE category_id = %s))
-                    )
-                    AND start_date <= NOW() AND end_date >= NOW()
-                    ORDER BY discount_percent DESC LIMIT 1
-                ''', (product_id, items[0]['category_id']))
-                promo = cursor.fetchone()
-
-                applied_discount_percent = 0
-                total_discount_for_product = 0
-                effective_price_per_item = original_price_per_item
-                promotion_name = None
-
-                if promo:
-                    promotion_name = promo['name']
-                    promo_id = promo['id']
-                    promo_discount_percent = float(promo['discount_percent'])
-
-                    # Специальная логика для акции '3 пива по цене 2'
-                    if promotion_name == '3 пива по цене 2' and product_id == 14 and total_quantity >= 3:
-                        # Скидка применяется к наименее дорогим товарам. В акции 3 по цене 2, один товар бесплатен.
-                        num_free_items = total_quantity // 3
-                        total_discount_for_product = num_free_items * original_price_per_item
-                        # Рассчитываем эффективную цену за единицу для отображения
-                        total_price_for_product_with_discount = (
-                                                                            total_quantity * original_price_per_item) - total_discount_for_product
-                        effective_price_per_item = total_price_for_product_with_discount / total_quantity if total_quantity > 0 else original_price_per_item
-                        applied_discount_percent = (total_discount_for_product / (
-                                                                      total_quantity * original_price_per_item)) * 100 if (
-                                                                                                    total_quantity * original_price_per_item) > 0 else 0
-                        applied_discount_percent = round(applied_discount_percent, 2)
-                    # Добавляем проверку: если это акция '3 по цене 2', не применяем стандартную процентную скидку, если количество меньше 3
-                    elif not (promotion_name == '3 пива по цене 2' and product_id == 14) and promo_discount_percent > 0:
-                        # Для обычных процентных скидок
-                        effective_price_per_item = round(original_price_per_item * (1 - promo_discount_percent / 100),
-                                                         2)
-                        applied_discount_percent = promo_discount_percent
-                        total_discount_for_product = (
-                                                                 original_price_per_item - effective_price_per_item) * total_quantity
-
-                # Добавляем каждую позицию обратно с рассчитанными ценами и скидками
-                for item in items:
-                    processed_cart_items.append({
-                        'id': item['id'],
-                        'product_id': item['product_id'],
-                        'name': item['name'],
-                        'quantity': item['quantity'],
-                        'original_price': original_price_per_item,
-                        'discounted_price': effective_price_per_item,  # Используем эффективную цену за единицу
-                        'price': effective_price_per_item,
-                        # Используем эффективную цену за единицу для отображения итогов
-                        'discount_percent': applied_discount_percent,
-                        'discount_applied_per_item': round((original_price_per_item - effective_price_per_item), 2),
-                        'promotion_name': promotion_name
-                    })
+            # --- Расчет цен с учетом скидок в корзине ---
+            pricing = price_cart_items(conn, cart_items)
+            processed_cart_items = []
+            for i, item in enumerate(cart_items):
+                processed_cart_items.append({
+                    'id': item['id'],
+                    'product_id': item['product_id'],
+                    'name': item['name'],
+                    'quantity': item['quantity'],
+                    'original_price': float(pricing.original_price[i]),
+                    'discounted_price': float(pricing.price[i]),  # Эффективная цена за единицу
+                    'price': float(pricing.price[i]),
+                    'discount_percent': float(pricing.discount_percent[i]),
+                    'discount_applied_per_item': float(pricing.discount_per_item[i]),
+                    'promotion_name': pricing.promotion_names[i]
+                })
 
             return jsonify(processed_cart_items), 200
     except Exception as e:
         app.logger.error(f"Failed to get cart contents: {e}")
         return jsonify({'error': 'Failed to get cart contents'}), 500
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Очистка корзины
@@ -532,7 +627,7 @@ def clear_cart():
         app.logger.error(f"Failed to clear cart: {e}")
         return jsonify({'error': 'Failed to clear cart'}), 500
     finally:
-        conn.close()
+        release_db_connection()
 
 
 @app.route('/api/me', methods=['GET'])
@@ -555,7 +650,7 @@ def me():
                 'is_admin': user['role'] == 'admin'
             })
     finally:
-        conn.close()
+        release_db_connection()
 
 
 @app.route('/api/admin/users', methods=['GET'])
@@ -573,7 +668,7 @@ def get_all_users():
                 u['is_admin'] = (u['role'] == 'admin')
             return jsonify(users)
     finally:
-        conn.close()
+        release_db_connection()
 
 
 @app.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
@@ -608,7 +703,82 @@ def delete_user(user_id):
         app.logger.error(f"Failed to delete user: {e}")
         return jsonify({'error': 'Failed to delete user'}), 500
     finally:
-        conn.close()
+        release_db_connection()
+
+
+ORDER_STATUSES = ('pending', 'paid', 'shipped', 'delivered', 'canceled')
+
+
+# Страница истории заказов вместе с позициями одним запросом
+# Сначала по индексу (created_at, id) выбирается страница заказов, затем позиции
+# только этих заказов собираются в массив через json_agg.
+# Фильтры берутся из параметров запроса: status (через запятую), date_from, date_to,
+# limit и cursor; курсор следующей страницы возвращается вторым значением.
+def fetch_orders_page(cursor, user_id=None, item_discounts=True):
+    limit = parse_limit(request.args.get('limit'))
+    after = decode_cursor(request.args.get('cursor'), {'created_at': cursor_datetime, 'id': cursor_int})
+    date_from, date_to = parse_date_range(request.args.get('date_from'), request.args.get('date_to'))
+    statuses = [s for s in request.args.get('status', '').split(',') if s]
+    if any(s not in ORDER_STATUSES for s in statuses):
+        raise PaginationError(f"status must be one of: {', '.join(ORDER_STATUSES)}")
+
+    conditions = []
+    params = []
+    if user_id is not None:
+        conditions.append("o.user_id = %s")
+        params.append(user_id)
+    if statuses:
+        conditions.append("o.status = ANY(%s)")
+        params.append(statuses)
+    if date_from:
+        conditions.append("o.created_at >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("o.created_at < %s")
+        params.append(date_to)
+    if after:
+        conditions.append("(o.created_at, o.id) < (%s::timestamp, %s)")
+        params.extend([after['created_at'], after['id']])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    discount_field = ", 'discount_applied', oi.discount_applied::text" if item_discounts else ""
+
+    # Суммы отдаются строками, как и Decimal в остальных ответах API
+    cursor.execute(f"""
+        WITH page AS (
+            SELECT o.id, o.user_id, o.total_price, o.delivery_address, o.delivery_method,
+                   o.delivery_cost, o.payment_method, o.status, o.created_at
+            FROM orders o
+            {where}
+            ORDER BY o.created_at DESC, o.id DESC
+            LIMIT %s
+        )
+        SELECT page.id as order_id, page.user_id, u.username, u.email, page.total_price,
+               page.delivery_address, page.delivery_method, page.delivery_cost,
+               page.payment_method, page.status, page.created_at,
+               COALESCE(items.items, '[]'::json) as items
+        FROM page
+        JOIN users u ON page.user_id = u.id
+        LEFT JOIN LATERAL (
+            SELECT json_agg(json_build_object(
+                       'product_id', oi.product_id,
+                       'product_name', p.name,
+                       'quantity', oi.quantity,
+                       'price', oi.price::text{discount_field}
+                   ) ORDER BY oi.id) as items
+            FROM order_items oi
+            JOIN products p ON oi.product_id = p.id
+            WHERE oi.order_id = page.id
+        ) items ON true
+        ORDER BY page.created_at DESC, page.id DESC
+    """, params + [limit + 1])
+    orders = cursor.fetchall()
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        next_cursor = encode_cursor({'created_at': last['created_at'], 'id': last['order_id']})
+    return orders, next_cursor
 
 
 @app.route('/api/admin/orders', methods=['GET'])
@@ -619,31 +789,12 @@ def get_all_orders():
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            # Выбираем заказы вместе с данными пользователя
-            cursor.execute("""
-                SELECT o.id as order_id, o.user_id, u.username, u.email, o.total_price, o.delivery_address,
-                       o.delivery_method, o.delivery_cost, o.payment_method, o.status, o.created_at
-                FROM orders o
-                JOIN users u ON o.user_id = u.id
-                ORDER BY o.created_at DESC
-            """)
-            orders = cursor.fetchall()
-
-            # Для каждого заказа подгружаем позиции заказа
-            for order in orders:
-                cursor.execute("""
-                    SELECT oi.product_id, p.name as product_name, oi.quantity, oi.price
-                    FROM order_items oi
-                    JOIN products p ON oi.product_id = p.id
-                    WHERE oi.order_id = %s
-                """, (order['order_id'],))
-                order_items = cursor.fetchall()
-                order['items'] = order_items
-
-            app.logger.info(f'get_all_orders: Data before jsonify: {orders}') # Лог для проверки данных
-            return jsonify(orders), 200
+            orders, next_cursor = fetch_orders_page(cursor, item_discounts=False)
+            return paginated_response(orders, next_cursor)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Получение заказов текущего пользователя
@@ -655,33 +806,15 @@ def get_user_orders():
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT o.id as order_id, o.total_price, o.delivery_address,
-                       o.delivery_method, o.delivery_cost, o.payment_method, o.status, o.created_at,
-                       u.username, u.email
-                FROM orders o
-                JOIN users u ON o.user_id = u.id
-                WHERE o.user_id = %s
-                ORDER BY o.created_at DESC
-            """, (session['user_id'],))
-            orders = cursor.fetchall()
-
-            for order in orders:
-                cursor.execute("""
-                    SELECT oi.product_id, p.name as product_name, oi.quantity, oi.price, oi.discount_applied
-                    FROM order_items oi
-                    JOIN products p ON oi.product_id = p.id
-                    WHERE oi.order_id = %s
-                """, (order['order_id'],))
-                order_items = cursor.fetchall()
-                order['items'] = order_items
-
-            return jsonify(orders), 200
+            orders, next_cursor = fetch_orders_page(cursor, user_id=session['user_id'])
+            return paginated_response(orders, next_cursor)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(f"Failed to get user orders: {e}")
         return jsonify({'error': 'Failed to get user orders'}), 500
     finally:
-        conn.close()
+        release_db_connection()
 
 
 # Оформление заказа
@@ -698,83 +831,81 @@ def checkout():
     if not delivery_address or not delivery_method or not payment_method:
         return jsonify({'error': 'Missing delivery or payment details'}), 400
 
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT c.quantity, p.id as product_id, p.price, p.name, p.stock, p.category_id
-                FROM cart c
-                JOIN products p ON c.product_id = p.id
-                WHERE c.user_id = %s
-            """, (session['user_id'],))
-            cart_items = cursor.fetchall()
-
-            if not cart_items:
-                return jsonify({'error': 'Cart is empty'}), 400
-
-            # Проверка остатков
-            for item in cart_items:
-                if item['stock'] < item['quantity']:
-                    return jsonify({'error': f'Insufficient stock for {item["name"]}'}), 400
-
-            # --- Применение скидок ---
-            total_price = 0
-            discounted_items = []
-            now = "CURRENT_TIMESTAMP"
-            for item in cart_items:
-                # Поиск активной акции для товара
-                cursor.execute('''
-                    SELECT discount_percent FROM promotions
-                    WHERE (
-                        (product_id = %s) OR
-                        (id IN (SELECT promotion_id FROM promotion_categories WHERE category_id = %s))
-                    )
-                    AND start_date <= NOW() AND end_date >= NOW()
-                    ORDER BY discount_percent DESC LIMIT 1
-                ''', (item['product_id'], item['category_id']))
-                promo = cursor.fetchone()
-                discount_percent = float(promo['discount_percent']) if promo else 0
-                price = float(item['price'])
-                discount_applied = 0
-                if discount_percent > 0:
-                    discount_applied = round(price * discount_percent / 100, 2)
-                    price = round(price - discount_applied, 2)
-                total_price += price * item['quantity']
-                discounted_items.append({
-                    'product_id': item['product_id'],
-                    'quantity': item['quantity'],
-                    'price': price,
-                    'discount_applied': discount_applied
-                })
-
-            delivery_cost = 300.00 if delivery_method == 'courier' else 0.00
-
-            cursor.execute(
-                """
-                INSERT INTO orders (user_id, total_price, delivery_address, delivery_method, delivery_cost, payment_method, status)
-                VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
-                """,
-                (session['user_id'], total_price + delivery_cost, delivery_address, delivery_method, delivery_cost,
-                 payment_method, 'paid')
-            )
-            order_id = cursor.fetchone()['id']
+    user_id = session['user_id']
+    delivery_cost = 300.00 if delivery_method == 'courier' else 0.00
+
+    def place_order(cursor):
+        cursor.execute("""
+            SELECT c.quantity, p.id as product_id, p.price, p.name, p.category_id
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = %s
+        """, (user_id,))
+        cart_items = cursor.fetchall()
+        if not cart_items:
+            return None
+
+        # Блокируем товары и проверяем остатки по суммарному количеству в корзине
+        requested = {}
+        for item in cart_items:
+            requested[item['product_id']] = requested.get(item['product_id'], 0) + item['quantity']
+        locked = reserve_stock(cursor, requested)
+        # Товары, которые этот заказ раскупает полностью
+        sold_out = any(locked[product_id]['stock'] == quantity for product_id, quantity in requested.items())
+
+        # --- Применение скидок (тот же расчет, что и в get_cart) ---
+        pricing = price_cart_items(conn, cart_items)
+        total_price = pricing.total + delivery_cost
+
+        cursor.execute(
+            """
+            INSERT INTO orders (user_id, total_price, delivery_address, delivery_method, delivery_cost, payment_method, status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
+            """,
+            (user_id, total_price, delivery_address, delivery_method, delivery_cost, payment_method, 'paid')
+        )
+        order_id = cursor.fetchone()['id']
+
+        # Все позиции заказа одной вставкой; остатки списывает
+        # statement-level триггер trg_decrease_stock одним UPDATE
+        execute_values(
+            cursor,
+            "INSERT INTO order_items (order_id, product_id, quantity, price, discount_applied) VALUES %s",
+            [(order_id, item['product_id'], item['quantity'], round(float(pricing.price[i]), 2),
+              float(pricing.discount_per_item[i]))
+             for i, item in enumerate(cart_items)],
+            page_size=len(cart_items)
+        )
 
-            for item in discounted_items:
-                cursor.execute(
-                    "INSERT INTO order_items (order_id, product_id, quantity, price, discount_applied) VALUES (%s, %s, %s, %s, %s)",
-                    (order_id, item['product_id'], item['quantity'], item['price'], item['discount_applied'])
-                )
+        log_user_activity(user_id, 'checkout', f'Order placed: order_id {order_id}, total {total_price}', cursor=cursor)
 
-            log_user_activity(session['user_id'], 'checkout',
-                              f'Order placed: order_id {order_id}, total {total_price + delivery_cost}')
+        cursor.execute("DELETE FROM cart WHERE user_id = %s", (user_id,))
+        return order_id, total_price, requested, sold_out
 
-            cursor.execute("DELETE FROM cart WHERE user_id = %s", (session['user_id'],))
-            conn.commit()
-            return jsonify(
-                {'message': 'Заказ оформлен', 'order_id': order_id,
-                 'total_price': str(total_price + delivery_cost)}), 201
+    conn = get_db_connection()
+    try:
+        order = run_in_transaction(conn, place_order)
+        if order is None:
+            return jsonify({'error': 'Cart is empty'}), 400
+        order_id, total_price, requested, sold_out = order
+        # Заказ списал остатки - устарели ответы каталога с этими товарами
+        catalog_cache.invalidate_products(requested, availability_changed=sold_out)
+        # Новые покупки учитываются в рекомендациях фоновым дообучением
+        recommendation_cache.invalidate_user(user_id)
+        recommender_updater.notify()
+        return jsonify(
+            {'message': 'Заказ оформлен', 'order_id': order_id,
+             'total_price': str(total_price)}), 201
+    except InsufficientStockError as e:
+        return jsonify({'error': str(e), 'product_id': e.product_id, 'available': e.available}), 409
+    except StockConflictError as e:
+        app.logger.warning(f"Checkout conflict for user {user_id}: {e}")
+        return jsonify({'error': 'Товар сейчас оформляют другие покупатели, повторите попытку'}), 409
+    except psycopg2.Error as e:
+        app.logger.error(f"Failed to checkout: {e}")
+        return jsonify({'error': 'Checkout failed'}), 500
     finally:
-        conn.close()
+        release_db_connection()
 
 
 @app.route('/api/products/<int:product_id>', methods=['PUT'])
@@ -841,9 +972,12 @@ def update_product(product_id):
                     ''', (name, category[0], brand[0], price, volume, strength, stock, product_id))
 
                 conn.commit()
+                catalog_cache.bump()
+                # Прогноз цены зависит от категории, бренда, объема и крепости
+                price_forecaster.invalidate_product(product_id)
                 return jsonify({'success': True})
         finally:
-            conn.close()
+            release_db_connection()
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -854,36 +988,35 @@ def get_active_promotion():
     category_id = request.args.get('category_id', type=int)
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT discount_percent FROM promotions
-                WHERE (
-                    (product_id = %s) OR
-                    (id IN (SELECT promotion_id FROM promotion_categories WHERE category_id = %s))
-                )
-                AND start_date <= NOW() AND end_date >= NOW()
-                ORDER BY discount_percent DESC LIMIT 1
-            ''', (product_id, category_id))
-            promo = cursor.fetchone()
-            if promo:
-                return jsonify({'discount_percent': float(promo['discount_percent'])})
-            else:
-                return jsonify({})
+        promo = promotion_index.current(conn).best_for(product_id, category_id)
+        if promo:
+            return jsonify({'discount_percent': promo['discount_percent']})
+        else:
+            return jsonify({})
     finally:
-        conn.close()
+        release_db_connection()
 
 
-# Создаем экземпляр системы рекомендаций
+# Создаем экземпляр системы рекомендаций; модель строится в фоне (recommender_updater),
+# до готовности первого среза выдаются популярные товары
 recommender = RecommendationSystem()
+
+# Предвычисленный индекс похожих товаров (строится python item_neighbors.py)
 try:
-    recommender.prepare_data()
-    recommender.compute_similarities()
+    if not recommender.load_neighbor_index(os.getenv("ITEM_NEIGHBORS_PATH", "models/item_neighbors")):
+        app.logger.warning("Item neighbor index not found, similar items are computed in memory")
 except Exception as e:
-    app.logger.error(f"Failed to initialize recommendation system: {e}")
+    app.logger.error(f"Failed to load item neighbor index: {e}")
+
+# Построение модели и дообучение по новым заказам: по расписанию и после оформления заказа
+recommender_updater = RecommenderUpdater(recommender)
+recommender_updater.start()
 
 
 @app.route('/api/recommendations', methods=['GET'])
 def get_recommendations():
+    # В процессах, созданных fork после импорта, поток дообучения запускается здесь
+    recommender_updater.start()
     if 'user_id' not in session:
         # Для неавторизованных пользователей возвращаем популярные товары
         try:
@@ -894,8 +1027,14 @@ def get_recommendations():
             return jsonify([]), 200
 
     try:
-        # Для авторизованных пользователей возвращаем персонализированные рекомендации
-        recommendations = recommender.get_user_recommendations(session['user_id'], 6)
+        # Для авторизованных пользователей возвращаем персонализированные рекомендации;
+        # выдача кэшируется до смены среза модели или заказа пользователя
+        user_id = session['user_id']
+        generation = recommender.generation
+        recommendations = recommendation_cache.get(user_id, 6, generation)
+        if recommendations is None:
+            recommendations = recommender.get_user_recommendations(user_id, 6)
+            recommendation_cache.put(user_id, 6, generation, recommendations)
         return jsonify(recommendations), 200
     except Exception as e:
         app.logger.error(f"Failed to get user recommendations: {e}")
@@ -908,6 +1047,19 @@ def get_recommendations():
             return jsonify([]), 200
 
 
+# Похожие товары
+@app.route('/api/products/<int:product_id>/similar', methods=['GET'])
+def get_similar_products(product_id):
+    limit = min(max(request.args.get('limit', 6, type=int), 1), 50)
+    try:
+        return jsonify(recommender.get_similar_items(product_id, limit)), 200
+    except ValueError:
+        return jsonify([]), 200
+    except Exception as e:
+        app.logger.error(f"Failed to get similar items for product {product_id}: {e}")
+        return jsonify([]), 200
+
+
 # Отмена заказа
 @app.route('/api/orders/<int:order_id>/cancel', methods=['POST'])
 def cancel_order(order_id):
@@ -937,23 +1089,40 @@ def cancel_order(order_id):
             if (now - created_at).total_seconds() > 300:
                 return jsonify({'error': 'Отменить заказ можно только в течение 5 минут после оформления.'}), 400
 
-            cursor.execute("SELECT product_id, quantity FROM order_items WHERE order_id = %s", (order_id,))
-            order_items = cursor.fetchall()
-
-            for item in order_items:
-                cursor.execute(
-                    "UPDATE products SET stock = stock + %s WHERE id = %s",
-                    (item['quantity'], item['product_id'])
-                )
+            # Возвращаем остатки одним запросом, блокируя товары в том же порядке, что и checkout
+            cursor.execute("""
+                SELECT id FROM products
+                WHERE id IN (SELECT product_id FROM order_items WHERE order_id = %s)
+                ORDER BY id
+                FOR UPDATE
+            """, (order_id,))
+            cursor.execute("""
+                UPDATE products p
+                SET stock = p.stock + oi.quantity
+                FROM (
+                    SELECT product_id, SUM(quantity) as quantity
+                    FROM order_items
+                    WHERE order_id = %s
+                    GROUP BY product_id
+                ) oi
+                WHERE p.id = oi.product_id
+                RETURNING p.id, p.stock - oi.quantity AS previous_stock
+            """, (order_id,))
+            restocked = cursor.fetchall()
 
             cursor.execute(
                 "UPDATE orders SET status = %s WHERE id = %s",
                 ('canceled', order_id)
             )
 
-            log_user_activity(session['user_id'], 'cancel_order', f'Cancelled order_id: {order_id}')
+            log_user_activity(session['user_id'], 'cancel_order', f'Cancelled order_id: {order_id}', cursor=cursor)
 
             conn.commit()
+            # Остатки вернулись на склад - устарели ответы каталога с этими товарами
+            catalog_cache.invalidate_products(
+                [row['id'] for row in restocked],
+                availability_changed=any(row['previous_stock'] == 0 for row in restocked)
+            )
             return jsonify({'message': 'Order cancelled successfully'}), 200
 
     except Exception as e:
@@ -961,7 +1130,7 @@ def cancel_order(order_id):
         app.logger.error(f"Failed to cancel order {order_id}: {e}")
         return jsonify({'error': 'Failed to cancel order'}), 500
     finally:
-        conn.close()
+        release_db_connection()
 
 
 @app.route('/api/admin/user-orders-stats', methods=['GET'])
@@ -976,7 +1145,37 @@ def get_user_orders_stats():
             stats = cursor.fetchall()
             return jsonify(stats)
     finally:
-        conn.close()
+        release_db_connection()
+
+
+@app.route('/api/admin/db-pool-stats', methods=['GET'])
+@admin_required
+def get_db_pool_stats():
+    return jsonify(get_pool().stats()), 200
+
+
+@app.route('/api/admin/activity-log-stats', methods=['GET'])
+@admin_required
+def get_activity_log_stats():
+    return jsonify(activity_logger.stats()), 200
+
+
+@app.route('/api/admin/recommender-stats', methods=['GET'])
+@admin_required
+def get_recommender_stats():
+    return jsonify(recommender_updater.stats()), 200
+
+
+@app.route('/api/admin/recommendation-cache-stats', methods=['GET'])
+@admin_required
+def get_recommendation_cache_stats():
+    return jsonify(recommendation_cache.stats()), 200
+
+
+@app.route('/api/admin/catalog-cache-stats', methods=['GET'])
+@admin_required
+def get_catalog_cache_stats():
+    return jsonify(catalog_cache.stats()), 200
 
 
 @app.route('/api/admin/products/<int:product_id>', methods=['DELETE'])
@@ -988,13 +1187,84 @@ def delete_product(product_id):
             # Вызываем хранимую процедуру
             cursor.execute("CALL delete_product(%s)", (product_id,))
             conn.commit()
+            # Акции на удаленный товар теряют product_id (ON DELETE SET NULL)
+            promotion_index.invalidate()
+            catalog_cache.bump()
+            price_forecaster.invalidate_product(product_id)
             return jsonify({'message': 'Product deleted successfully'}), 200
     except Exception as e:
         conn.rollback()
         app.logger.error(f"Failed to delete product: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        release_db_connection()
+
+
+def fetch_price_features(product_id):
+    """Признаки товара для прогноза цены: (category_id, brand_id, volume, strength) или None"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT category_id, brand_id, volume, strength FROM products WHERE id = %s",
+                (product_id,)
+            )
+            return cursor.fetchone()
+    finally:
+        release_db_connection()
+
+
+# Прогноз цены товара на дни вперед; параллельные запросы считаются одним пакетом (price_forecaster)
+@app.route('/api/admin/products/<int:product_id>/price-forecast', methods=['GET'])
+@admin_required
+def get_price_forecast(product_id):
+    days = min(max(request.args.get('days', 1, type=int), 1), 365)
+    start = request.args.get('date')
+    try:
+        start = datetime.strptime(start, '%Y-%m-%d') if start else None
+    except ValueError:
+        return jsonify({'error': 'Дата должна быть в формате YYYY-MM-DD'}), 400
+
+    features = fetch_price_features(product_id)
+    if not features:
+        return jsonify({'error': 'Product not found'}), 404
+    dates = [day.date() for day in forecast_dates(days, start)]
+    try:
+        prices = price_forecaster.forecast(product_id, features, dates)
+    except Exception as e:
+        app.logger.error(f"Failed to forecast price for product {product_id}: {e}")
+        return jsonify({'error': 'Price forecast is unavailable'}), 503
+    return jsonify([
+        {'date': day.isoformat(), 'predicted_price': round(float(price), 2)}
+        for day, price in zip(dates, prices)
+    ]), 200
+
+
+# Лучшие даты для акции: дни с минимальной предсказанной ценой
+@app.route('/api/admin/products/<int:product_id>/promotion-timing', methods=['GET'])
+@admin_required
+def get_promotion_timing(product_id):
+    days = min(max(request.args.get('days', 30, type=int), 1), 365)
+    limit = min(max(request.args.get('limit', 5, type=int), 1), days)
+
+    features = fetch_price_features(product_id)
+    if not features:
+        return jsonify({'error': 'Product not found'}), 404
+    try:
+        best_dates = price_forecaster.best_promotion_dates(product_id, features, days, limit)
+    except Exception as e:
+        app.logger.error(f"Failed to suggest promotion timing for product {product_id}: {e}")
+        return jsonify({'error': 'Price forecast is unavailable'}), 503
+    return jsonify([
+        {'date': item['date'].isoformat(), 'predicted_price': round(item['predicted_price'], 2)}
+        for item in best_dates
+    ]), 200
+
+
+@app.route('/api/admin/price-forecast-stats', methods=['GET'])
+@admin_required
+def get_price_forecast_stats():
+    return jsonify(price_forecaster.stats()), 200
 
 
 if __name__ == '__main__':
@@ -0,0 +1,167 @@
+"""
+Оценка приближенного поиска соседей (RandomProjectionLSH) против точного.
+
+По синтетической истории заказов (без БД) для каждой конфигурации
+LSH (таблицы x биты x соседние корзины) измеряет:
+- recall@K ближайших пользователей и латентность запроса против точной
+  косинусной схожести со всеми пользователями;
+- recall@K соседей товаров и время их построения против top_k_item_neighbors;
+- совпадение рекомендаций get_user_recommendations с рекомендациями по
+  тем же --user-neighbors точным ближайшим пользователям (ошибка самого
+  LSH) и, в строке точного поиска, с точным режимом по всем пользователям
+  с общими товарами (эффект ограничения числа соседей).
+
+Точный режим уже считает схожесть только с пользователями, у которых есть
+общие товары, поэтому выигрыш LSH зависит от структуры данных: на
+случайных корзинах (--segments 0) почти все пользователи - кандидаты,
+с сегментами вкусов кандидатов на порядки меньше.
+
+Запуск: python bench_ann.py --users 100000 --products 5000 --segments 50 --configs 8x8,16x10
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import RandomProjectionLSH
+from bench_recommendations import generate_orders, latency
+from recommendation_system import RecommendationSystem, RecommenderModel, top_k_item_neighbors
+
+
+def exact_user_neighbors(user_vectors, user_idx, k):
+    """Точные top-k пользователей по косинусной схожести (без самого пользователя)"""
+    similarity = (user_vectors @ user_vectors[user_idx].T).toarray().ravel()
+    similarity[user_idx] = 0
+    positive = np.count_nonzero(similarity > 0)
+    return RecommendationSystem._top_k(similarity, min(k, positive))
+
+
+class ExactNeighbors:
+    """Точный поиск с интерфейсом RandomProjectionLSH.query() - эталон для рекомендаций"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def query(self, row, k):
+        rows = exact_user_neighbors(self.vectors, row, k)
+        return rows, (self.vectors[rows] @ self.vectors[row].T).toarray().ravel()
+
+
+def with_user_index(recommender, model, ann, user_ann, user_neighbors):
+    """Рекомендательная система на том же срезе с заданным поиском ближайших пользователей"""
+    recommender = RecommendationSystem(n_neighbors=recommender.n_neighbors, snapshot_path='', ann=ann)
+    recommender.ann_user_neighbors = user_neighbors
+    recommender.model = RecommenderModel(
+        model.user_ids, model.user_index, model.item_ids, model.item_index, model.user_item_matrix,
+        model.counts, model.item_neighbors, model.item_features, model.popular_items, model.item_info,
+        user_vectors=model.user_vectors, ann=ann, user_ann=user_ann)
+    return recommender
+
+
+def recommendations(recommender, user_ids, n):
+    return {user_id: {rec['product_id'] for rec in recommender.get_user_recommendations(user_id, n)}
+            for user_id in user_ids}
+
+
+def overlap(expected, actual):
+    """Средняя доля совпавших рекомендаций"""
+    return float(np.mean([len(expected[user_id] & actual[user_id]) / max(len(expected[user_id]), 1)
+                          for user_id in expected]))
+
+
+def neighbor_recall(expected, actual):
+    """Доля точных соседей, найденных приближенным поиском"""
+    if not len(expected):
+        return 1.0
+    return len(np.intersect1d(expected, actual)) / len(expected)
+
+
+def rows_recall(expected, actual):
+    """Средний recall по строкам двух CSR-матриц соседей"""
+    recalls = [
+        neighbor_recall(expected.indices[expected.indptr[row]:expected.indptr[row + 1]],
+                        actual.indices[actual.indptr[row]:actual.indptr[row + 1]])
+        for row in range(expected.shape[0])
+    ]
+    return float(np.mean(recalls))
+
+
+def parse_configs(value):
+    """'8x12,16x12' -> [(8, 12), (16, 12)]"""
+    return [tuple(int(part) for part in config.split('x')) for config in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--products', type=int, default=3000)
+    parser.add_argument('--items-per-user', type=int, default=20)
+    parser.add_argument('--segments', type=int, default=0,
+                        help='сегментов вкусов в синтетических данных (0 - без структуры)')
+    parser.add_argument('--user-neighbors', type=int, default=100,
+                        help='ближайших пользователей для рекомендаций в приближенном режиме')
+    parser.add_argument('--k', type=int, default=50, help='соседей для recall@K')
+    parser.add_argument('--n', type=int, default=6, help='рекомендаций на пользователя')
+    parser.add_argument('--configs', type=parse_configs, default=parse_configs('8x8,16x10,16x12,32x14'),
+                        help='конфигурации LSH: таблицы x биты через запятую')
+    parser.add_argument('--no-probes', action='store_true', help='не проверять соседние корзины')
+    parser.add_argument('--repeat', type=int, default=200, help='запросов на замер')
+    parser.add_argument('--skip-items', action='store_true', help='не оценивать соседей товаров')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    orders = generate_orders(rng, args.users, args.products, args.items_per_user, args.segments)
+    print(f"Пользователей: {orders['user_id'].nunique()}, товаров: {orders['product_id'].nunique()}, "
+          f"строк заказов: {len(orders)}")
+
+    exact = RecommendationSystem(n_neighbors=args.k, snapshot_path='', ann=False)
+    exact.prepare_from_orders(orders)
+    model = exact.model
+    sample = rng.choice(len(model.user_ids), args.repeat, replace=False)
+    sample_users = model.user_ids[sample]
+
+    expected_users = {idx: exact_user_neighbors(model.user_vectors, idx, args.k) for idx in sample}
+    exact_p50, exact_p95 = latency(lambda idx: exact_user_neighbors(model.user_vectors, idx, args.k), sample)
+    all_users_recs = recommendations(exact, sample_users, args.n)
+    exact_recs = recommendations(
+        with_user_index(exact, model, True, ExactNeighbors(model.user_vectors), args.user_neighbors),
+        sample_users, args.n)
+    if not args.skip_items:
+        started = time.perf_counter()
+        expected_items = top_k_item_neighbors(model.user_item_matrix, args.k)
+        exact_items_time = time.perf_counter() - started
+
+    print(f"{'LSH':<10} {'построение, с':>14} {'recall@K':>9} {'кандидатов':>11} {'p50, мс':>9} {'p95, мс':>9} "
+          f"{'рек.':>6} {'товары recall@K':>16} {'товары, с':>10}")
+    print(f"{'точный':<10} {'':>14} {1.0:>9.3f} {len(model.user_ids):>11} {exact_p50:>9.2f} {exact_p95:>9.2f} "
+          f"{overlap(all_users_recs, exact_recs):>6.3f} {1.0 if not args.skip_items else float('nan'):>16.3f} "
+          f"{exact_items_time if not args.skip_items else float('nan'):>10.2f}")
+
+    for n_tables, n_bits in args.configs:
+        ann = {'n_tables': n_tables, 'n_bits': n_bits, 'probes': not args.no_probes}
+        started = time.perf_counter()
+        index = RandomProjectionLSH(**ann).fit(model.user_vectors)
+        build_time = time.perf_counter() - started
+
+        recall = np.mean([neighbor_recall(expected_users[idx], index.query(idx, args.k)[0]) for idx in sample])
+        candidates = np.mean([len(index.candidates(idx)) for idx in sample])
+        p50, p95 = latency(lambda idx: index.query(idx, args.k), sample)
+
+        # Рекомендации в приближенном режиме на том же срезе
+        approximate = with_user_index(exact, model, ann, index, args.user_neighbors)
+        recs_overlap = overlap(exact_recs, recommendations(approximate, sample_users, args.n))
+
+        items_recall, items_time = float('nan'), float('nan')
+        if not args.skip_items:
+            started = time.perf_counter()
+            actual_items = top_k_item_neighbors(model.user_item_matrix, args.k, ann=ann)
+            items_time = time.perf_counter() - started
+            items_recall = rows_recall(expected_items, actual_items)
+
+        print(f"{f'{n_tables}x{n_bits}':<10} {build_time:>14.2f} {recall:>9.3f} {candidates:>11.0f} "
+              f"{p50:>9.2f} {p95:>9.2f} {recs_overlap:>6.3f} {items_recall:>16.3f} {items_time:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
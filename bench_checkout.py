@@ -0,0 +1,96 @@
+"""
+Замер латентности оформления заказа в зависимости от размера корзины.
+
+Работает с локальной базой из .env (init_db*.sql должны быть применены):
+создает тестового пользователя и товары, наполняет корзину N разными товарами,
+оформляет заказы через Flask test client и в конце удаляет все тестовые данные.
+
+Запуск: python bench_checkout.py --sizes 1 10 50 200 --repeat 20
+"""
+import argparse
+import time
+
+import numpy as np
+from werkzeug.security import generate_password_hash
+
+from app import app
+from db_pool import get_pool
+
+BENCH_USERNAME = 'bench_checkout'
+BENCH_PRODUCT_PREFIX = 'Bench checkout product '
+
+
+def create_products(cursor, count):
+    """Создает count тестовых товаров с большим остатком"""
+    cursor.execute("""
+        INSERT INTO products (category_id, brand_id, name, price, stock)
+        SELECT 1, 1, %s || g, 100.00, 1000000
+        FROM generate_series(1, %s) g
+        RETURNING id
+    """, (BENCH_PRODUCT_PREFIX, count))
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+def ensure_user(cursor):
+    cursor.execute("SELECT id FROM users WHERE username = %s", (BENCH_USERNAME,))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute(
+        "INSERT INTO users (username, password_hash, email) VALUES (%s, %s, %s) RETURNING id",
+        (BENCH_USERNAME, generate_password_hash(BENCH_USERNAME), f'{BENCH_USERNAME}@example.com')
+    )
+    return cursor.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50, 200], help='размеры корзины')
+    parser.add_argument('--repeat', type=int, default=20, help='заказов на каждый размер')
+    args = parser.parse_args()
+
+    with get_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            product_ids = create_products(cursor, max(args.sizes))
+            user_id = ensure_user(cursor)
+        conn.commit()
+
+    client = app.test_client()
+    response = client.post('/api/login', json={'username': BENCH_USERNAME, 'password': BENCH_USERNAME})
+    if response.status_code != 200:
+        raise SystemExit(f"Не удалось войти: {response.get_data(as_text=True)}")
+
+    print(f"{'позиций':>8} {'p50, мс':>9} {'p95, мс':>9}")
+    for size in args.sizes:
+        timings = []
+        for _ in range(args.repeat):
+            with get_pool().connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM cart WHERE user_id = %s", (user_id,))
+                    cursor.executemany(
+                        "INSERT INTO cart (user_id, product_id, quantity) VALUES (%s, %s, 1)",
+                        [(user_id, product_id) for product_id in product_ids[:size]]
+                    )
+                conn.commit()
+
+            started = time.perf_counter()
+            response = client.post('/api/checkout', json={
+                'delivery_address': 'bench', 'delivery_method': 'pickup', 'payment_method': 'card'
+            })
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 201:
+                raise SystemExit(f"Ошибка оформления: {response.get_data(as_text=True)}")
+
+        timings = np.array(timings) * 1000
+        print(f"{size:>8} {np.percentile(timings, 50):>9.2f} {np.percentile(timings, 95):>9.2f}")
+
+    # Удаляем тестовые заказы, товары и пользователя
+    with get_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            cursor.execute("DELETE FROM products WHERE id = ANY(%s)", (product_ids,))
+        conn.commit()
+
+
+if __name__ == '__main__':
+    main()
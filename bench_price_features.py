@@ -0,0 +1,133 @@
+"""
+Бенчмарк подготовки признаков PricePredictor: прежний построчный конвейер
+против векторизованного.
+
+Генерирует историю цен и акций в том виде, в каком ее возвращает БД
+(numeric - Decimal, EXTRACT - Decimal), строит признаки обоими способами,
+сравнивает время и проверяет, что X и y совпадают.
+
+Запуск: python bench_price_features.py --rows 200000 --promotions 500
+"""
+import argparse
+import time
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from price_prediction import HOLIDAYS, PROMO_FEATURES, PricePredictor, cast_numeric
+
+# Столбцы numeric в запросах prepare_data
+PRICE_NUMERIC = ['price', 'strength', 'month', 'day_of_week']
+PROMO_NUMERIC = ['discount_percent', 'promo_month', 'promo_day']
+
+
+def generate_history(rng, n_rows, n_products, n_promotions):
+    """История цен и акции со столбцами запросов prepare_data"""
+    changed_at = pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 3 * 365 * 24, n_rows), unit='h')
+    product_ids = rng.integers(1, n_products + 1, n_rows)
+    price_data = pd.DataFrame({
+        'id': np.arange(1, n_rows + 1),
+        'product_id': product_ids,
+        'price': [Decimal(f'{p:.2f}') for p in rng.uniform(100, 5000, n_rows)],
+        'changed_at': changed_at,
+        'category_id': product_ids % 20 + 1,
+        'brand_id': product_ids % 200 + 1,
+        'volume': 500,
+        'strength': [Decimal(f'{s:.1f}') for s in rng.uniform(4, 45, n_rows)],
+        'month': [Decimal(m) for m in changed_at.month],
+        # EXTRACT(DOW): 0 - воскресенье
+        'day_of_week': [Decimal(d) for d in (changed_at.dayofweek + 1) % 7],
+    }).sort_values('changed_at', ignore_index=True)
+
+    start = pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 3 * 365, n_promotions), unit='D')
+    promo_data = pd.DataFrame({
+        'product_id': rng.integers(1, n_products + 1, n_promotions),
+        'discount_percent': [Decimal(f'{d:.2f}') for d in rng.uniform(5, 50, n_promotions)],
+        'promo_month': [Decimal(m) for m in start.month],
+        'promo_day': [Decimal(d) for d in (start.dayofweek + 1) % 7],
+    })
+    return price_data, promo_data
+
+
+def legacy_features(price_data, promo_data):
+    """Прежний конвейер: astype(float) с try/except, apply по строкам, iterrows по акциям"""
+    def convert_decimal_to_float(df):
+        for col in df.columns:
+            if df[col].dtype == 'object':
+                try:
+                    df[col] = df[col].astype(float)
+                except:
+                    pass
+        return df
+
+    price_data = convert_decimal_to_float(price_data)
+    if isinstance(price_data['changed_at'].iloc[0], str):
+        price_data['changed_at'] = pd.to_datetime(price_data['changed_at'])
+    price_data = convert_decimal_to_float(price_data)
+    price_data['month_sin'] = np.sin(2 * np.pi * price_data['month'].astype(float) / 12)
+    price_data['month_cos'] = np.cos(2 * np.pi * price_data['month'].astype(float) / 12)
+    price_data['day_sin'] = np.sin(2 * np.pi * price_data['day_of_week'].astype(float) / 7)
+    price_data['day_cos'] = np.cos(2 * np.pi * price_data['day_of_week'].astype(float) / 7)
+    price_data['quarter'] = pd.to_datetime(price_data['changed_at']).dt.quarter
+    price_data['is_weekend'] = price_data['day_of_week'].isin([5, 6]).astype(int)
+    price_data['is_holiday'] = price_data.apply(
+        lambda x: 1 if (x['month'], x['changed_at'].day) in HOLIDAYS else 0,
+        axis=1
+    )
+
+    X = price_data[['category_id', 'brand_id', 'volume', 'strength',
+                    'month_sin', 'month_cos', 'day_sin', 'day_cos',
+                    'quarter', 'is_weekend', 'is_holiday']].copy()
+    for col in PROMO_FEATURES:
+        X[col] = 0
+    if not promo_data.empty:
+        promo_data = convert_decimal_to_float(promo_data)
+        for _, row in promo_data.iterrows():
+            month = int(row['promo_month'])
+            day = int(row['promo_day'])
+            if 1 <= month <= 12:
+                X[f'promo_month_{month}'] = 1
+            if 0 <= day <= 6:
+                X[f'promo_day_{day}'] = 1
+    return X, price_data['price'].astype(float)
+
+
+def vectorized_features(price_data, promo_data):
+    """Новый конвейер: Decimal приводятся один раз, признаки - по столбцам"""
+    price_data = cast_numeric(price_data, PRICE_NUMERIC)
+    promo_data = cast_numeric(promo_data, PROMO_NUMERIC)
+    return PricePredictor().build_training_features(price_data, promo_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='строк истории цен')
+    parser.add_argument('--products', type=int, default=3000)
+    parser.add_argument('--promotions', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    price_data, promo_data = generate_history(rng, args.rows, args.products, args.promotions)
+
+    timings = {}
+    results = {}
+    for name, build in (('прежний', legacy_features), ('векторный', vectorized_features)):
+        started = time.perf_counter()
+        results[name] = build(price_data.copy(), promo_data.copy())
+        timings[name] = time.perf_counter() - started
+
+    print(f"Строк истории цен: {args.rows}, акций: {args.promotions}")
+    for name, elapsed in timings.items():
+        print(f"{name:<10} {elapsed:>8.2f} с")
+    print(f"Ускорение: {timings['прежний'] / timings['векторный']:.0f}x")
+
+    (X_old, y_old), (X_new, y_new) = results['прежний'], results['векторный']
+    pd.testing.assert_frame_equal(X_old, X_new)
+    pd.testing.assert_series_equal(y_old, y_new)
+    print("Признаки совпадают")
+
+
+if __name__ == '__main__':
+    main()
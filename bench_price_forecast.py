@@ -0,0 +1,79 @@
+"""
+Бенчмарк прогноза цен под параллельными запросами: отдельный predict_prices
+на каждый запрос против микропакетов PriceForecaster.
+
+Обучает PricePredictor на синтетической истории (без БД), затем --threads
+потоков запрашивают прогноз на --days дней по всем товарам каталога
+(как панель администратора) - сначала каждый своим вызовом модели, затем
+через PriceForecaster; третий проход повторяет запросы из кэша. Печатает
+время, пропускную способность, число вызовов модели и сверяет цены.
+
+Запуск: python bench_price_forecast.py --products 1000 --days 30 --threads 16
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bench_price_prediction import generate_catalog, train_synthetic
+from price_forecast import PriceForecaster
+from price_prediction import forecast_dates, product_date_batch
+
+
+def run_requests(threads, catalog, request):
+    """Запросы по всем товарам каталога из threads потоков; (цены по товарам, секунды)"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        prices = list(pool.map(request, range(len(catalog))))
+    return np.array(prices), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--threads', type=int, default=16, help='параллельных запросов')
+    parser.add_argument('--window', type=float, default=0.01, help='окно сбора пакета, с')
+    parser.add_argument('--train-rows', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    catalog = generate_catalog(rng, args.products)
+    predictor = train_synthetic(rng, catalog, args.train_rows)
+    dates = [day.date() for day in forecast_dates(args.days)]
+
+    # Прежний путь: модель вызывается на каждый запрос, вызовы конкурируют за ядра
+    lock = threading.Lock()
+    direct_calls = [0]
+
+    def direct(product):
+        with lock:
+            direct_calls[0] += 1
+        return predictor.predict_prices(product_date_batch(catalog[product:product + 1], dates))
+
+    direct_prices, direct_time = run_requests(args.threads, catalog, direct)
+
+    forecaster = PriceForecaster(predictor=predictor, window=args.window)
+    batched_prices, batched_time = run_requests(
+        args.threads, catalog, lambda product: forecaster.forecast(product, catalog[product], dates))
+    batches = forecaster.stats()['batches']
+    _, cached_time = run_requests(
+        args.threads, catalog, lambda product: forecaster.forecast(product, catalog[product], dates))
+
+    if not np.allclose(direct_prices, batched_prices):
+        raise SystemExit("Прогнозы микропакетов расходятся с прямыми вызовами")
+
+    print(f"Товаров: {args.products}, дней: {args.days}, потоков: {args.threads}, окно: {args.window * 1000:.0f} мс")
+    print(f"{'':<14} {'всего, с':>10} {'запросов/с':>12} {'вызовов модели':>16}")
+    for name, elapsed, calls in (('по запросу', direct_time, direct_calls[0]),
+                                 ('микропакеты', batched_time, batches),
+                                 ('из кэша', cached_time, 0)):
+        print(f"{name:<14} {elapsed:>10.2f} {args.products / elapsed:>12.0f} {calls:>16}")
+    print("Прогнозы совпадают")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Бенчмарк предсказания цен: построчный predict_price против пакетного predict_prices.
+
+Обучает PricePredictor на синтетической истории цен (без БД) и измеряет:
+- прежний путь (DataFrame из одной строки и model.predict на каждую пару
+  товар-дата) на выборке пар с пересчетом на весь каталог x дни;
+- predict_prices по всему каталогу x дни;
+- suggest_promotion_timing: 30 построчных вызовов против одного пакета;
+и сверяет предсказания обоих путей.
+
+Запуск: python bench_price_prediction.py --products 3000 --days 365
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from price_prediction import (BASE_FEATURES, BATCH_COLUMNS, HOLIDAYS, PROMO_FEATURES, PricePredictor,
+                              forecast_dates, product_date_batch)
+
+
+def generate_catalog(rng, n_products):
+    """Синтетический каталог: (category_id, brand_id, volume, strength)"""
+    return np.column_stack([
+        rng.integers(1, 21, n_products),
+        rng.integers(1, 201, n_products),
+        rng.choice([330, 500, 700, 750, 1000], n_products),
+        np.round(rng.uniform(4, 45, n_products), 1)
+    ]).astype(float)
+
+
+def train_synthetic(rng, catalog, n_rows):
+    """PricePredictor, обученный на синтетической истории цен со сезонностью"""
+    predictor = PricePredictor()
+    predictor.feature_names = BASE_FEATURES + PROMO_FEATURES
+    products = catalog[rng.integers(0, len(catalog), n_rows)]
+    dates = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 730, n_rows), unit='D')
+    batch = np.column_stack([products, dates.month, dates.weekday, dates.day]).astype(float)
+    base = products[:, 2] / 10 * (1 + products[:, 3] / 20) + products[:, 1]
+    price = base * (1 + 0.1 * np.sin(2 * np.pi * dates.month.to_numpy() / 12)) \
+        * np.where(dates.weekday.isin([5, 6]), 1.05, 1.0) * rng.normal(1, 0.02, n_rows)
+
+    X = pd.DataFrame(predictor.build_features(batch), columns=predictor.feature_names)
+    predictor.model.fit(predictor.scaler.fit_transform(X), price)
+    return predictor
+
+
+def legacy_predict_price(predictor, product_data):
+    """Прежний predict_price: DataFrame из одной строки, признаки по одному"""
+    X = pd.DataFrame(0, index=[0], columns=predictor.feature_names)
+    month = float(product_data['month'])
+    day_of_week = float(product_data['day_of_week'])
+    X['month_sin'] = np.sin(2 * np.pi * month / 12)
+    X['month_cos'] = np.cos(2 * np.pi * month / 12)
+    X['day_sin'] = np.sin(2 * np.pi * day_of_week / 7)
+    X['day_cos'] = np.cos(2 * np.pi * day_of_week / 7)
+    X['quarter'] = int((month - 1) // 3 + 1)
+    X['is_weekend'] = 1 if day_of_week in [5, 6] else 0
+    X['is_holiday'] = 1 if (int(month), datetime.now().day) in HOLIDAYS else 0
+    for key, value in product_data.items():
+        if key in X.columns:
+            X[key] = float(value)
+    return predictor.model.predict(predictor.scaler.transform(X))[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=3000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--train-rows', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=300, help='пар для замера построчного пути')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    catalog = generate_catalog(rng, args.products)
+    started = time.perf_counter()
+    predictor = train_synthetic(rng, catalog, args.train_rows)
+    print(f"Обучение на {args.train_rows} строках: {time.perf_counter() - started:.1f} с")
+
+    # Прогноз на сегодняшнее число, как в прежнем predict_price
+    dates = forecast_dates(args.days)
+    batch = product_date_batch(catalog, dates)
+    batch[:, BATCH_COLUMNS.index('day')] = datetime.now().day
+    total = len(batch)
+
+    sample = rng.choice(total, min(args.sample, total), replace=False)
+    started = time.perf_counter()
+    legacy = [legacy_predict_price(predictor, dict(zip(BATCH_COLUMNS, batch[row]))) for row in sample]
+    per_row = (time.perf_counter() - started) / len(sample)
+
+    started = time.perf_counter()
+    prices = predictor.predict_prices(batch)
+    batch_time = time.perf_counter() - started
+
+    if not np.allclose(prices[sample], legacy):
+        raise SystemExit("Пакетные предсказания расходятся с построчными")
+
+    print(f"Каталог x дни: {args.products} x {args.days} = {total} пар")
+    print(f"{'':<12} {'всего, с':>10} {'пар/с':>12}")
+    print(f"{'построчно':<12} {per_row * total:>10.1f} {1 / per_row:>12.0f}   (оценка по {len(sample)} парам)")
+    print(f"{'пакетно':<12} {batch_time:>10.1f} {total / batch_time:>12.0f}")
+
+    # suggest_promotion_timing: 30 дат одного товара
+    timing_dates = forecast_dates(30)
+    started = time.perf_counter()
+    for date in timing_dates:
+        legacy_predict_price(predictor, dict(zip(BATCH_COLUMNS[:4], catalog[0]),
+                                             month=date.month, day_of_week=date.weekday()))
+    legacy_timing = time.perf_counter() - started
+    started = time.perf_counter()
+    predictor.predict_prices(product_date_batch(catalog[:1], timing_dates))
+    batch_timing = time.perf_counter() - started
+    print(f"suggest_promotion_timing (30 дат): построчно {legacy_timing * 1000:.1f} мс, "
+          f"пакетно {batch_timing * 1000:.1f} мс")
+    print("Предсказания совпадают")
+
+
+if __name__ == '__main__':
+    main()
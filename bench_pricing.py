@@ -0,0 +1,132 @@
+"""
+Бенчмарк движка цен: корзина из 10 000 позиций против тысяч активных акций.
+
+Запуск: python bench_pricing.py --lines 10000 --promotions 5000
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from pricing_engine import PricingEngine
+
+
+def generate_promotions(rng, n_promotions, n_products, n_categories):
+    """Синтетические акции всех типов"""
+    promotions = []
+    for promo_id in range(1, n_promotions + 1):
+        kind = rng.random()
+        promo = {
+            'id': promo_id,
+            'name': f'Акция {promo_id}',
+            'promo_type': 'percentage',
+            'discount_percent': float(rng.integers(5, 50)),
+            'product_id': None,
+            'category_ids': [],
+            'buy_quantity': None,
+            'pay_quantity': None,
+            'bundle_product_ids': []
+        }
+        if kind < 0.5:
+            promo['product_id'] = int(rng.integers(1, n_products + 1))
+        elif kind < 0.65:
+            promo['category_ids'] = [int(c) for c in rng.choice(np.arange(1, n_categories + 1), 2, replace=False)]
+        elif kind < 0.85:
+            buy = int(rng.integers(2, 6))
+            promo.update(promo_type='n_for_m', product_id=int(rng.integers(1, n_products + 1)),
+                         buy_quantity=buy, pay_quantity=buy - 1)
+        else:
+            promo.update(promo_type='bundle',
+                         bundle_product_ids=[int(p) for p in rng.choice(np.arange(1, n_products + 1), 3, replace=False)])
+        promotions.append(promo)
+    return promotions
+
+
+def reference_percent_discount(price, percent):
+    return math.floor(round(price * 100) * percent / 100 + 0.5 + 1e-9) / 100
+
+
+def reference_price_cart(promotions, product_ids, category_ids, prices, quantities):
+    """Построчный расчет на чистом Python с той же семантикой - для сверки"""
+    quantity, price, category = {}, {}, {}
+    for pid, cid, p, q in zip(product_ids, category_ids, prices, quantities):
+        quantity[pid] = quantity.get(pid, 0) + int(q)
+        price[pid] = float(p)
+        category[pid] = int(cid)
+
+    discount = {pid: 0.0 for pid in quantity}
+    for promo in promotions:
+        candidates = []
+        if promo['promo_type'] == 'n_for_m':
+            pid = promo['product_id']
+            if pid in quantity:
+                free = quantity[pid] // promo['buy_quantity'] * (promo['buy_quantity'] - promo['pay_quantity'])
+                candidates.append((pid, free * price[pid]))
+        elif promo['promo_type'] == 'bundle':
+            items = set(promo['bundle_product_ids'])
+            sets = min(quantity.get(pid, 0) for pid in items)
+            if sets > 0:
+                for pid in items:
+                    candidates.append((pid, reference_percent_discount(price[pid], promo['discount_percent']) * sets))
+        else:
+            targets = set()
+            if promo['product_id'] in quantity:
+                targets.add(promo['product_id'])
+            cats = set(promo['category_ids'])
+            targets.update(pid for pid in quantity if category[pid] in cats)
+            for pid in targets:
+                candidates.append((pid, reference_percent_discount(price[pid], promo['discount_percent']) * quantity[pid]))
+        for pid, amount in candidates:
+            discount[pid] = max(discount[pid], amount)
+
+    return round(sum(price[pid] * quantity[pid] - discount[pid] for pid in quantity), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=10000, help='позиций в корзине')
+    parser.add_argument('--products', type=int, default=50000, help='товаров в каталоге')
+    parser.add_argument('--categories', type=int, default=200, help='категорий')
+    parser.add_argument('--promotions', type=int, default=5000, help='активных акций')
+    parser.add_argument('--repeat', type=int, default=20, help='повторов расчета')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    promotions = generate_promotions(rng, args.promotions, args.products, args.categories)
+
+    product_category = rng.integers(1, args.categories + 1, args.products + 1)
+    product_price = np.round(rng.uniform(50, 5000, args.products + 1), 2)
+    product_ids = rng.integers(1, args.products + 1, args.lines)
+    category_ids = product_category[product_ids]
+    prices = product_price[product_ids]
+    quantities = rng.integers(1, 10, args.lines)
+
+    started = time.perf_counter()
+    engine = PricingEngine.from_promotions(promotions)
+    compile_time = time.perf_counter() - started
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        pricing = engine.price_cart(product_ids, category_ids, prices, quantities)
+        timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    expected = reference_price_cart(promotions, product_ids, category_ids, prices, quantities)
+    reference_time = time.perf_counter() - started
+
+    timings = np.array(timings) * 1000
+    print(f"Позиций: {args.lines}, акций: {args.promotions}, правил: {len(engine.rules)}")
+    print(f"Компиляция правил: {compile_time * 1000:.1f} мс")
+    print(f"Расчет корзины: p50 {np.percentile(timings, 50):.2f} мс, "
+          f"p95 {np.percentile(timings, 95):.2f} мс, max {timings.max():.2f} мс")
+    print(f"Построчный расчет на Python: {reference_time * 1000:.1f} мс")
+    print(f"Итого движок: {pricing.total:.2f}, эталон: {expected:.2f}")
+    if abs(pricing.total - expected) > 0.01:
+        raise SystemExit("Итоги движка и эталона расходятся")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Бенчмарк рекомендательной системы: плотная реализация против разреженной.
+
+Строит RecommendationSystem по синтетической истории заказов (без БД) и
+сравнивает его с прежней плотной схемой (pivot_table и полные матрицы
+косинусной схожести пользователей и товаров): время построения, пиковую
+и итоговую память, латентность get_user_recommendations и совпадение выдачи.
+Также проверяет, что дообучение update_from_orders дает те же средние
+покупки и популярность товаров, что и полное построение.
+
+Запуск: python bench_recommendations.py --users 10000 --products 5000
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
+
+from recommendation_system import RecommendationSystem
+
+
+def generate_orders(rng, n_users, n_products, items_per_user, segments=0, affinity=0.8):
+    """
+    Синтетическая история заказов: популярность товаров по закону Ципфа
+
+    При segments > 0 пользователи и товары делятся на сегменты вкусов:
+    доля affinity покупок заменяется товаром своего сегмента с близкой
+    популярностью, так что у пользователей появляются явные соседи.
+    """
+    popularity = 1.0 / np.arange(1, n_products + 1) ** 0.8
+    popularity /= popularity.sum()
+    counts = rng.poisson(items_per_user, n_users).clip(1, n_products)
+    user_ids = np.repeat(np.arange(1, n_users + 1), counts)
+    product_ids = rng.choice(n_products, size=counts.sum(), p=popularity) + 1
+    if segments:
+        own = rng.random(len(product_ids)) < affinity
+        shifted = (product_ids[own] - 1) // segments * segments + user_ids[own] % segments + 1
+        product_ids[own] = np.where(shifted <= n_products, shifted, product_ids[own])
+    orders = pd.DataFrame({
+        'user_id': user_ids,
+        'product_id': product_ids,
+        'quantity': rng.integers(1, 4, len(user_ids))
+    }).drop_duplicates(['user_id', 'product_id'])
+
+    categories = rng.integers(1, 21, n_products + 1)
+    brands = rng.integers(1, 201, n_products + 1)
+    prices = np.round(rng.uniform(50, 5000, n_products + 1), 2)
+    pid = orders['product_id'].to_numpy()
+    orders['created_at'] = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24, len(orders)), unit='h')
+    orders['category_id'] = categories[pid]
+    orders['brand_id'] = brands[pid]
+    orders['volume'] = 500
+    orders['strength'] = 5.0
+    orders['price'] = prices[pid]
+    orders['product_name'] = ['Товар ' + str(p) for p in pid]
+    orders['category_name'] = ['Категория ' + str(c) for c in categories[pid]]
+    orders['brand_name'] = ['Бренд ' + str(b) for b in brands[pid]]
+    return orders
+
+
+class DenseReference:
+    """Прежняя плотная схема: pivot_table и полные матрицы схожести"""
+
+    def __init__(self, orders):
+        matrix = orders.pivot_table(index='user_id', columns='product_id', values='quantity', fill_value=0)
+        self.ratings = matrix.to_numpy(dtype=np.float64)
+        self.item_ids = matrix.columns.to_numpy()
+        self.user_index = {user_id: idx for idx, user_id in enumerate(matrix.index)}
+        self.user_similarity = cosine_similarity(self.ratings)
+        self.item_similarity = cosine_similarity(self.ratings.T)
+
+    def nbytes(self):
+        return self.ratings.nbytes + self.user_similarity.nbytes + self.item_similarity.nbytes
+
+    def scores(self, user_id):
+        user_idx = self.user_index[user_id]
+        similar_users = self.user_similarity[user_idx]
+        return similar_users @ self.ratings / np.abs(similar_users).sum()
+
+    def recommend(self, user_id, n):
+        user_idx = self.user_index[user_id]
+        predictions = self.scores(user_id)
+        predictions[self.ratings[user_idx] > 0] = -np.inf
+        top = np.argpartition(-predictions, n - 1)[:n]
+        return self.item_ids[top[np.argsort(-predictions[top])]]
+
+
+def sparse_nbytes(recommender):
+    total = 0
+    model = recommender.model
+    for matrix in (model.user_item_matrix, model.user_vectors, model.item_neighbors):
+        total += matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return total
+
+
+def measure(build):
+    """Время и пиковая память (по tracemalloc) построения модели"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    model = build()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return model, elapsed, peak
+
+
+def latency(fn, user_ids):
+    timings = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        fn(user_id)
+        timings.append(time.perf_counter() - started)
+    timings = np.array(timings) * 1000
+    return np.percentile(timings, 50), np.percentile(timings, 95)
+
+
+def build_sparse(orders):
+    recommender = RecommendationSystem()
+    recommender.prepare_from_orders(orders)
+    return recommender
+
+
+def check_incremental(orders, share=0.2):
+    """
+    Сверка дообучения с полным построением: модель строится по первым
+    заказам, остальные (доля share) учитываются update_from_orders. Покупки
+    самых редких товаров (последние 5% ID) целиком уходят в новые заказы,
+    чтобы дообучение добавляло и новые товары, а не только новых пользователей.
+    """
+    orders = orders.sort_values('created_at', kind='stable').reset_index(drop=True)
+    orders['order_id'] = orders.index + 1
+    product_ids = np.sort(orders['product_id'].unique())
+    new_items = product_ids[int(len(product_ids) * 0.95):]
+    later = (orders.index >= int(len(orders) * (1 - share))) | orders['product_id'].isin(new_items)
+    incremental = build_sparse(orders[~later])
+    incremental.update_from_orders(orders[later])
+    full = build_sparse(orders)
+
+    def interactions(model):
+        matrix = model.user_item_matrix.tocoo()
+        return pd.Series(matrix.data, index=pd.MultiIndex.from_arrays(
+            [model.user_ids[matrix.row], model.item_ids[matrix.col]])).sort_index()
+
+    actual, expected = incremental.model, full.model
+    pd.testing.assert_series_equal(interactions(actual), interactions(expected))
+    pd.testing.assert_series_equal(actual.popular_items['quantity'].sort_index(),
+                                   expected.popular_items['quantity'].sort_index())
+    print(f"Дообучение на {later.sum()} строках ({len(new_items)} новых товаров) совпадает с полным построением")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--items-per-user', type=int, default=20)
+    parser.add_argument('--n', type=int, default=6, help='рекомендаций на пользователя')
+    parser.add_argument('--repeat', type=int, default=200, help='запросов на замер латентности')
+    parser.add_argument('--skip-dense', action='store_true', help='не строить плотную схему (для больших размеров)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    orders = generate_orders(rng, args.users, args.products, args.items_per_user)
+    print(f"Пользователей: {orders['user_id'].nunique()}, товаров: {orders['product_id'].nunique()}, "
+          f"строк заказов: {len(orders)}")
+
+    check_incremental(orders)
+
+    recommender, sparse_time, sparse_peak = measure(lambda: build_sparse(orders))
+    user_ids = rng.choice(recommender.model.user_ids, args.repeat)
+    sparse_p50, sparse_p95 = latency(lambda u: recommender.get_user_recommendations(u, args.n), user_ids)
+
+    print(f"{'':<12} {'построение, с':>14} {'пик, МБ':>9} {'модель, МБ':>11} {'p50, мс':>9} {'p95, мс':>9}")
+    print(f"{'разреженная':<12} {sparse_time:>14.2f} {sparse_peak / 2**20:>9.0f} "
+          f"{sparse_nbytes(recommender) / 2**20:>11.1f} {sparse_p50:>9.2f} {sparse_p95:>9.2f}")
+    if args.skip_dense:
+        return
+
+    dense, dense_time, dense_peak = measure(lambda: DenseReference(orders))
+    dense_p50, dense_p95 = latency(lambda u: dense.recommend(u, args.n), user_ids)
+    print(f"{'плотная':<12} {dense_time:>14.2f} {dense_peak / 2**20:>9.0f} "
+          f"{dense.nbytes() / 2**20:>11.1f} {dense_p50:>9.2f} {dense_p95:>9.2f}")
+
+    # Сверка: у выданных товаров те же оценки (порядок равных оценок может отличаться)
+    item_pos = {item: pos for pos, item in enumerate(dense.item_ids)}
+    for user_id in user_ids[:20]:
+        expected = dense.scores(user_id)
+        expected_top = np.sort(expected[[item_pos[i] for i in dense.recommend(user_id, args.n)]])
+        actual = [item_pos[rec['product_id']] for rec in recommender.get_user_recommendations(user_id, args.n)]
+        if not np.allclose(np.sort(expected[actual]), expected_top):
+            raise SystemExit(f"Выдача для пользователя {user_id} расходится с плотной схемой")
+    print("Выдача совпадает с плотной схемой")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+
+class CachedResponse:
+    """Готовый ответ каталога: тело, заголовки и валидаторы для условных запросов"""
+
+    __slots__ = ('body', 'mimetype', 'headers', 'etag', 'last_modified', 'expires_at',
+                 'product_ids', 'stock_filtered')
+
+    def __init__(self, body, mimetype, headers, last_modified, expires_at, product_ids=(), stock_filtered=False):
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = headers
+        # Товары в ответе и зависит ли набор товаров от наличия (in_stock)
+        self.product_ids = frozenset(product_ids)
+        self.stock_filtered = stock_filtered
+        # Сильный ETag: хэш тела, одинаковый во всех процессах для одинакового ответа
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+
+class CatalogCache:
+    """
+    Кэш ответов на чтение каталога (товары, бренды).
+
+    Ключ записи включает версию каталога; изменение каталога администратором
+    увеличивает версию через bump(), и старые записи перестают находиться.
+    Заказы и отмены меняют только остатки, поэтому сбрасывают через
+    invalidate_products() лишь ответы с затронутыми товарами (и выборки
+    in_stock, если товар закончился или вернулся в продажу). ttl
+    ограничивает устаревание, если каталог изменили в другом процессе.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        """
+        Args:
+            max_entries: максимум записей (вытесняются давно не использованные)
+            ttl: время жизни записи в секундах
+        """
+        if max_entries is None:
+            max_entries = int(os.getenv("CATALOG_CACHE_SIZE", "1024"))
+        if ttl is None:
+            ttl = float(os.getenv("CATALOG_CACHE_TTL", "60"))
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = 0
+        # Счетчик сбросов по остаткам: ответ, построенный до сброса, не сохраняется
+        self._stock_version = 0
+        self._modified_at = _http_now()
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+        self._invalidations = 0
+
+    @property
+    def version(self):
+        """Версия каталога и остатков, при которой строится ответ (передается в put)"""
+        return self._version, self._stock_version
+
+    @property
+    def modified_at(self):
+        """Время последнего изменения каталога (для Last-Modified)"""
+        return self._modified_at
+
+    def bump(self):
+        """Каталог изменился: новая версия, все записи сбрасываются"""
+        with self._lock:
+            self._version += 1
+            self._modified_at = _http_now()
+            self._entries.clear()
+            self._invalidations += 1
+
+    def invalidate_products(self, product_ids, availability_changed=False):
+        """
+        Остатки товаров изменились: сброс ответов, в которые они входят
+
+        Args:
+            product_ids: ID товаров с изменившимся остатком
+            availability_changed: какой-то из товаров закончился или снова
+                появился - сбрасываются и все выборки с фильтром in_stock
+        """
+        product_ids = set(product_ids)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if (availability_changed and entry.stock_filtered)
+                     or not product_ids.isdisjoint(entry.product_ids)]
+            self._stock_version += 1
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._modified_at = _http_now()
+                self._invalidations += 1
+
+    def get(self, key):
+        """Запись для ключа текущей версии или None"""
+        with self._lock:
+            entry = self._entries.get((self._version, key))
+            if entry is None or entry.expires_at <= time.monotonic():
+                self._misses += 1
+                return None
+            self._entries.move_to_end((self._version, key))
+            self._hits += 1
+            return entry
+
+    def put(self, version, key, body, mimetype, headers, product_ids=(), stock_filtered=False):
+        """
+        Сохранение ответа, построенного при версии version
+
+        Если каталог успел измениться, пока ответ строился, запись не
+        сохраняется, но возвращается вызывающему для отдачи клиенту.
+
+        Args:
+            product_ids: товары в ответе (для invalidate_products)
+            stock_filtered: набор товаров выбран по наличию
+        """
+        with self._lock:
+            entry = CachedResponse(body, mimetype, headers, self._modified_at, time.monotonic() + self.ttl,
+                                   product_ids, stock_filtered)
+            if version != (self._version, self._stock_version):
+                return entry
+            self._entries[(self._version, key)] = entry
+            self._entries.move_to_end((self._version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def record_not_modified(self):
+        with self._lock:
+            self._not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'version': self._version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'not_modified': self._not_modified,
+                'invalidations': self._invalidations
+            }
+
+
+def _http_now():
+    # HTTP-даты имеют точность до секунды
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+# Общий кэш каталога процесса
+catalog_cache = CatalogCache()
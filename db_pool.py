@@ -0,0 +1,181 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений с PostgreSQL, общий для всего процесса.
+
+    Поверх ThreadedConnectionPool добавляет ожидание свободного соединения
+    с таймаутом (вместо мгновенного PoolError), проверку соединения при выдаче
+    и метрики: время ожидания, число занятых соединений, события исчерпания пула.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=5.0, healthcheck_interval=30.0, **conn_kwargs):
+        """
+        Args:
+            minconn: минимальное число открытых соединений
+            maxconn: максимальное число соединений
+            timeout: сколько секунд ждать свободное соединение
+            healthcheck_interval: через сколько секунд простоя соединение проверяется через SELECT 1
+            conn_kwargs: параметры psycopg2.connect
+        """
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **conn_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            'checkouts': 0,
+            'in_use': 0,
+            'max_in_use': 0,
+            'exhausted_events': 0,
+            'timeouts': 0,
+            'broken_connections': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def getconn(self):
+        """Выдача проверенного соединения из пула"""
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['exhausted_events'] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise pool.PoolError(f"Нет свободных соединений в пуле за {self.timeout} с")
+        waited = time.monotonic() - started
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['max_in_use'] = max(self._stats['max_in_use'], self._stats['in_use'])
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        return conn
+
+    def _checkout_healthy(self):
+        """Берет соединение из пула, заменяя разорванные"""
+        # Каждое соединение в пуле проверяем не больше одного раза
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            with self._lock:
+                self._stats['broken_connections'] += 1
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        raise pool.PoolError("Не удалось получить рабочее соединение с базой данных")
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        # Соединение долго простаивало - проверяем его запросом
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn):
+        """Возврат соединения в пул с откатом незавершенной транзакции"""
+        close = conn.closed != 0
+        if not close and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: соединение возвращается в пул при выходе"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        """Метрики пула"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['minconn'] = self.minconn
+        stats['maxconn'] = self.maxconn
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Общий пул соединений процесса.
+
+    Создается лениво при первом обращении; после fork (например, в воркерах gunicorn)
+    пул пересоздается, чтобы процессы не делили сокеты.
+    """
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+                healthcheck_interval=float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30")),
+                dbname=os.getenv("DB_NAME", "alcohol_shop"),
+                user=os.getenv("DB_USER", "postgres"),
+                password=os.getenv("DB_PASSWORD", "123"),
+                host=os.getenv("DB_HOST", "localhost"),
+                port=os.getenv("DB_PORT", "5432")
+            )
+            _pool_pid = os.getpid()
+            logger.info("Создан пул соединений: min=%s, max=%s", _pool.minconn, _pool.maxconn)
+    return _pool
@@ -0,0 +1,179 @@
+"""
+Офлайн-оценка рекомендательной системы на истории заказов.
+
+История делится по времени (orders.created_at): модель строится на
+заказах до границы, а проверяется на покупках после нее. Для каждого
+пользователя из обучающей части с новыми покупками в тестовой части
+запрашиваются K рекомендаций каждым методом:
+- user - get_user_recommendations(пользователь);
+- similar - get_similar_items(последний купленный до границы товар);
+- category - get_category_recommendations(любимая категория пользователя);
+- popular - get_popular_recommendations() как базовый уровень.
+
+Отчет: precision@K, recall@K, доля пользователей хотя бы с одним
+попаданием, покрытие каталога (доля товаров, попавших хоть в одну выдачу)
+и перцентили латентности. По умолчанию данные синтетические (БД не нужна),
+--source db читает оплаченные заказы из БД.
+
+Запуск: python evaluate_recommendations.py --users 20000 --products 3000 --segments 30 --k 10
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import RealDictCursor
+
+from bench_recommendations import generate_orders
+from recommendation_system import ORDERS_QUERY, ITEM_COLUMNS, RecommendationSystem
+
+METHODS = ('user', 'similar', 'category', 'popular')
+
+
+def load_orders(source, args):
+    """История заказов со столбцами ORDERS_QUERY: синтетическая или из БД"""
+    if source == 'synthetic':
+        rng = np.random.default_rng(args.seed)
+        return generate_orders(rng, args.users, args.products, args.items_per_user, args.segments)
+
+    recommender = RecommendationSystem(snapshot_path='')
+    conn = recommender.get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(ORDERS_QUERY, (0,))
+            return pd.DataFrame(cursor.fetchall())
+    finally:
+        recommender.release_db_connection(conn)
+
+
+def time_split(orders, test_share):
+    """
+    Деление по времени: последние test_share заказов (по created_at) - тестовые
+
+    Returns:
+        (обучающие строки, тестовые строки, граница)
+    """
+    created_at = pd.to_datetime(orders['created_at'])
+    cutoff = created_at.quantile(1 - test_share)
+    return orders[created_at < cutoff], orders[created_at >= cutoff], cutoff
+
+
+def test_cases(train, test, max_users, rng):
+    """
+    Пользователи для проверки: есть в обучающей части и купили в тестовой
+    что-то новое
+
+    Returns:
+        список (user_id, новые товары, последний товар до границы, любимая категория)
+    """
+    bought = train.groupby('user_id')['product_id'].agg(set)
+    new_items = test.groupby('user_id')['product_id'].agg(set)
+    last_item = train.sort_values('created_at', kind='stable').groupby('user_id')['product_id'].last()
+    favourite_category = train.groupby(['user_id', 'category_id'])['quantity'].sum() \
+        .sort_values(ascending=False, kind='stable').reset_index() \
+        .drop_duplicates('user_id').set_index('user_id')['category_id']
+
+    cases = []
+    for user_id, items in new_items.items():
+        if user_id not in bought.index:
+            continue
+        relevant = items - bought[user_id]
+        if relevant:
+            cases.append((int(user_id), relevant, int(last_item[user_id]), int(favourite_category[user_id])))
+    if max_users and len(cases) > max_users:
+        cases = [cases[i] for i in sorted(rng.choice(len(cases), max_users, replace=False))]
+    return cases
+
+
+def evaluate(recommender, cases, k, n_products):
+    """Метрики и латентность каждого метода по списку test_cases()"""
+    requests = {
+        'user': lambda case: recommender.get_user_recommendations(case[0], k),
+        'similar': lambda case: recommender.get_similar_items(case[2], k),
+        'category': lambda case: recommender.get_category_recommendations(case[3], k),
+        'popular': lambda case: recommender.get_popular_recommendations(k),
+    }
+    report = {}
+    for method in METHODS:
+        precision, recall, hits, timings = [], [], [], []
+        recommended = set()
+        for case in cases:
+            started = time.perf_counter()
+            try:
+                recommendations = requests[method](case)
+            except ValueError:
+                # Товара нет в модели: пустая выдача
+                recommendations = []
+            timings.append(time.perf_counter() - started)
+
+            items = {rec['product_id'] for rec in recommendations}
+            recommended |= items
+            found = len(items & case[1])
+            precision.append(found / k)
+            recall.append(found / len(case[1]))
+            hits.append(found > 0)
+
+        timings = np.array(timings) * 1000
+        report[method] = {
+            f'precision@{k}': float(np.mean(precision)),
+            f'recall@{k}': float(np.mean(recall)),
+            'hit_rate': float(np.mean(hits)),
+            'coverage': len(recommended) / n_products,
+            'p50_ms': float(np.percentile(timings, 50)),
+            'p95_ms': float(np.percentile(timings, 95)),
+            'p99_ms': float(np.percentile(timings, 99)),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', choices=('synthetic', 'db'), default='synthetic')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--products', type=int, default=3000)
+    parser.add_argument('--items-per-user', type=int, default=20, help='позиций заказов на пользователя')
+    parser.add_argument('--segments', type=int, default=30,
+                        help='сегментов вкусов в синтетических данных (0 - без структуры)')
+    parser.add_argument('--test-share', type=float, default=0.2, help='доля последних заказов для проверки')
+    parser.add_argument('--k', type=int, default=10, help='рекомендаций на запрос')
+    parser.add_argument('--max-users', type=int, default=2000, help='пользователей для проверки (0 - все)')
+    parser.add_argument('--ann', action='store_true', help='приближенный поиск соседей (RECOMMENDER_ANN_*)')
+    parser.add_argument('--output', help='сохранить отчет в JSON (для сравнения запусков)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    orders = load_orders(args.source, args)
+    train, test, cutoff = time_split(orders, args.test_share)
+    catalog = orders[ITEM_COLUMNS].drop_duplicates('product_id', keep='last')
+    print(f"Строк заказов: {len(orders)} (обучение {len(train)}, проверка {len(test)}), граница {cutoff}")
+
+    recommender = RecommendationSystem(snapshot_path='', ann=args.ann)
+    started = time.perf_counter()
+    recommender.prepare_from_orders(train, catalog)
+    build_time = time.perf_counter() - started
+
+    cases = test_cases(train, test, args.max_users, np.random.default_rng(args.seed))
+    if not cases:
+        raise SystemExit("Нет пользователей с новыми покупками после границы")
+    report = evaluate(recommender, cases, args.k, len(catalog))
+
+    print(f"Построение: {build_time:.2f} с, пользователей для проверки: {len(cases)}")
+    columns = list(report['user'])
+    print(f"{'метод':<10}" + ''.join(f"{column:>14}" for column in columns))
+    for method, metrics in report.items():
+        print(f"{method:<10}" + ''.join(f"{metrics[column]:>14.4f}" for column in columns))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'args': vars(args),
+                'cutoff': str(cutoff),
+                'build_seconds': build_time,
+                'users': len(cases),
+                'methods': report
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
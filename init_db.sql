@@ -74,6 +74,16 @@ CREATE TABLE products (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Индексы каталога: каждый фильтр /api/products и каждый ключ сортировки
+-- (price, name с добавочным id для keyset-пагинации) опираются на свой индекс
+CREATE INDEX idx_products_category_price_id ON products (category_id, price, id);
+CREATE INDEX idx_products_brand_price_id ON products (brand_id, price, id);
+CREATE INDEX idx_products_price_id ON products (price, id);
+CREATE INDEX idx_products_name_id ON products (name, id);
+CREATE INDEX idx_products_strength ON products (strength);
+CREATE INDEX idx_products_volume ON products (volume);
+CREATE INDEX idx_products_in_stock_price_id ON products (price, id) WHERE stock > 0;
+
 -- Таблица истории цен
 CREATE TABLE price_history (
     id SERIAL PRIMARY KEY,
@@ -134,6 +144,12 @@ CREATE TABLE order_items (
     discount_applied DECIMAL(10,2) DEFAULT 0 CHECK (discount_applied >= 0)
 );
 
+-- Индексы для истории заказов: keyset-пагинация по (created_at, id)
+-- для всех заказов и для заказов одного пользователя, выборка позиций заказа
+CREATE INDEX idx_orders_created_at_id ON orders (created_at DESC, id DESC);
+CREATE INDEX idx_orders_user_created_at_id ON orders (user_id, created_at DESC, id DESC);
+CREATE INDEX idx_order_items_order_id ON order_items (order_id);
+
 -- Таблица отзывов
 CREATE TABLE reviews (
     id SERIAL PRIMARY KEY,
@@ -42,4 +42,85 @@ WHERE name = '3 пива по цене 2' AND product_id = 14;
 
 ALTER TABLE user_activity DROP CONSTRAINT user_activity_action_type_check;
 
-ALTER TABLE user_activity ADD CONSTRAINT user_activity_action_type_check CHECK (action_type IN ('register', 'login', 'add_to_cart', 'checkout', 'logout', 'clear_cart'));
\ No newline at end of file
+ALTER TABLE user_activity ADD CONSTRAINT user_activity_action_type_check CHECK (action_type IN ('register', 'login', 'add_to_cart', 'checkout', 'logout', 'clear_cart'));
+
+-- Типы акций для движка расчета цен (pricing_engine.py):
+-- percentage - процентная скидка на товар (product_id) или на категории (promotion_categories)
+-- n_for_m    - "купи buy_quantity, плати за pay_quantity" на товар product_id
+-- bundle     - процентная скидка на комплект товаров из promotion_products
+ALTER TABLE promotions
+ADD COLUMN promo_type VARCHAR(20) NOT NULL DEFAULT 'percentage' CHECK (promo_type IN ('percentage', 'n_for_m', 'bundle'));
+
+ALTER TABLE promotions
+ADD COLUMN buy_quantity INTEGER CHECK (buy_quantity > 0);
+
+ALTER TABLE promotions
+ADD COLUMN pay_quantity INTEGER CHECK (pay_quantity >= 0);
+
+ALTER TABLE promotions
+ADD CONSTRAINT promotions_n_for_m_check CHECK (
+    promo_type <> 'n_for_m' OR (buy_quantity IS NOT NULL AND pay_quantity IS NOT NULL AND pay_quantity < buy_quantity)
+);
+
+-- Таблица товаров, входящих в комплект (для акций типа bundle)
+CREATE TABLE promotion_products (
+    id SERIAL PRIMARY KEY,
+    promotion_id INTEGER NOT NULL REFERENCES promotions(id) ON DELETE CASCADE,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    UNIQUE (promotion_id, product_id)
+);
+
+UPDATE promotions
+SET promo_type = 'n_for_m', buy_quantity = 3, pay_quantity = 2
+WHERE name = '3 пива по цене 2' AND product_id = 14;
+
+-- Списание остатков одним запросом на всю вставку в order_items.
+-- Строковый триггер выполнял отдельные SELECT и UPDATE на каждую позицию заказа;
+-- statement-level вариант работает с таблицей переходов new_items.
+DROP TRIGGER IF EXISTS trg_decrease_stock ON order_items;
+
+CREATE OR REPLACE FUNCTION decrease_stock_on_order_items()
+RETURNS TRIGGER AS $$
+DECLARE
+    _missing_product_id INTEGER;
+BEGIN
+    -- Блокируем товары в порядке id, чтобы параллельные заказы не взаимоблокировались
+    PERFORM 1 FROM products
+    WHERE id IN (SELECT product_id FROM new_items)
+    ORDER BY id
+    FOR UPDATE;
+
+    WITH requested AS (
+        SELECT product_id, SUM(quantity) AS quantity
+        FROM new_items
+        GROUP BY product_id
+    ),
+    updated AS (
+        UPDATE products p
+        SET stock = p.stock - r.quantity
+        FROM requested r
+        WHERE p.id = r.product_id AND p.stock >= r.quantity
+        RETURNING p.id
+    )
+    SELECT r.product_id INTO _missing_product_id
+    FROM requested r
+    WHERE r.product_id NOT IN (SELECT id FROM updated)
+    ORDER BY r.product_id
+    LIMIT 1;
+
+    -- Проверяем, достаточно ли товара на складе
+    IF _missing_product_id IS NOT NULL THEN
+        RAISE EXCEPTION 'Недостаточно товара на складе для product_id = %', _missing_product_id
+            USING ERRCODE = 'check_violation', CONSTRAINT = 'products_stock_check', TABLE = 'products',
+                  DETAIL = format('product_id = %s', _missing_product_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_decrease_stock
+AFTER INSERT ON order_items
+REFERENCING NEW TABLE AS new_items
+FOR EACH STATEMENT
+EXECUTE FUNCTION decrease_stock_on_order_items();
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Веса признаков для похожести по описанию товара (внутри одной категории)
+CONTENT_WEIGHTS = {'brand': 0.5, 'volume': 0.25, 'strength': 0.25}
+
+
+class ItemNeighborIndex:
+    """
+    Предвычисленные top-K соседи каждого товара.
+
+    Хранится тремя массивами: отсортированные product_ids (n), neighbor_ids
+    (n x K, пустые места заполнены -1) и scores (n x K, float32). Массивы
+    сохраняются в .npy и открываются через mmap, поэтому загрузка при старте
+    приложения не читает файл целиком, а поиск соседей - бинарный поиск
+    строки и чтение K значений.
+    """
+
+    FILES = ('product_ids', 'neighbor_ids', 'scores')
+
+    def __init__(self, product_ids, neighbor_ids, scores, meta=None):
+        self.product_ids = product_ids
+        self.neighbor_ids = neighbor_ids
+        self.scores = scores
+        self.meta = meta or {}
+
+    @property
+    def k(self):
+        return self.neighbor_ids.shape[1]
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def neighbors(self, product_id, n):
+        """
+        До n соседей товара по убыванию схожести: список (product_id, score) или None
+
+        Args:
+            product_id: ID товара
+            n: количество соседей (не больше K)
+        """
+        row = np.searchsorted(self.product_ids, product_id)
+        if row >= len(self.product_ids) or self.product_ids[row] != product_id:
+            return None
+        ids = self.neighbor_ids[row, :n]
+        scores = self.scores[row, :n]
+        valid = ids >= 0
+        return list(zip(ids[valid].tolist(), scores[valid].tolist()))
+
+    @classmethod
+    def build(cls, recommender, k):
+        """
+        Построение индекса по обученной RecommendationSystem
+
+        Для товаров с историей заказов соседи берутся из коллаборативной
+        схожести (item_neighbors текущего среза модели), для остальных товаров каталога -
+        по описанию (категория, бренд, объем, крепость).
+
+        Args:
+            recommender: RecommendationSystem после prepare_data()
+            k: сколько соседей хранить для каждого товара
+        """
+        model = recommender.model
+        catalog_ids = model.catalog['product_id'].to_numpy(dtype=np.int64) \
+            if model.catalog is not None else np.empty(0, dtype=np.int64)
+        product_ids = np.union1d(model.item_ids.astype(np.int64), catalog_ids)
+        neighbor_ids = np.full((len(product_ids), k), -1, dtype=np.int64)
+        scores = np.zeros((len(product_ids), k), dtype=np.float32)
+
+        # Коллаборативные соседи: строки CSR уже содержат top-k по схожести
+        history_rows = np.searchsorted(product_ids, model.item_ids)
+        neighbors = model.item_neighbors
+        for item_idx, row in enumerate(history_rows):
+            start, stop = neighbors.indptr[item_idx], neighbors.indptr[item_idx + 1]
+            values = neighbors.data[start:stop]
+            order = np.argsort(-values, kind='stable')[:k]
+            neighbor_ids[row, :len(order)] = model.item_ids[neighbors.indices[start:stop][order]]
+            scores[row, :len(order)] = values[order]
+
+        # Товары без истории заказов (или без общих покупателей) - соседи по описанию
+        lonely = model.item_ids[np.diff(neighbors.indptr) == 0].astype(np.int64)
+        cold = np.union1d(np.setdiff1d(catalog_ids, model.item_ids), np.intersect1d(lonely, catalog_ids))
+        if len(cold):
+            cold_ids, cold_scores = content_neighbors(model.catalog, cold, k)
+            rows = np.searchsorted(product_ids, cold)
+            neighbor_ids[rows] = cold_ids
+            scores[rows] = cold_scores
+
+        meta = {
+            'k': k,
+            'products': int(len(product_ids)),
+            'with_history': int(len(history_rows)),
+            'content_only': int(len(cold)),
+            'built_at': datetime.now().isoformat(timespec='seconds')
+        }
+        return cls(product_ids, neighbor_ids, scores, meta)
+
+    def save(self, path):
+        """Сохранение массивов в каталог path (по файлу .npy на массив и meta.json)"""
+        os.makedirs(path, exist_ok=True)
+        for name in self.FILES:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Загрузка индекса, сохраненного save()
+
+        Args:
+            path: каталог индекса
+            mmap: открыть массивы через mmap вместо чтения в память
+        """
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None,
+                                allow_pickle=False)
+                  for name in cls.FILES}
+        meta_path = os.path.join(path, 'meta.json')
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        return cls(arrays['product_ids'], arrays['neighbor_ids'], arrays['scores'], meta)
+
+
+def content_neighbors(catalog, product_ids, k):
+    """
+    Соседи товаров по описанию: кандидаты из той же категории, оценка -
+    совпадение бренда и близость объема и крепости
+
+    Args:
+        catalog: DataFrame товаров (product_id, category_id, brand_id, volume, strength)
+        product_ids: товары, для которых нужны соседи
+        k: количество соседей
+
+    Returns:
+        (neighbor_ids, scores) размером len(product_ids) x k, пустые места -1 и 0
+    """
+    ids = catalog['product_id'].to_numpy(dtype=np.int64)
+    categories = catalog['category_id'].to_numpy()
+    brands = catalog['brand_id'].to_numpy()
+    volumes = pd.to_numeric(catalog['volume'], errors='coerce').to_numpy(dtype=np.float64)
+    strengths = pd.to_numeric(catalog['strength'], errors='coerce').to_numpy(dtype=np.float64)
+    volume_scale = _scale(volumes)
+    strength_scale = _scale(strengths)
+
+    position = {product_id: idx for idx, product_id in enumerate(ids)}
+    by_category = {}
+    for idx, category in enumerate(categories):
+        by_category.setdefault(category, []).append(idx)
+    by_category = {category: np.array(rows) for category, rows in by_category.items()}
+
+    neighbor_ids = np.full((len(product_ids), k), -1, dtype=np.int64)
+    scores = np.zeros((len(product_ids), k), dtype=np.float32)
+    for out_row, product_id in enumerate(product_ids):
+        idx = position.get(int(product_id))
+        if idx is None:
+            continue
+        candidates = by_category[categories[idx]]
+        candidates = candidates[candidates != idx]
+        if not len(candidates):
+            continue
+        score = CONTENT_WEIGHTS['brand'] * (brands[candidates] == brands[idx])
+        score += CONTENT_WEIGHTS['volume'] * _closeness(volumes[candidates], volumes[idx], volume_scale)
+        score += CONTENT_WEIGHTS['strength'] * _closeness(strengths[candidates], strengths[idx], strength_scale)
+
+        top = min(k, len(candidates))
+        best = np.argpartition(-score, top - 1)[:top] if top < len(candidates) else np.arange(len(candidates))
+        best = best[np.argsort(-score[best], kind='stable')]
+        neighbor_ids[out_row, :top] = ids[candidates[best]]
+        scores[out_row, :top] = score[best]
+    return neighbor_ids, scores
+
+
+def _scale(values):
+    # Разброс признака по каталогу; 1, если признак не заполнен или постоянен
+    known = values[np.isfinite(values)]
+    return float(known.std()) if len(known) and known.std() > 0 else 1.0
+
+
+def _closeness(values, value, scale):
+    # 1 при равенстве, убывает с разницей; неизвестное значение дает 0
+    closeness = 1.0 / (1.0 + np.abs(values - value) / scale)
+    return np.nan_to_num(closeness, nan=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Построение индекса похожих товаров')
+    parser.add_argument('--output', default=os.getenv("ITEM_NEIGHBORS_PATH", "models/item_neighbors"),
+                        help='каталог для файлов индекса')
+    parser.add_argument('--k', type=int, default=int(os.getenv("RECOMMENDER_ITEM_NEIGHBORS", "50")),
+                        help='соседей на товар')
+    args = parser.parse_args()
+
+    from recommendation_system import RecommendationSystem
+
+    started = time.perf_counter()
+    recommender = RecommendationSystem(n_neighbors=args.k)
+    recommender.prepare_data()
+    index = ItemNeighborIndex.build(recommender, args.k)
+    index.save(args.output)
+    print(f"Индекс сохранен в {args.output}: {index.meta}, {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
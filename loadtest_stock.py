@@ -0,0 +1,132 @@
+"""
+Нагрузочный тест резервирования остатков: много потоков покупают один и тот же товар.
+
+Работает с локальной базой из .env (init_db*.sql должны быть применены).
+Создает товар с остатком --stock и --threads пользователей; каждый поток
+--attempts раз кладет товар в корзину и оформляет заказ. В конце проверяется,
+что продано не больше остатка, остаток в БД сходится с числом заказов
+и ни один запрос не завершился ошибкой 500.
+
+Запуск: python loadtest_stock.py --threads 16 --stock 100 --attempts 20
+"""
+import argparse
+import os
+import threading
+import time
+from collections import Counter
+
+from werkzeug.security import generate_password_hash
+
+# Каждому потоку нужно свое соединение
+os.environ.setdefault("DB_POOL_MAX", "64")
+
+from app import app  # noqa: E402
+from db_pool import get_pool  # noqa: E402
+
+LOADTEST_PREFIX = 'loadtest_stock_'
+
+
+def setup(threads, stock):
+    with get_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO products (category_id, brand_id, name, price, stock)
+                VALUES (4, 2, %s, 150.00, %s) RETURNING id
+            """, (f'{LOADTEST_PREFIX}product', stock))
+            product_id = cursor.fetchone()[0]
+            password_hash = generate_password_hash(LOADTEST_PREFIX)
+            users = []
+            for i in range(threads):
+                username = f'{LOADTEST_PREFIX}{i}'
+                cursor.execute(
+                    "INSERT INTO users (username, password_hash, email) VALUES (%s, %s, %s) RETURNING id",
+                    (username, password_hash, f'{username}@example.com')
+                )
+                users.append((cursor.fetchone()[0], username))
+        conn.commit()
+    return product_id, users
+
+
+def teardown(product_id, users):
+    with get_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE id = ANY(%s)", ([user_id for user_id, _ in users],))
+            cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
+        conn.commit()
+
+
+def buyer(username, product_id, attempts, results, latencies, lock):
+    client = app.test_client()
+    client.post('/api/login', json={'username': username, 'password': LOADTEST_PREFIX})
+    for _ in range(attempts):
+        client.delete('/api/cart')
+        client.post('/api/cart', json={'product_id': product_id, 'quantity': 1})
+        started = time.perf_counter()
+        response = client.post('/api/checkout', json={
+            'delivery_address': 'loadtest', 'delivery_method': 'pickup', 'payment_method': 'card'
+        })
+        elapsed = time.perf_counter() - started
+        with lock:
+            results[response.status_code] += 1
+            latencies.append(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--stock', type=int, default=100)
+    parser.add_argument('--attempts', type=int, default=20, help='попыток покупки на поток')
+    parser.add_argument('--keep', action='store_true', help='не удалять тестовые данные')
+    args = parser.parse_args()
+
+    product_id, users = setup(args.threads, args.stock)
+    results = Counter()
+    latencies = []
+    lock = threading.Lock()
+    workers = [
+        threading.Thread(target=buyer, args=(username, product_id, args.attempts, results, latencies, lock))
+        for _, username in users
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    with get_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT stock FROM products WHERE id = %s", (product_id,))
+            final_stock = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT COALESCE(SUM(oi.quantity), 0) FROM order_items oi
+                JOIN orders o ON o.id = oi.order_id
+                WHERE oi.product_id = %s AND o.status = 'paid'
+            """, (product_id,))
+            sold = cursor.fetchone()[0]
+
+    latencies.sort()
+    print(f"Потоков: {args.threads}, попыток: {args.threads * args.attempts}, за {elapsed:.2f} с")
+    print(f"Ответы: {dict(results)}")
+    print(f"Латентность checkout: p50 {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс")
+    print(f"Начальный остаток: {args.stock}, продано: {sold}, остаток: {final_stock}")
+    print(f"Пул: {get_pool().stats()}")
+
+    if not args.keep:
+        teardown(product_id, users)
+
+    problems = []
+    if results[500]:
+        problems.append("есть ответы 500")
+    if sold > args.stock or final_stock != args.stock - sold:
+        problems.append("остаток не сходится с продажами")
+    if results[201] != sold:
+        problems.append("число успешных заказов не совпадает с продажами")
+    if problems:
+        raise SystemExit("Ошибка: " + ", ".join(problems))
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import joblib
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+CURRENT_FILE = 'CURRENT'
+
+
+class LoadedModel:
+    """Загруженная версия модели: артефакты по именам и manifest"""
+
+    __slots__ = ('name', 'version', 'artifacts', 'manifest')
+
+    def __init__(self, name, version, artifacts, manifest):
+        self.name = name
+        self.version = version
+        self.artifacts = artifacts
+        self.manifest = manifest
+
+
+class ModelRegistry:
+    """
+    Версионированное хранилище артефактов моделей.
+
+    Каждая версия - каталог root/<name>/<version>/ с артефактами joblib
+    и manifest.json:
+    sha256 и размер каждого файла и метаданные обучения. Активная версия
+    записана в root/<name>/CURRENT и меняется атомарно (os.replace), так
+    что публикация или откат не трогают загруженную модель.
+
+    get() держит загруженные версии в памяти процесса, общие для всех
+    экземпляров моделей, и не чаще раза в check_interval секунд сверяет
+    CURRENT: если активна другая версия, она загружается и подменяет
+    прежнюю без перезапуска приложения. mmap здесь не помогает: sklearn
+    копирует узлы деревьев при распаковке. Поэтому модель загружается при
+    импорте приложения (PriceForecaster), и воркеры gunicorn --preload
+    делят ее страницы через copy-on-write, пока версия не сменится.
+    """
+
+    def __init__(self, root=None, keep=None, check_interval=None):
+        """
+        Args:
+            root: каталог реестра
+            keep: сколько последних версий каждой модели хранить
+            check_interval: как часто (в секундах) проверять смену активной версии
+        """
+        self.root = root or os.getenv("MODEL_REGISTRY_PATH", "models/registry")
+        self.keep = keep or int(os.getenv("MODEL_REGISTRY_KEEP", "5"))
+        self.check_interval = check_interval if check_interval is not None \
+            else float(os.getenv("MODEL_REGISTRY_CHECK_INTERVAL", "10"))
+        self._lock = threading.Lock()
+        # Загрузка новой версии выполняется одним потоком
+        self._load_lock = threading.Lock()
+        self._loaded = {}
+        self._checked_at = {}
+        self._swaps = 0
+        self._failed = 0
+
+    def publish(self, name, artifacts, meta=None):
+        """
+        Сохранение новой версии и переключение на нее
+
+        Args:
+            name: имя модели
+            artifacts: словарь имя -> объект (сохраняется в <имя>.joblib)
+            meta: метаданные обучения для manifest
+
+        Returns:
+            имя версии
+        """
+        model_dir = os.path.join(self.root, name)
+        temp_dir = os.path.join(model_dir, f'.tmp-{os.getpid()}-{threading.get_ident()}')
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        try:
+            files = {}
+            for key, value in artifacts.items():
+                filename = f'{key}.joblib'
+                path = os.path.join(temp_dir, filename)
+                joblib.dump(value, path)
+                files[filename] = {'sha256': _sha256(path), 'size': os.path.getsize(path)}
+
+            # Имя версии: время публикации и отпечаток содержимого
+            digest = hashlib.sha256(''.join(files[f]['sha256'] for f in sorted(files)).encode()).hexdigest()
+            created_at = datetime.now()
+            version = f"{created_at:%Y%m%d%H%M%S}-{digest[:8]}"
+            manifest = {
+                'name': name,
+                'version': version,
+                'created_at': created_at.isoformat(timespec='seconds'),
+                'files': files,
+                'meta': meta or {}
+            }
+            with open(os.path.join(temp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+            version_dir = os.path.join(model_dir, version)
+            if os.path.exists(version_dir):
+                # Та же модель уже опубликована в эту секунду
+                shutil.rmtree(temp_dir)
+            else:
+                os.rename(temp_dir, version_dir)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+        self._write_current(name, version)
+        # Опубликовавший процесс уже держит артефакты в памяти
+        with self._lock:
+            self._loaded[name] = LoadedModel(name, version, dict(artifacts), manifest)
+            self._checked_at[name] = time.monotonic()
+        self._prune(name)
+        return version
+
+    def activate(self, name, version):
+        """Переключение на сохраненную версию (например, откат); другие процессы подхватят ее через get()"""
+        self.verify(name, version)
+        self._write_current(name, version)
+
+    def current_version(self, name):
+        """Активная версия модели или None"""
+        try:
+            with open(os.path.join(self.root, name, CURRENT_FILE), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def versions(self, name):
+        """Сохраненные версии модели, от старых к новым"""
+        model_dir = os.path.join(self.root, name)
+        if not os.path.isdir(model_dir):
+            return []
+        return sorted(entry for entry in os.listdir(model_dir)
+                      if os.path.exists(os.path.join(model_dir, entry, MANIFEST_FILE)))
+
+    def manifest(self, name, version):
+        with open(os.path.join(self.root, name, version, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+
+    def verify(self, name, version):
+        """
+        Проверка файлов версии по manifest
+
+        Returns:
+            manifest
+
+        Raises:
+            ValueError: файл отсутствует или контрольная сумма не совпадает
+        """
+        manifest = self.manifest(name, version)
+        version_dir = os.path.join(self.root, name, version)
+        for filename, expected in manifest['files'].items():
+            path = os.path.join(version_dir, filename)
+            if not os.path.exists(path):
+                raise ValueError(f"Версия {name}/{version}: нет файла {filename}")
+            if os.path.getsize(path) != expected['size'] or _sha256(path) != expected['sha256']:
+                raise ValueError(f"Версия {name}/{version}: контрольная сумма {filename} не совпадает")
+        return manifest
+
+    def load(self, name, version=None):
+        """
+        Загрузка версии (по умолчанию активной) после проверки контрольных сумм
+
+        Args:
+            name: имя модели
+            version: версия
+
+        Returns:
+            LoadedModel или None, если версий нет
+        """
+        version = version or self.current_version(name)
+        if version is None:
+            return None
+        manifest = self.verify(name, version)
+        version_dir = os.path.join(self.root, name, version)
+        artifacts = {
+            filename[:-len('.joblib')]: joblib.load(os.path.join(version_dir, filename))
+            for filename in manifest['files']
+        }
+        return LoadedModel(name, version, artifacts, manifest)
+
+    def get(self, name):
+        """
+        Активная версия модели из памяти процесса
+
+        Раз в check_interval секунд сверяет CURRENT и при смене версии
+        загружает новую; пока она загружается, возвращается прежняя.
+
+        Returns:
+            LoadedModel или None, если модель ни разу не публиковалась
+        """
+        now = time.monotonic()
+        with self._lock:
+            loaded = self._loaded.get(name)
+            if loaded is not None and now - self._checked_at.get(name, 0) < self.check_interval:
+                return loaded
+
+        # Новую версию загружает один поток, остальные тем временем работают с прежней
+        if not self._load_lock.acquire(blocking=loaded is None):
+            return loaded
+        try:
+            with self._lock:
+                loaded = self._loaded.get(name)
+                if loaded is not None and now - self._checked_at.get(name, 0) < self.check_interval:
+                    return loaded
+            version = self.current_version(name)
+            if version is not None and (loaded is None or loaded.version != version):
+                try:
+                    fresh = self.load(name, version)
+                except (OSError, ValueError, KeyError) as e:
+                    with self._lock:
+                        self._failed += 1
+                    logger.error("Не удалось загрузить модель %s версии %s: %s", name, version, e)
+                else:
+                    with self._lock:
+                        if loaded is not None:
+                            self._swaps += 1
+                            logger.info("Модель %s: версия %s заменена на %s", name, loaded.version, version)
+                        self._loaded[name] = loaded = fresh
+            with self._lock:
+                self._checked_at[name] = time.monotonic()
+            return loaded
+        finally:
+            self._load_lock.release()
+
+    def stats(self):
+        with self._lock:
+            loaded = {name: model.version for name, model in self._loaded.items()}
+            swaps, failed = self._swaps, self._failed
+        return {
+            'root': self.root,
+            'loaded': loaded,
+            'current': {name: self.current_version(name) for name in loaded},
+            'swaps': swaps,
+            'failed': failed,
+            'check_interval': self.check_interval
+        }
+
+    def _write_current(self, name, version):
+        # Указатель на активную версию заменяется атомарно
+        model_dir = os.path.join(self.root, name)
+        temp_path = os.path.join(model_dir, f'{CURRENT_FILE}.tmp-{os.getpid()}-{threading.get_ident()}')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(temp_path, os.path.join(model_dir, CURRENT_FILE))
+
+    def _prune(self, name):
+        # Старые версии удаляются, активная сохраняется всегда
+        current = self.current_version(name)
+        versions = self.versions(name)
+        for version in versions[:-self.keep]:
+            if version != current:
+                shutil.rmtree(os.path.join(self.root, name, version), ignore_errors=True)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Реестр моделей процесса
+model_registry = ModelRegistry()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Реестр версий моделей')
+    parser.add_argument('command', choices=('list', 'verify', 'activate'))
+    parser.add_argument('name', help='имя модели, например price_predictor')
+    parser.add_argument('version', nargs='?', help='версия (для verify - по умолчанию активная)')
+    args = parser.parse_args()
+
+    current = model_registry.current_version(args.name)
+    if args.command == 'list':
+        for version in model_registry.versions(args.name):
+            manifest = model_registry.manifest(args.name, version)
+            marker = '*' if version == current else ' '
+            print(f"{marker} {version}  {manifest['created_at']}  {json.dumps(manifest['meta'], ensure_ascii=False)}")
+    elif args.command == 'verify':
+        version = args.version or current
+        model_registry.verify(args.name, version)
+        print(f"{args.name}/{version}: файлы совпадают с manifest")
+    else:
+        if not args.version:
+            parser.error("укажите версию")
+        model_registry.activate(args.name, args.version)
+        print(f"{args.name}: активна версия {args.version}")
+
+
+if __name__ == '__main__':
+    main()
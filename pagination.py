@@ -0,0 +1,125 @@
+import base64
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+# Размер страницы по умолчанию и верхняя граница для параметра limit
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Заголовок, в котором клиент получает курсор следующей страницы
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class PaginationError(ValueError):
+    """Некорректные параметры постраничной выборки (limit, cursor, фильтры)"""
+
+
+def encode_cursor(values):
+    """
+    Непрозрачный курсор keyset-пагинации: ключ сортировки последней строки страницы
+
+    Args:
+        values: словарь значений ключа сортировки (datetime сериализуется в ISO)
+    """
+    payload = json.dumps(values, default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, keys):
+    """
+    Разбор курсора, выданного encode_cursor
+
+    Значения проверяются до того, как попадут в SQL: поврежденный или
+    подделанный курсор дает PaginationError (400), а не ошибку БД.
+
+    Args:
+        token: строка курсора из запроса (None - первая страница)
+        keys: обязательные ключи курсора: словарь ключ -> функция разбора
+            значения (cursor_int, cursor_datetime, ...)
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise PaginationError('Invalid cursor') from e
+    if not isinstance(values, dict) or any(key not in values for key in keys):
+        raise PaginationError('Invalid cursor')
+    try:
+        return {key: parse(values[key]) for key, parse in keys.items()}
+    except (ValueError, TypeError, ArithmeticError) as e:
+        raise PaginationError('Invalid cursor') from e
+
+
+def cursor_int(value):
+    """Целое значение курсора (id)"""
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise TypeError(f'expected integer, got {value!r}')
+    return value
+
+
+def cursor_decimal(value):
+    """Значение numeric: encode_cursor сохраняет Decimal строкой"""
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise TypeError(f'expected number, got {value!r}')
+    number = Decimal(value)
+    if not number.is_finite():
+        raise ValueError(f'expected finite number, got {value!r}')
+    return number
+
+
+def cursor_str(value):
+    if not isinstance(value, str):
+        raise TypeError(f'expected string, got {value!r}')
+    return value
+
+
+def cursor_datetime(value):
+    """Момент времени в ISO-формате, как его сохраняет encode_cursor"""
+    return datetime.fromisoformat(cursor_str(value))
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Размер страницы из параметра limit, ограниченный сверху maximum"""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except ValueError as e:
+        raise PaginationError('limit must be an integer') from e
+    if limit < 1:
+        raise PaginationError('limit must be positive')
+    return min(limit, maximum)
+
+
+def parse_number(value, name, cast=float):
+    """Числовой параметр фильтра (None, если параметр не передан)"""
+    if value in (None, ''):
+        return None
+    try:
+        return cast(value)
+    except (ValueError, ArithmeticError) as e:
+        raise PaginationError(f'{name} must be a number') from e
+
+
+def parse_date_range(date_from, date_to):
+    """
+    Границы периода из параметров date_from/date_to (YYYY-MM-DD, обе включительно)
+
+    Возвращает (начало, конец) как datetime, где конец - полночь дня после date_to,
+    чтобы условие created_at < конец захватывало весь последний день.
+    """
+    try:
+        start = datetime.combine(date.fromisoformat(date_from), datetime.min.time()) if date_from else None
+        end = datetime.combine(date.fromisoformat(date_to) + timedelta(days=1), datetime.min.time()) if date_to else None
+    except ValueError as e:
+        raise PaginationError('Dates must be in YYYY-MM-DD format') from e
+    return start, end
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
@@ -0,0 +1,260 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+from dotenv import load_dotenv
+
+from model_registry import model_registry
+from price_prediction import REGISTRY_NAME, PricePredictor, forecast_dates, product_date_batch
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class PendingForecast:
+    """Запрос прогноза в очереди: признаки товара, даты и результат"""
+
+    __slots__ = ('features', 'dates', 'prices', 'version', 'error', 'done')
+
+    def __init__(self, features, dates):
+        self.features = features
+        self.dates = dates
+        self.prices = None
+        self.version = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class PriceForecaster:
+    """
+    Прогноз цен товаров для обработчиков запросов.
+
+    Обработчики не вызывают модель сами: forecast() кладет запрос в очередь
+    и ждет результата, а фоновый поток собирает запросы, пришедшие за окно
+    window секунд (или до max_rows пар товар-дата), и предсказывает их
+    одним вызовом predict_prices. Параллельные запросы панели
+    администратора по разным товарам так обходятся одним model.predict.
+
+    Предсказанные цены кэшируются по (товар, дата) до конца дня: в полночь,
+    при смене версии модели и при изменении товара (invalidate_product)
+    записи сбрасываются. Число товаров в кэше ограничено (вытесняются
+    давно не запрашиваемые).
+    """
+
+    def __init__(self, predictor=None, window=None, max_rows=None, max_products=None, timeout=None):
+        """
+        Args:
+            predictor: PricePredictor (по умолчанию - модель из реестра)
+            window: сколько секунд собирать запросы в пакет
+            max_rows: максимум пар товар-дата в пакете
+            max_products: максимум товаров в кэше
+            timeout: сколько forecast() ждет результата
+        """
+        self.predictor = predictor or PricePredictor()
+        if predictor is None and model_registry.current_version(REGISTRY_NAME) is not None:
+            # Модель загружается при импорте приложения, до fork: воркеры
+            # gunicorn --preload делят ее страницы, а не распаковывают свою копию
+            self.predictor.load_model()
+        self.window = window if window is not None else float(os.getenv("PRICE_FORECAST_WINDOW", "0.01"))
+        self.max_rows = max_rows or int(os.getenv("PRICE_FORECAST_MAX_ROWS", "65536"))
+        self.max_products = max_products or int(os.getenv("PRICE_FORECAST_CACHE_SIZE", "10000"))
+        self.timeout = timeout or float(os.getenv("PRICE_FORECAST_TIMEOUT", "10"))
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        # product_id -> {дата: цена}; кэш действителен для дня _day и версии модели _version
+        self._entries = OrderedDict()
+        self._day = date.today()
+        self._version = None
+        self._hits = 0
+        self._misses = 0
+        self._requests = 0
+        self._batches = 0
+        self._rows = 0
+        self._failed = 0
+        self._evictions = 0
+
+    def forecast(self, product_id, features, dates):
+        """
+        Предсказанные цены товара на даты
+
+        Args:
+            product_id: ID товара
+            features: (category_id, brand_id, volume, strength)
+            dates: даты прогноза (date или datetime)
+
+        Returns:
+            np.ndarray цен в порядке dates
+
+        Raises:
+            TimeoutError: пакет не посчитан за timeout секунд
+            Exception: ошибка модели (например, она не обучена)
+        """
+        days = [value.date() if hasattr(value, 'date') else value for value in dates]
+        prices = np.empty(len(days))
+        missing = []
+        # Версия сверяется с реестром до выдачи из кэша: после горячей подмены
+        # модели цены прежней версии не отдаются
+        version = self.predictor.active_version()
+        with self._lock:
+            self._expire(version)
+            cached = self._entries.get(product_id)
+            if cached is not None:
+                self._entries.move_to_end(product_id)
+            for idx, day in enumerate(days):
+                price = cached.get(day) if cached is not None else None
+                if price is None:
+                    missing.append(idx)
+                else:
+                    prices[idx] = price
+            self._hits += len(days) - len(missing)
+            self._misses += len(missing)
+        if not missing:
+            return prices
+
+        pending = PendingForecast(
+            tuple(float(value) for value in features),
+            [days[idx] for idx in missing]
+        )
+        self._ensure_worker()
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            raise TimeoutError(f"Прогноз цен товара {product_id} не получен за {self.timeout} с")
+        if pending.error is not None:
+            raise pending.error
+
+        prices[missing] = pending.prices
+        with self._lock:
+            # Цены, посчитанные до смены дня или версии модели, не кэшируются
+            if self._day == date.today() and pending.version == self._version:
+                cached = self._entries.setdefault(product_id, {})
+                cached.update(zip(pending.dates, pending.prices.tolist()))
+                self._entries.move_to_end(product_id)
+                while len(self._entries) > self.max_products:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return prices
+
+    def best_promotion_dates(self, product_id, features, days_ahead=30, limit=5):
+        """
+        Даты с минимальными предсказанными ценами (как suggest_promotion_timing)
+
+        Returns:
+            список {'date', 'predicted_price'} по возрастанию цены
+        """
+        dates = [day.date() for day in forecast_dates(days_ahead)]
+        prices = self.forecast(product_id, features, dates)
+        best = np.argsort(prices, kind='stable')[:limit]
+        return [{'date': dates[idx], 'predicted_price': float(prices[idx])} for idx in best]
+
+    def invalidate_product(self, product_id):
+        """Сброс прогнозов товара (например, после изменения его характеристик)"""
+        with self._lock:
+            self._entries.pop(product_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'products': len(self._entries),
+                'max_products': self.max_products,
+                'model_version': self._version,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'requests': self._requests,
+                'batches': self._batches,
+                'rows': self._rows,
+                'avg_batch_requests': self._requests / self._batches if self._batches else 0.0,
+                'failed': self._failed,
+                'queued': self._queue.qsize(),
+                'window': self.window
+            }
+
+    def _expire(self, version):
+        # Прогнозы действительны до конца дня и до смены версии модели
+        today = date.today()
+        if today != self._day or version != self._version:
+            self._entries.clear()
+            self._day = today
+            self._version = version
+
+    def _ensure_worker(self):
+        # Поток запускается лениво в каждом процессе (после fork он не наследуется)
+        if self._pid == os.getpid() and self._worker is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._worker is not None:
+                return
+            self._worker = threading.Thread(target=self._run, name='price-forecaster', daemon=True)
+            self._pid = os.getpid()
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._predict_batch(batch)
+
+    def _collect(self):
+        """Сбор пакета: первый запрос ждем без ограничения, остальные - в течение window"""
+        batch = [self._queue.get()]
+        rows = len(batch[0].dates)
+        deadline = time.monotonic() + self.window
+        while rows < self.max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            rows += len(pending.dates)
+        return batch
+
+    def _predict_batch(self, batch):
+        """Один вызов модели на все запросы пакета; цены раздаются по запросам"""
+        try:
+            prices = self.predictor.predict_prices(np.vstack([
+                product_date_batch([pending.features], pending.dates) for pending in batch
+            ]))
+        except Exception as e:
+            with self._lock:
+                self._failed += len(batch)
+            logger.error("Не удалось предсказать цены для %s запросов: %s", len(batch), e)
+            for pending in batch:
+                pending.error = e
+                pending.done.set()
+            return
+
+        with self._lock:
+            # Новая версия модели: прогнозы прежней больше не выдаются
+            if self.predictor.version != self._version:
+                self._entries.clear()
+                self._version = self.predictor.version
+            self._requests += len(batch)
+            self._batches += 1
+            self._rows += len(prices)
+        offset = 0
+        for pending in batch:
+            pending.prices = prices[offset:offset + len(pending.dates)]
+            pending.version = self._version
+            offset += len(pending.dates)
+            pending.done.set()
+
+
+# Общий сервис прогноза цен процесса
+price_forecaster = PriceForecaster()
@@ -3,93 +3,146 @@ import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestRegressor
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime, timedelta
 import joblib
+import copy
 import os
+import time
 from dotenv import load_dotenv
-from decimal import Decimal
+from db_pool import get_pool
+from model_registry import model_registry
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Столбцы пакета для predict_prices: признаки товара и дата (месяц, день недели, число)
+BATCH_COLUMNS = ['category_id', 'brand_id', 'volume', 'strength', 'month', 'day_of_week', 'day']
+
+# Праздничные дни (месяц, день)
+HOLIDAYS = [
+    (1, 1), (1, 2), (1, 7), (2, 23), (3, 8), (5, 1), (5, 9),
+    (6, 12), (11, 4), (12, 31)
+]
+
+# Маска праздников [месяц, число]: признак is_holiday - одно обращение по индексам
+HOLIDAY_MASK = np.zeros((13, 32), dtype=bool)
+HOLIDAY_MASK[tuple(np.array(HOLIDAYS).T)] = True
+
+# Признаки модели: товар, календарь и месяцы/дни недели начала акций
+BASE_FEATURES = ['category_id', 'brand_id', 'volume', 'strength',
+                 'month_sin', 'month_cos', 'day_sin', 'day_cos',
+                 'quarter', 'is_weekend', 'is_holiday']
+PROMO_FEATURES = [f'promo_month_{month}' for month in range(1, 13)] + [f'promo_day_{day}' for day in range(7)]
+
+# Имя модели в реестре (model_registry)
+REGISTRY_NAME = 'price_predictor'
+
+# Код типа numeric в PostgreSQL: такие столбцы psycopg2 возвращает как Decimal
+NUMERIC_TYPE_CODE = 1700
+
+# По сколько строк строить признаки и вызывать model.predict (матрица признаков
+# каталога за год целиком заняла бы сотни МБ)
+PREDICT_CHUNK_ROWS = 65536
+
 class PricePredictor:
-    def __init__(self):
-        self.model = RandomForestRegressor(n_estimators=200, random_state=42, max_depth=10)
+    def __init__(self, n_jobs=None):
+        """
+        Args:
+            n_jobs: потоков для обучения и предсказания (-1 - все ядра)
+        """
+        self.n_jobs = n_jobs or int(os.getenv("PRICE_MODEL_N_JOBS", "-1"))
+        # Сколько деревьев добавлять при дообучении и до какого размера леса дообучать
+        self.increment_trees = int(os.getenv("PRICE_MODEL_INCREMENT_TREES", "20"))
+        self.max_trees = int(os.getenv("PRICE_MODEL_MAX_TREES", "400"))
+        # Дообучение: минимум новых строк, размер выборки недавней истории
+        # для сравнения с прежней версией и допустимое падение R² на ней
+        self.min_new_rows = int(os.getenv("PRICE_MODEL_MIN_NEW_ROWS", "100"))
+        self.validation_rows = int(os.getenv("PRICE_MODEL_VALIDATION_ROWS", "5000"))
+        self.max_r2_drop = float(os.getenv("PRICE_MODEL_MAX_R2_DROP", "0"))
+        self.model = RandomForestRegressor(n_estimators=200, random_state=42, max_depth=10, n_jobs=self.n_jobs)
         self.scaler = StandardScaler()
         self.model_path = 'models/price_predictor.joblib'
         self.scaler_path = 'models/price_scaler.joblib'
         self.feature_names = None
+        # Версия модели из реестра; None - модель обучена в этом экземпляре или еще не загружена
+        self.version = None
+        # Отметка загруженной prepare_data() истории цен: последний changed_at
+        # и ID записей с этим changed_at (записи с тем же временем, добавленные
+        # позже, попадут в следующее дообучение)
+        self.trained_until = None
+        self.trained_until_ids = []
         
         # Создаем директорию для моделей, если её нет
         os.makedirs('models', exist_ok=True)
 
     def get_db_connection(self):
-        """Создание соединения с базой данных"""
-        return psycopg2.connect(
-            dbname=os.getenv("DB_NAME", "alcohol_shop"),
-            user=os.getenv("DB_USER", "postgres"),
-            password=os.getenv("DB_PASSWORD", "123"),
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432")
-        )
-
-    def convert_decimal_to_float(self, df):
-        """Преобразование Decimal в float"""
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                try:
-                    df[col] = df[col].astype(float)
-                except:
-                    pass
-        return df
+        """Получение соединения с базой данных из общего пула"""
+        return get_pool().getconn()
+
+    def release_db_connection(self, conn):
+        """Возврат соединения в пул"""
+        get_pool().putconn(conn)
 
     def add_temporal_features(self, df):
-        """Добавление временных признаков"""
-        # Преобразуем дату в datetime, если это строка
-        if isinstance(df['changed_at'].iloc[0], str):
-            df['changed_at'] = pd.to_datetime(df['changed_at'])
-        
-        # Преобразуем все числовые колонки в float
-        df = self.convert_decimal_to_float(df)
-        
+        """
+        Добавление временных признаков
+
+        Все признаки считаются по столбцам целиком; числовые столбцы
+        уже приведены к float (fetch_frame).
+        """
+        changed_at = pd.to_datetime(df['changed_at'])
+        df['changed_at'] = changed_at
+        month = df['month'].astype(float)
+        day_of_week = df['day_of_week'].astype(float)
+
         # Добавляем циклические признаки для месяца и дня недели
-        df['month_sin'] = np.sin(2 * np.pi * df['month'].astype(float) / 12)
-        df['month_cos'] = np.cos(2 * np.pi * df['month'].astype(float) / 12)
-        df['day_sin'] = np.sin(2 * np.pi * df['day_of_week'].astype(float) / 7)
-        df['day_cos'] = np.cos(2 * np.pi * df['day_of_week'].astype(float) / 7)
-        
+        df['month_sin'] = np.sin(2 * np.pi * month / 12)
+        df['month_cos'] = np.cos(2 * np.pi * month / 12)
+        df['day_sin'] = np.sin(2 * np.pi * day_of_week / 7)
+        df['day_cos'] = np.cos(2 * np.pi * day_of_week / 7)
+
         # Добавляем признак квартала
-        df['quarter'] = pd.to_datetime(df['changed_at']).dt.quarter
-        
+        df['quarter'] = changed_at.dt.quarter
+
         # Добавляем признак выходного дня
         df['is_weekend'] = df['day_of_week'].isin([5, 6]).astype(int)
-        
-        # Добавляем признак праздничного периода (пример)
-        holidays = [
-            (1, 1), (1, 2), (1, 7), (2, 23), (3, 8), (5, 1), (5, 9),
-            (6, 12), (11, 4), (12, 31)
-        ]
-        df['is_holiday'] = df.apply(
-            lambda x: 1 if (x['month'], x['changed_at'].day) in holidays else 0,
-            axis=1
-        )
-        
+
+        # Добавляем признак праздничного периода по маске (месяц, число)
+        df['is_holiday'] = HOLIDAY_MASK[month.to_numpy(dtype=int), changed_at.dt.day.to_numpy()].astype(int)
+
         return df
 
-    def prepare_data(self):
-        """Подготовка данных для обучения модели"""
+    def fetch_history(self, since=None, seen_ids=(), until=None, limit=None):
+        """
+        История цен с признаками товаров и акции из базы данных
+
+        Args:
+            since: брать только историю цен с changed_at не раньше этого момента
+            seen_ids: ID записей с changed_at = since, которые не нужны
+            until: брать только историю цен с changed_at не позже этого момента
+            limit: брать только limit последних записей
+
+        Returns:
+            (price_data, promo_data) по возрастанию changed_at
+        """
         conn = self.get_db_connection()
         try:
             # Получаем историю цен
             price_history_query = """
-                SELECT ph.*, p.category_id, p.brand_id, p.volume, p.strength,
-                       EXTRACT(MONTH FROM ph.changed_at) as month,
-                       EXTRACT(DOW FROM ph.changed_at) as day_of_week
-                FROM price_history ph
-                JOIN products p ON ph.product_id = p.id
-                ORDER BY ph.changed_at
+                SELECT * FROM (
+                    SELECT ph.*, p.category_id, p.brand_id, p.volume, p.strength,
+                           EXTRACT(MONTH FROM ph.changed_at) as month,
+                           EXTRACT(DOW FROM ph.changed_at) as day_of_week
+                    FROM price_history ph
+                    JOIN products p ON ph.product_id = p.id
+                    WHERE (%s::timestamp IS NULL
+                           OR (ph.changed_at >= %s::timestamp AND ph.id <> ALL(%s::int[])))
+                      AND (%s::timestamp IS NULL OR ph.changed_at <= %s::timestamp)
+                    ORDER BY ph.changed_at DESC, ph.id DESC
+                    LIMIT %s
+                ) history
+                ORDER BY changed_at, id
             """
             
             # Получаем информацию об акциях
@@ -103,77 +156,109 @@ class PricePredictor:
             """
             
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(price_history_query)
-                price_data = pd.DataFrame(cursor.fetchall())
+                cursor.execute(price_history_query, (since, since, list(seen_ids), until, until, limit))
+                price_data = fetch_frame(cursor)
                 
                 cursor.execute(promotions_query)
-                promo_data = pd.DataFrame(cursor.fetchall())
-            
-            # Проверяем наличие данных
-            if price_data.empty:
-                raise ValueError("Нет данных о ценах в базе данных")
-            
-            print(f"Загружено записей о ценах: {len(price_data)}")
-            print(f"Загружено записей об акциях: {len(promo_data)}")
-            
-            # Преобразуем все числовые колонки в float
-            price_data = self.convert_decimal_to_float(price_data)
-            
-            # Добавляем временные признаки
-            price_data = self.add_temporal_features(price_data)
-            
-            # Подготовка признаков
-            base_features = ['category_id', 'brand_id', 'volume', 'strength', 
-                           'month_sin', 'month_cos', 'day_sin', 'day_cos',
-                           'quarter', 'is_weekend', 'is_holiday']
-            
-            X = price_data[base_features].copy()
-            
-            # Создаем колонки для акций
-            promo_columns = []
-            for month in range(1, 13):
-                promo_columns.append(f'promo_month_{month}')
-            for day in range(7):
-                promo_columns.append(f'promo_day_{day}')
-            
-            # Инициализируем все колонки акций нулями
-            for col in promo_columns:
-                X[col] = 0
-            
-            # Добавляем информацию об акциях, если они есть
-            if not promo_data.empty:
-                promo_data = self.convert_decimal_to_float(promo_data)
-                
-                # Проверяем наличие необходимых колонок
-                required_columns = ['promo_month', 'promo_day']
-                if not all(col in promo_data.columns for col in required_columns):
-                    print("Предупреждение: В данных об акциях отсутствуют некоторые необходимые колонки")
-                else:
-                    # Создаем признаки акций вручную
-                    for _, row in promo_data.iterrows():
-                        month = int(row['promo_month'])
-                        day = int(row['promo_day'])
-                        if 1 <= month <= 12:
-                            X[f'promo_month_{month}'] = 1
-                        if 0 <= day <= 6:
-                            X[f'promo_day_{day}'] = 1
-            
-            # Сохраняем имена признаков
-            self.feature_names = X.columns.tolist()
-            
-            # Целевая переменная - цена
-            y = price_data['price'].astype(float)
-            
-            print(f"Количество признаков: {len(self.feature_names)}")
-            print(f"Признаки: {', '.join(self.feature_names)}")
-            
-            return X, y
-            
+                promo_data = fetch_frame(cursor)
         finally:
-            conn.close()
+            self.release_db_connection(conn)
+
+        return price_data, promo_data
+
+    def prepare_data(self, since=None, seen_ids=()):
+        """
+        Подготовка данных для обучения модели
+
+        Args:
+            since: брать только историю цен с changed_at не раньше этого момента
+            seen_ids: ID записей с changed_at = since, на которых модель уже обучена
+        """
+        price_data, promo_data = self.fetch_history(since, seen_ids)
+
+        # Проверяем наличие данных
+        if price_data.empty:
+            raise ValueError("Нет данных о ценах в базе данных")
+
+        print(f"Загружено записей о ценах: {len(price_data)}")
+        print(f"Загружено записей об акциях: {len(promo_data)}")
+        changed_at = pd.to_datetime(price_data['changed_at'])
+        self.trained_until = changed_at.max().to_pydatetime()
+        self.trained_until_ids = sorted(int(row_id) for row_id in price_data.loc[changed_at == changed_at.max(), 'id'])
+        if since is not None and self.trained_until == since:
+            self.trained_until_ids = sorted(set(self.trained_until_ids) | set(seen_ids))
+
+        X, y = self.build_training_features(price_data, promo_data)
+
+        print(f"Количество признаков: {len(self.feature_names)}")
+        print(f"Признаки: {', '.join(self.feature_names)}")
+
+        return X, y
+
+    def build_training_features(self, price_data, promo_data):
+        """
+        Признаки и целевая переменная для обучения
+
+        Args:
+            price_data: история цен со столбцами запроса prepare_data (числа - float)
+            promo_data: акции (product_id, discount_percent, promo_month, promo_day)
+
+        Returns:
+            (X, y)
+        """
+        # Добавляем временные признаки
+        price_data = self.add_temporal_features(price_data)
+        X = price_data[BASE_FEATURES].copy()
+
+        # Признак акции в месяце/дне недели одинаков для всех строк: столбец
+        # заполняется один раз на каждое встретившееся значение
+        for col in PROMO_FEATURES:
+            X[col] = 0
+        if not promo_data.empty:
+            if not all(col in promo_data.columns for col in ['promo_month', 'promo_day']):
+                print("Предупреждение: В данных об акциях отсутствуют некоторые необходимые колонки")
+            else:
+                months = promo_data['promo_month'].to_numpy(dtype=int)
+                days = promo_data['promo_day'].to_numpy(dtype=int)
+                for month in np.unique(months[(months >= 1) & (months <= 12)]):
+                    X[f'promo_month_{month}'] = 1
+                for day in np.unique(days[(days >= 0) & (days <= 6)]):
+                    X[f'promo_day_{day}'] = 1
+
+        # Сохраняем имена признаков
+        self.feature_names = X.columns.tolist()
+
+        # Целевая переменная - цена
+        y = price_data['price'].astype(float)
+        return X, y
+
+    def train(self, incremental=False):
+        """
+        Обучение модели
+
+        Деревья леса строятся параллельно в n_jobs потоках.
+
+        Args:
+            incremental: дообучить активную версию из реестра: добавить
+                increment_trees деревьев, обученных только на строках
+                price_history с changed_at позже ее обучения (warm_start).
+                Если новых строк меньше min_new_rows, дообучение пропускается
+                (skipped); если R² новой версии на validation_rows последних
+                записях ниже, чем у прежней, больше чем на max_r2_drop, она
+                не публикуется (rejected). Если версии в реестре нет или лес
+                уже достиг max_trees, выполняется полное обучение.
+
+        Returns:
+            словарь со статистикой запуска (режим, строки, время обучения, R²,
+            версия); r2_scope - на чем измерен R² проверки: all_rows (отложенная
+            часть всей истории) или recent_rows (последние записи истории,
+            там же r2_previous - R² прежней версии)
+        """
+        if incremental:
+            stats = self._train_incremental()
+            if stats is not None:
+                return stats
 
-    def train(self):
-        """Обучение модели"""
         X, y = self.prepare_data()
         
         # Разделение на обучающую и тестовую выборки
@@ -184,7 +269,9 @@ class PricePredictor:
         X_test_scaled = self.scaler.transform(X_test)
         
         # Обучение модели
+        started = time.perf_counter()
         self.model.fit(X_train_scaled, y_train)
+        fit_seconds = time.perf_counter() - started
         
         # Оценка модели
         train_score = self.model.score(X_train_scaled, y_train)
@@ -202,13 +289,119 @@ class PricePredictor:
         print("\nВажность признаков:")
         print(feature_importance.head(10))
         
-        # Сохранение модели и скейлера
-        joblib.dump(self.model, self.model_path)
-        joblib.dump(self.scaler, self.scaler_path)
-        joblib.dump(self.feature_names, 'models/feature_names.joblib')
+        return self._publish('full', len(X), fit_seconds, train_score, test_score, r2_scope='all_rows')
+
+    def _train_incremental(self):
+        """Дообучение активной версии; None, если нужно полное обучение"""
+        loaded = model_registry.get(REGISTRY_NAME)
+        meta = loaded.manifest['meta'] if loaded is not None else {}
+        trained_until = meta.get('trained_until')
+        if trained_until is None:
+            print("В реестре нет версии с отметкой обучения - полное обучение")
+            return None
+        n_trees = len(loaded.artifacts['model'].estimators_)
+        if n_trees + self.increment_trees > self.max_trees:
+            print(f"В лесу уже {n_trees} деревьев - полное обучение")
+            return None
+
+        try:
+            X, y = self.prepare_data(since=datetime.fromisoformat(trained_until),
+                                     seen_ids=meta.get('trained_until_ids', []))
+        except ValueError:
+            X = ()
+        if len(X) < self.min_new_rows:
+            # Версия не публикуется, поэтому отметка обучения в реестре прежняя:
+            # эти строки войдут в следующее дообучение
+            print(f"Новых записей о ценах после {trained_until}: {len(X)}, "
+                  f"нужно не меньше {self.min_new_rows}")
+            self.load_model()
+            return {'mode': 'skipped', 'rows': len(X), 'version': loaded.version}
+        if self.feature_names != list(loaded.artifacts['feature_names']):
+            print("Набор признаков изменился - полное обучение")
+            return None
+
+        # Загруженная версия общая для процесса, поэтому дообучается ее копия;
+        # скейлер прежний, чтобы старые и новые деревья видели одинаковые признаки
+        previous = loaded.artifacts['model']
+        model = copy.deepcopy(previous)
+        scaler = loaded.artifacts['scaler']
+        X_scaled = scaler.transform(X)
+
+        # Новые деревья обучаются на всех новых строках: отложенные строки
+        # остались бы за отметкой обучения и не вошли бы ни в одну версию
+        model.set_params(warm_start=True, n_estimators=n_trees + self.increment_trees, n_jobs=self.n_jobs)
+        started = time.perf_counter()
+        model.fit(X_scaled, y)
+        fit_seconds = time.perf_counter() - started
+        model.set_params(warm_start=False)
+        # по одной строке R² не определен
+        train_score = model.score(X_scaled, y) if len(y) > 1 else None
+
+        # Проверка: новая и прежняя версии на одной выборке недавней истории
+        # (включая новые строки); версия с упавшим R² не публикуется
+        price_data, promo_data = self.fetch_history(until=self.trained_until, limit=self.validation_rows)
+        X_recent, y_recent = self.build_training_features(price_data, promo_data)
+        X_recent = scaler.transform(X_recent)
+        test_score = model.score(X_recent, y_recent)
+        previous_score = previous.score(X_recent, y_recent)
+        print(f"R² на {len(y_recent)} последних записях: новая версия {test_score:.3f}, "
+              f"прежняя {previous_score:.3f}")
+
+        self.model, self.scaler = model, scaler
+        if test_score < previous_score - self.max_r2_drop:
+            print(f"R² упал больше чем на {self.max_r2_drop} - версия не публикуется")
+            stats = self._stats('rejected', len(X), fit_seconds, train_score, test_score,
+                                r2_scope='recent_rows', r2_previous=round(float(previous_score), 4),
+                                base_version=loaded.version)
+            self.load_model()
+            return {**stats, 'version': loaded.version}
+        return self._publish('incremental', len(X), fit_seconds, train_score, test_score,
+                             r2_scope='recent_rows', r2_previous=round(float(previous_score), 4),
+                             base_version=loaded.version)
+
+    def _stats(self, mode, rows, fit_seconds, train_score, test_score, **meta):
+        # Статистика запуска обучения
+        return {
+            'mode': mode,
+            'rows': rows,
+            'trees': len(self.model.estimators_),
+            'n_jobs': self.n_jobs,
+            'fit_seconds': round(fit_seconds, 3),
+            'r2_train': round(float(train_score), 4) if train_score is not None else None,
+            'r2_test': round(float(test_score), 4) if test_score is not None else None,
+            'trained_until': self.trained_until.isoformat(),
+            **meta
+        }
+
+    def _publish(self, mode, rows, fit_seconds, train_score, test_score, **meta):
+        # Публикация новой версии модели и скейлера в реестре
+        stats = self._stats(mode, rows, fit_seconds, train_score, test_score, **meta)
+        self.version = model_registry.publish(REGISTRY_NAME, {
+            'model': self.model,
+            'scaler': self.scaler,
+            'feature_names': self.feature_names
+        }, meta={**stats, 'trained_until_ids': self.trained_until_ids, 'features': len(self.feature_names)})
+        print(f"Модель сохранена в реестре, версия {self.version}")
+        return {**stats, 'version': self.version}
 
     def load_model(self):
-        """Загрузка сохраненной модели"""
+        """
+        Загрузка активной версии модели из реестра
+
+        Загруженная версия хранится в памяти процесса (model_registry.get),
+        поэтому все экземпляры PricePredictor делят одну модель; после
+        публикации или активации другой версии она подменяет прежнюю без
+        перезапуска. Модель, сохраненная до появления реестра, загружается
+        из прежних файлов.
+        """
+        loaded = model_registry.get(REGISTRY_NAME)
+        if loaded is not None:
+            if loaded.version != self.version:
+                self.feature_names = loaded.artifacts['feature_names']
+                self.scaler = loaded.artifacts['scaler']
+                self.model = loaded.artifacts['model']
+                self.version = loaded.version
+            return True
         if os.path.exists(self.model_path) and os.path.exists(self.scaler_path):
             self.model = joblib.load(self.model_path)
             self.scaler = joblib.load(self.scaler_path)
@@ -216,6 +409,19 @@ class PricePredictor:
             return True
         return False
 
+    def active_version(self):
+        """
+        Версия модели, которой будет выполнено следующее предсказание
+
+        Для модели из реестра - его активная версия (с учетом горячей
+        подмены), для обученной в этом экземпляре или загруженной из
+        прежних файлов - None.
+        """
+        if self.version is None and self.feature_names is not None:
+            return None
+        loaded = model_registry.get(REGISTRY_NAME)
+        return loaded.version if loaded is not None else self.version
+
     def predict_price(self, product_data):
         """
         Предсказание цены для нового товара
@@ -228,51 +434,97 @@ class PricePredictor:
                     'volume': float,
                     'strength': float,
                     'month': int (1-12),
-                    'day_of_week': int (0-6)
+                    'day_of_week': int (0-6),
+                    'day': int (1-31, по умолчанию сегодняшнее число)
                 }
         """
-        if not hasattr(self.model, 'predict'):
-            if not self.load_model():
+        row = [product_data.get(column, datetime.now().day if column == 'day' else None)
+               for column in BATCH_COLUMNS]
+        return self.predict_prices(np.array([row], dtype=float))[0]
+
+    def predict_prices(self, batch):
+        """
+        Пакетное предсказание цен для многих пар товар-дата
+
+        Признаки строятся сразу для всех строк массивами NumPy, а модель
+        вызывается один раз на каждые PREDICT_CHUNK_ROWS строк, а не на
+        каждую строку.
+
+        Args:
+            batch: массив (строки, len(BATCH_COLUMNS)), столбцы - BATCH_COLUMNS;
+                удобно собирать через product_date_batch()
+
+        Returns:
+            np.ndarray предсказанных цен в порядке строк
+        """
+        # Модель из реестра сверяется с его активной версией
+        if self.feature_names is None or self.version is not None:
+            if not self.load_model() and self.feature_names is None:
                 raise Exception("Модель не обучена. Сначала выполните train()")
-        
-        # Создаем DataFrame с нулевыми значениями для всех признаков
-        X = pd.DataFrame(0, index=[0], columns=self.feature_names)
-        
-        # Добавляем временные признаки
-        month = float(product_data['month'])
-        day_of_week = float(product_data['day_of_week'])
-        
-        # Циклические признаки
-        X['month_sin'] = np.sin(2 * np.pi * month / 12)
-        X['month_cos'] = np.cos(2 * np.pi * month / 12)
-        X['day_sin'] = np.sin(2 * np.pi * day_of_week / 7)
-        X['day_cos'] = np.cos(2 * np.pi * day_of_week / 7)
-        
-        # Квартал
-        X['quarter'] = int((month - 1) // 3 + 1)
-        
-        # Выходной день
-        X['is_weekend'] = 1 if day_of_week in [5, 6] else 0
-        
-        # Праздничный день (пример)
-        holidays = [
-            (1, 1), (1, 2), (1, 7), (2, 23), (3, 8), (5, 1), (5, 9),
-            (6, 12), (11, 4), (12, 31)
-        ]
-        X['is_holiday'] = 1 if (int(month), datetime.now().day) in holidays else 0
-        
-        # Заполняем остальные известные признаки
-        for key, value in product_data.items():
-            if key in X.columns:
-                X[key] = float(value)
-        
-        # Масштабирование признаков
-        X_scaled = self.scaler.transform(X)
-        
-        # Предсказание цены
-        predicted_price = self.model.predict(X_scaled)[0]
-        
-        return predicted_price
+        # Версия берется один раз: подмена модели во время вызова его не затронет
+        model, scaler, feature_names = self.model, self.scaler, self.feature_names
+
+        batch = np.asarray(batch, dtype=float).reshape(-1, len(BATCH_COLUMNS))
+        prices = np.empty(len(batch))
+        for start in range(0, len(batch), PREDICT_CHUNK_ROWS):
+            chunk = batch[start:start + PREDICT_CHUNK_ROWS]
+            X = pd.DataFrame(self.build_features(chunk, feature_names), columns=feature_names)
+            prices[start:start + len(chunk)] = model.predict(scaler.transform(X))
+        return prices
+
+    def build_features(self, batch, feature_names=None):
+        """
+        Матрица признаков модели для строк пакета (столбцы - feature_names)
+
+        Признаки акций, которых нет в пакете, остаются нулевыми.
+        """
+        feature_names = feature_names or self.feature_names
+        values = dict(zip(BATCH_COLUMNS, batch.T))
+        month, day_of_week = values['month'], values['day_of_week']
+        features = {
+            'category_id': values['category_id'],
+            'brand_id': values['brand_id'],
+            'volume': values['volume'],
+            'strength': values['strength'],
+            # Циклические признаки
+            'month_sin': np.sin(2 * np.pi * month / 12),
+            'month_cos': np.cos(2 * np.pi * month / 12),
+            'day_sin': np.sin(2 * np.pi * day_of_week / 7),
+            'day_cos': np.cos(2 * np.pi * day_of_week / 7),
+            'quarter': (month - 1) // 3 + 1,
+            'is_weekend': np.isin(day_of_week, [5, 6]),
+            'is_holiday': HOLIDAY_MASK[month.astype(int), values['day'].astype(int)]
+        }
+
+        X = np.zeros((len(batch), len(feature_names)))
+        for idx, name in enumerate(feature_names):
+            if name in features:
+                X[:, idx] = features[name]
+        return X
+
+    def predict_catalog(self, days_ahead=365, start=None):
+        """
+        Предсказание цен всех товаров каталога на days_ahead дней вперед
+
+        Returns:
+            (ID товаров, даты, цены - массив товары x даты)
+        """
+        conn = self.get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, category_id, brand_id, volume, strength
+                    FROM products
+                    ORDER BY id
+                """)
+                rows = cursor.fetchall()
+        finally:
+            self.release_db_connection(conn)
+
+        dates = forecast_dates(days_ahead, start)
+        product_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        prices = self.predict_prices(product_date_batch([row[1:] for row in rows], dates))
+        return product_ids, dates, prices.reshape(len(product_ids), len(dates))
 
     def suggest_promotion_timing(self, product_id, days_ahead=30):
         """
@@ -295,36 +547,64 @@ class PricePredictor:
                 
                 if not product:
                     raise Exception("Товар не найден")
-                
-                # Генерируем даты для анализа
-                dates = [datetime.now() + timedelta(days=i) for i in range(days_ahead)]
-                
-                # Предсказываем цены для каждой даты
-                predictions = []
-                for date in dates:
-                    product_data = {
-                        'category_id': product['category_id'],
-                        'brand_id': product['brand_id'],
-                        'volume': product['volume'],
-                        'strength': product['strength'],
-                        'month': date.month,
-                        'day_of_week': date.weekday()
-                    }
-                    
-                    predicted_price = self.predict_price(product_data)
-                    predictions.append({
-                        'date': date,
-                        'predicted_price': predicted_price
-                    })
-                
-                # Находим даты с минимальными предсказанными ценами
-                predictions.sort(key=lambda x: x['predicted_price'])
-                best_dates = predictions[:5]  # Топ-5 лучших дат
-                
-                return best_dates
-                
         finally:
-            conn.close()
+            self.release_db_connection(conn)
+
+        # Генерируем даты для анализа и предсказываем цены на все даты одним пакетом
+        dates = forecast_dates(days_ahead)
+        features = [product['category_id'], product['brand_id'], product['volume'], product['strength']]
+        prices = self.predict_prices(product_date_batch([features], dates))
+
+        # Находим даты с минимальными предсказанными ценами
+        best = np.argsort(prices, kind='stable')[:5]  # Топ-5 лучших дат
+        return [{'date': dates[idx], 'predicted_price': prices[idx]} for idx in best]
+
+
+def fetch_frame(cursor):
+    """
+    Результат запроса в DataFrame
+
+    Столбцы типа numeric (Decimal) по описанию результата приводятся к
+    float один раз, без попыток привести каждый столбец object.
+    """
+    columns = [column.name for column in cursor.description]
+    df = pd.DataFrame(cursor.fetchall(), columns=columns)
+    numeric = [column.name for column in cursor.description if column.type_code == NUMERIC_TYPE_CODE]
+    return cast_numeric(df, numeric)
+
+
+def cast_numeric(df, columns):
+    """Приведение столбцов columns (Decimal из БД) к float"""
+    if columns:
+        df[columns] = df[columns].astype(float)
+    return df
+
+
+def forecast_dates(days_ahead, start=None):
+    """Даты прогноза: start (по умолчанию сейчас) и следующие days_ahead - 1 дней"""
+    start = start or datetime.now()
+    return [start + timedelta(days=i) for i in range(days_ahead)]
+
+
+def product_date_batch(products, dates):
+    """
+    Пакет для predict_prices: все пары товар x дата
+
+    Args:
+        products: строки (category_id, brand_id, volume, strength)
+        dates: даты прогноза
+
+    Returns:
+        массив (len(products) * len(dates), len(BATCH_COLUMNS)), строки товара
+        идут подряд по всем датам
+    """
+    products = np.asarray(products, dtype=float).reshape(-1, 4)
+    calendar = np.array([(date.month, date.weekday(), date.day) for date in dates], dtype=float).reshape(-1, 3)
+    return np.hstack([
+        np.repeat(products, len(calendar), axis=0),
+        np.tile(calendar, (len(products), 1))
+    ])
+
 
 def main():
     # Создание и обучение модели
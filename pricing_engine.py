@@ -0,0 +1,292 @@
+import numpy as np
+
+
+class Rule:
+    """Базовое правило скидки, скомпилированное из строки таблицы promotions"""
+
+    def __init__(self, promotion_id, name):
+        self.promotion_id = promotion_id
+        self.name = name
+
+
+class PercentageRule(Rule):
+    """Процентная скидка на конкретный товар"""
+
+    def __init__(self, promotion_id, name, product_id, discount_percent):
+        super().__init__(promotion_id, name)
+        self.product_id = product_id
+        self.discount_percent = discount_percent
+
+
+class CategoryRule(Rule):
+    """Процентная скидка на все товары категории"""
+
+    def __init__(self, promotion_id, name, category_id, discount_percent):
+        super().__init__(promotion_id, name)
+        self.category_id = category_id
+        self.discount_percent = discount_percent
+
+
+class NForMRule(Rule):
+    """Акция "buy_quantity по цене pay_quantity" на конкретный товар"""
+
+    def __init__(self, promotion_id, name, product_id, buy_quantity, pay_quantity):
+        super().__init__(promotion_id, name)
+        self.product_id = product_id
+        self.buy_quantity = buy_quantity
+        self.pay_quantity = pay_quantity
+
+
+class BundleRule(Rule):
+    """Процентная скидка на полные комплекты из нескольких товаров"""
+
+    def __init__(self, promotion_id, name, product_ids, discount_percent):
+        super().__init__(promotion_id, name)
+        self.product_ids = sorted(set(product_ids))
+        self.discount_percent = discount_percent
+
+
+def compile_rules(promotions):
+    """
+    Компиляция акций в правила
+
+    Args:
+        promotions: список словарей с полями id, name, promo_type, discount_percent,
+            product_id, category_ids, buy_quantity, pay_quantity, bundle_product_ids
+    """
+    rules = []
+    for promo in promotions:
+        promo_type = promo.get('promo_type') or 'percentage'
+        if promo_type == 'n_for_m':
+            if promo['product_id'] is not None and promo['buy_quantity'] and promo['pay_quantity'] is not None:
+                rules.append(NForMRule(promo['id'], promo['name'], promo['product_id'],
+                                       int(promo['buy_quantity']), int(promo['pay_quantity'])))
+        elif promo_type == 'bundle':
+            if promo.get('bundle_product_ids') and promo['discount_percent'] > 0:
+                rules.append(BundleRule(promo['id'], promo['name'], promo['bundle_product_ids'],
+                                        promo['discount_percent']))
+        elif promo['discount_percent'] > 0:
+            if promo['product_id'] is not None:
+                rules.append(PercentageRule(promo['id'], promo['name'], promo['product_id'],
+                                            promo['discount_percent']))
+            for category_id in promo.get('category_ids') or []:
+                rules.append(CategoryRule(promo['id'], promo['name'], category_id,
+                                          promo['discount_percent']))
+    return rules
+
+
+class CartPricing:
+    """
+    Результат расчета корзины, выровненный по входным позициям.
+
+    Позиции одного товара получают одинаковую цену за единицу: акции вида
+    "N по цене M" и комплекты считаются по суммарному количеству товара.
+    """
+
+    def __init__(self, original_price, price, discount_per_item, discount_percent,
+                 promotion_ids, promotion_names, total):
+        self.original_price = original_price
+        self.price = price
+        self.discount_per_item = discount_per_item
+        self.discount_percent = discount_percent
+        self.promotion_ids = promotion_ids
+        self.promotion_names = promotion_names
+        self.total = total
+
+    def __len__(self):
+        return len(self.price)
+
+
+class PricingEngine:
+    """
+    Движок расчета цен корзины.
+
+    Правила компилируются в отсортированные массивы по типам, после чего корзина
+    любого размера считается за один векторный проход: для каждого товара
+    собираются скидки-кандидаты от всех применимых правил и выбирается
+    наибольшая. Скидки разных правил на один товар не суммируются.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._names = np.array([rule.name for rule in self.rules] + [None], dtype=object)
+        self._ids = np.array([rule.promotion_id for rule in self.rules] + [None], dtype=object)
+        self._compile()
+
+    @classmethod
+    def from_promotions(cls, promotions):
+        return cls(compile_rules(promotions))
+
+    def _compile(self):
+        percentage, category, n_for_m, bundle = [], [], [], []
+        for rule_idx, rule in enumerate(self.rules):
+            if isinstance(rule, PercentageRule):
+                percentage.append((rule.product_id, rule.discount_percent, rule_idx))
+            elif isinstance(rule, CategoryRule):
+                category.append((rule.category_id, rule.discount_percent, rule_idx))
+            elif isinstance(rule, NForMRule):
+                n_for_m.append((rule.product_id, rule.buy_quantity, rule.pay_quantity, rule_idx))
+            elif isinstance(rule, BundleRule):
+                bundle.append(rule_idx)
+
+        # Для процентных правил достаточно лучшего процента на ключ
+        self._product_keys, self._product_percent, self._product_rule = _best_percent_by_key(percentage)
+        self._category_keys, self._category_percent, self._category_rule = _best_percent_by_key(category)
+
+        if n_for_m:
+            data = np.array(n_for_m, dtype=np.int64)
+            self._nfm_product = data[:, 0]
+            self._nfm_buy = data[:, 1]
+            self._nfm_pay = data[:, 2]
+            self._nfm_rule = data[:, 3]
+        else:
+            self._nfm_product = self._nfm_buy = self._nfm_pay = self._nfm_rule = np.empty(0, dtype=np.int64)
+
+        # Комплекты разворачиваются в плоские массивы (комплект, товар)
+        bundle_idx, bundle_product, bundle_starts, bundle_percent, bundle_rule = [], [], [], [], []
+        for position, rule_idx in enumerate(bundle):
+            rule = self.rules[rule_idx]
+            bundle_starts.append(len(bundle_product))
+            bundle_idx.extend([position] * len(rule.product_ids))
+            bundle_product.extend(rule.product_ids)
+            bundle_percent.append(rule.discount_percent)
+            bundle_rule.append(rule_idx)
+        self._bundle_idx = np.array(bundle_idx, dtype=np.int64)
+        self._bundle_product = np.array(bundle_product, dtype=np.int64)
+        self._bundle_starts = np.array(bundle_starts, dtype=np.int64)
+        self._bundle_percent = np.array(bundle_percent, dtype=np.float64)
+        self._bundle_rule = np.array(bundle_rule, dtype=np.int64)
+
+    def price_cart(self, product_ids, category_ids, prices, quantities):
+        """
+        Расчет цен корзины
+
+        Args:
+            product_ids: ID товаров по позициям корзины
+            category_ids: ID категорий по позициям
+            prices: базовые цены за единицу
+            quantities: количества
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        category_ids = np.asarray(category_ids, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        quantities = np.asarray(quantities, dtype=np.int64)
+        if len(product_ids) == 0:
+            empty = np.empty(0)
+            return CartPricing(empty, empty, empty, empty, self._ids[:0], self._names[:0], 0.0)
+
+        # Агрегируем позиции по товару
+        products, line_to_product = np.unique(product_ids, return_inverse=True)
+        n_products = len(products)
+        quantity = np.bincount(line_to_product, weights=quantities, minlength=n_products).astype(np.int64)
+        price = np.empty(n_products)
+        price[line_to_product] = prices
+        category = np.empty(n_products, dtype=np.int64)
+        category[line_to_product] = category_ids
+
+        cand_product, cand_discount, cand_percent, cand_rule = [], [], [], []
+
+        def add_percentage(positions, percents, rule_ids):
+            unit_discount = _percent_discount(price[positions], percents)
+            cand_product.append(positions)
+            cand_discount.append(unit_discount * quantity[positions])
+            cand_percent.append(percents)
+            cand_rule.append(rule_ids)
+
+        positions, matched = _match(self._product_keys, products)
+        add_percentage(matched, self._product_percent[positions], self._product_rule[positions])
+
+        positions, matched = _match(self._category_keys, category)
+        add_percentage(matched, self._category_percent[positions], self._category_rule[positions])
+
+        if len(self._nfm_product):
+            matched, rule_pos = _match(products, self._nfm_product)
+            buy = self._nfm_buy[rule_pos]
+            free = (quantity[matched] // buy) * (buy - self._nfm_pay[rule_pos])
+            cand_product.append(matched)
+            cand_discount.append(free * price[matched])
+            cand_percent.append(np.full(len(matched), np.nan))
+            cand_rule.append(self._nfm_rule[rule_pos])
+
+        if len(self._bundle_product):
+            position = np.clip(np.searchsorted(products, self._bundle_product), 0, n_products - 1)
+            present = products[position] == self._bundle_product
+            item_quantity = np.where(present, quantity[position], 0)
+            sets = np.minimum.reduceat(item_quantity, self._bundle_starts)
+            item_sets = sets[self._bundle_idx]
+            active = item_sets > 0
+            percent = self._bundle_percent[self._bundle_idx[active]]
+            matched = position[active]
+            cand_product.append(matched)
+            cand_discount.append(_percent_discount(price[matched], percent) * item_sets[active])
+            cand_percent.append(np.full(len(matched), np.nan))
+            cand_rule.append(self._bundle_rule[self._bundle_idx[active]])
+
+        discount = np.zeros(n_products)
+        percent = np.zeros(n_products)
+        rule = np.full(n_products, len(self.rules), dtype=np.int64)
+
+        cand_product = np.concatenate(cand_product)
+        if len(cand_product):
+            cand_discount = np.concatenate(cand_discount)
+            cand_percent = np.concatenate(cand_percent)
+            cand_rule = np.concatenate(cand_rule)
+            # Для каждого товара берем кандидата с наибольшей скидкой
+            # (при равенстве - правило, объявленное раньше)
+            order = np.lexsort((cand_rule, -cand_discount, cand_product))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = cand_product[order][1:] != cand_product[order][:-1]
+            best = order[first]
+            best = best[cand_discount[best] > 0]
+            winners = cand_product[best]
+            discount[winners] = cand_discount[best]
+            rule[winners] = cand_rule[best]
+            gross = price[winners] * quantity[winners]
+            computed = np.round(cand_discount[best] / gross * 100, 2)
+            percent[winners] = np.where(np.isnan(cand_percent[best]), computed, cand_percent[best])
+
+        effective = price - discount / quantity
+        total = round(float(np.sum(price * quantity - discount)), 2)
+
+        return CartPricing(
+            original_price=prices,
+            price=effective[line_to_product],
+            discount_per_item=np.round(price - effective, 2)[line_to_product],
+            discount_percent=percent[line_to_product],
+            promotion_ids=self._ids[rule][line_to_product],
+            promotion_names=self._names[rule][line_to_product],
+            total=total
+        )
+
+
+def _percent_discount(price, percent):
+    """Скидка за единицу товара, округленная до копеек (половина - вверх)"""
+    cents = np.round(price * 100)
+    return np.floor(cents * percent / 100 + 0.5 + 1e-9) / 100
+
+
+def _best_percent_by_key(entries):
+    """Сворачивает процентные правила до лучшего процента на ключ (отсортированные массивы)"""
+    best = {}
+    for key, percent, rule_idx in entries:
+        current = best.get(key)
+        if current is None or percent > current[0]:
+            best[key] = (percent, rule_idx)
+    keys = np.array(sorted(best), dtype=np.int64)
+    percents = np.array([best[key][0] for key in keys], dtype=np.float64)
+    rules = np.array([best[key][1] for key in keys], dtype=np.int64)
+    return keys, percents, rules
+
+
+def _match(keys, values):
+    """
+    Поиск значений в отсортированном массиве ключей
+
+    Возвращает позиции найденных значений в keys и их индексы в values
+    """
+    if len(keys) == 0 or len(values) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    position = np.clip(np.searchsorted(keys, values), 0, len(keys) - 1)
+    found = np.flatnonzero(keys[position] == values)
+    return position[found], found
@@ -0,0 +1,191 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+from pricing_engine import PricingEngine
+
+# Загрузка переменных окружения
+load_dotenv()
+
+
+class ActivePromotions:
+    """
+    Неизменяемый срез акций, активных в текущем временном окне.
+
+    Лучшая процентная акция хранится отдельно по product_id и по category_id,
+    поэтому поиск скидки для товара - два обращения к словарю.
+    """
+
+    def __init__(self, promotions, by_product, by_category, generation):
+        self.promotions = promotions
+        self.by_product = by_product
+        self.by_category = by_category
+        self.generation = generation
+        self._pricing = None
+
+    @property
+    def pricing(self):
+        """Движок цен, скомпилированный из акций этого среза"""
+        if self._pricing is None:
+            self._pricing = PricingEngine.from_promotions(self.promotions)
+        return self._pricing
+
+    def best_for(self, product_id, category_id):
+        """
+        Лучшая активная акция для товара (или None)
+
+        Args:
+            product_id: ID товара
+            category_id: ID категории товара
+        """
+        product_promo = self.by_product.get(product_id)
+        category_promo = self.by_category.get(category_id)
+        if product_promo is None:
+            return category_promo
+        if category_promo is None:
+            return product_promo
+        # При равной скидке предпочитаем акцию на конкретный товар
+        if category_promo['discount_percent'] > product_promo['discount_percent']:
+            return category_promo
+        return product_promo
+
+    def discount_for(self, product_id, category_id):
+        """Процент скидки лучшей активной акции (0, если акций нет)"""
+        promo = self.best_for(product_id, category_id)
+        return promo['discount_percent'] if promo else 0
+
+
+class PromotionIndex:
+    """
+    Индекс акций процесса, загружаемый из promotions, promotion_categories
+    и promotion_products.
+
+    Загружаются все акции, которые еще не закончились, вместе с их окнами
+    start_date/end_date. Активный срез пересчитывается без обращения к БД
+    на ближайшей границе окна (начало или конец любой акции), а полная
+    перезагрузка выполняется после invalidate() или по истечении ttl.
+    """
+
+    def __init__(self, ttl=None):
+        """
+        Args:
+            ttl: через сколько секунд индекс перечитывается из БД
+        """
+        if ttl is None:
+            ttl = float(os.getenv("PROMO_INDEX_TTL", "300"))
+        self.ttl = timedelta(seconds=ttl)
+        self._lock = threading.Lock()
+        self._promotions = None
+        self._loaded_at = None
+        self._window_ends_at = None
+        self._active = None
+        self._generation = 0
+
+    def invalidate(self):
+        """Сброс индекса после изменения акций; следующий запрос перечитает БД"""
+        with self._lock:
+            self._promotions = None
+
+    def current(self, conn):
+        """
+        Срез акций, активных на текущий момент
+
+        Args:
+            conn: соединение, через которое при необходимости перечитываются акции,
+                или функция, возвращающая его: тогда соединение берется из пула,
+                только если акции действительно нужно перечитать
+        """
+        now = datetime.now()
+        active = self._active
+        if self._is_fresh(now):
+            return active
+
+        with self._lock:
+            if self._promotions is None or now - self._loaded_at >= self.ttl:
+                self._promotions = self._load(conn)
+                self._loaded_at = now
+                self._build(now)
+            elif now >= self._window_ends_at:
+                self._build(now)
+            return self._active
+
+    def _is_fresh(self, now):
+        return (self._promotions is not None and self._active is not None
+                and now < self._window_ends_at and now - self._loaded_at < self.ttl)
+
+    def _load(self, conn):
+        """Загрузка всех незавершенных акций вместе с их категориями"""
+        if callable(conn):
+            conn = conn()
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT p.id, p.name, p.promo_type, p.discount_percent, p.product_id,
+                       p.buy_quantity, p.pay_quantity, p.start_date, p.end_date,
+                       ARRAY(SELECT pc.category_id FROM promotion_categories pc
+                             WHERE pc.promotion_id = p.id) as category_ids,
+                       ARRAY(SELECT pp.product_id FROM promotion_products pp
+                             WHERE pp.promotion_id = p.id) as bundle_product_ids
+                FROM promotions p
+                WHERE p.end_date >= NOW()
+            """)
+            rows = cursor.fetchall()
+
+        promotions = []
+        for row in rows:
+            promotions.append({
+                'id': row['id'],
+                'name': row['name'],
+                'promo_type': row['promo_type'],
+                'discount_percent': float(row['discount_percent'] or 0),
+                'product_id': row['product_id'],
+                'category_ids': list(row['category_ids']),
+                'buy_quantity': row['buy_quantity'],
+                'pay_quantity': row['pay_quantity'],
+                'bundle_product_ids': list(row['bundle_product_ids']),
+                'start_date': row['start_date'],
+                'end_date': row['end_date']
+            })
+        return promotions
+
+    def _build(self, now):
+        """Пересчет активного среза и времени следующей границы окна"""
+        by_product = {}
+        by_category = {}
+        active = []
+        # Если границ впереди нет, срез живет до следующей перезагрузки по ttl
+        window_ends_at = now + self.ttl
+
+        for promo in self._promotions:
+            if promo['start_date'] > now:
+                window_ends_at = min(window_ends_at, promo['start_date'])
+                continue
+            if promo['end_date'] < now:
+                continue
+            # Акция активна включительно по end_date
+            window_ends_at = min(window_ends_at, promo['end_date'] + timedelta(microseconds=1))
+            active.append(promo)
+
+            # В витрину попадают только процентные скидки; акции "N по цене M"
+            # и комплекты зависят от состава корзины и считаются движком цен
+            if promo['promo_type'] != 'percentage':
+                continue
+            if promo['product_id'] is not None:
+                _keep_best(by_product, promo['product_id'], promo)
+            for category_id in promo['category_ids']:
+                _keep_best(by_category, category_id, promo)
+
+        self._generation += 1
+        self._window_ends_at = window_ends_at
+        self._active = ActivePromotions(active, by_product, by_category, self._generation)
+
+
+def _keep_best(index, key, promo):
+    current = index.get(key)
+    if current is None or (promo['discount_percent'], -promo['id']) > (current['discount_percent'], -current['id']):
+        index[key] = promo
+
+
+# Общий индекс акций процесса
+promotion_index = PromotionIndex()
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+
+class CachedRecommendations:
+    """Выдача пользователю и срез модели, по которому она посчитана"""
+
+    __slots__ = ('generation', 'n', 'recommendations', 'expires_at')
+
+    def __init__(self, generation, n, recommendations, expires_at):
+        self.generation = generation
+        self.n = n
+        self.recommendations = recommendations
+        self.expires_at = expires_at
+
+
+class RecommendationCache:
+    """
+    Кэш персональных рекомендаций по пользователям.
+
+    Для пользователя хранится последняя выдача вместе с номером среза
+    модели, по которому она посчитана; запрос с другим номером среза
+    (модель дообучилась или перестроилась) считается промахом. После
+    оформления заказа запись пользователя сбрасывается через
+    invalidate_user(). Число записей ограничено (вытесняются давно не
+    использованные), время жизни - ttl.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        """
+        Args:
+            max_entries: максимум пользователей в кэше
+            ttl: время жизни выдачи в секундах
+        """
+        if max_entries is None:
+            max_entries = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "10000"))
+        if ttl is None:
+            ttl = float(os.getenv("RECOMMENDATION_CACHE_TTL", "600"))
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, user_id, n, generation):
+        """
+        Первые n рекомендаций пользователя, посчитанные срезом generation, или None
+
+        Args:
+            user_id: ID пользователя
+            n: количество рекомендаций
+            generation: номер текущего среза модели
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry.n < n:
+                self._misses += 1
+                return None
+            if entry.generation != generation or entry.expires_at <= time.monotonic():
+                # Выдача устарела: модель сменилась или истек ttl
+                del self._entries[user_id]
+                self._stale += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._hits += 1
+            return entry.recommendations[:n]
+
+    def put(self, user_id, n, generation, recommendations):
+        """Сохранение выдачи из n рекомендаций, посчитанной срезом generation"""
+        with self._lock:
+            self._entries[user_id] = CachedRecommendations(generation, n, recommendations, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Сброс выдачи пользователя (например, после его заказа)"""
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'stale': self._stale,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations
+            }
+
+
+# Общий кэш рекомендаций процесса
+recommendation_cache = RecommendationCache()
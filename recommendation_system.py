@@ -1,247 +1,1133 @@
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
-import psycopg2
+from scipy import sparse
+from sklearn.preprocessing import StandardScaler, normalize
 from psycopg2.extras import RealDictCursor
 import os
+import json
+import itertools
+import shutil
+import logging
+import threading
+from decimal import Decimal
 from dotenv import load_dotenv
+from db_pool import get_pool
+from item_neighbors import ItemNeighborIndex, content_neighbors
+from ann_index import RandomProjectionLSH
 from datetime import datetime, timedelta
 
 # Загрузка переменных окружения
 load_dotenv()
 
-class RecommendationSystem:
+logger = logging.getLogger(__name__)
+
+# Оплаченные заказы с описанием товаров; %s - нижняя граница orders.id (не включая)
+ORDERS_QUERY = """
+    SELECT o.id as order_id, o.user_id, oi.product_id, oi.quantity, o.created_at,
+           p.category_id, p.brand_id, p.volume, p.strength,
+           p.price, p.name as product_name,
+           c.name as category_name,
+           b.name as brand_name
+    FROM orders o
+    JOIN order_items oi ON o.id = oi.order_id
+    JOIN products p ON oi.product_id = p.id
+    JOIN categories c ON p.category_id = c.id
+    JOIN brands b ON p.brand_id = b.id
+    WHERE o.status = 'paid' AND o.id > %s
+    ORDER BY o.created_at
+"""
+
+# Позиции оплаченных заказов для полного построения: только числа, без описаний товаров
+INTERACTIONS_QUERY = """
+    SELECT o.id, o.user_id, oi.product_id, oi.quantity
+    FROM orders o
+    JOIN order_items oi ON o.id = oi.order_id
+    WHERE o.status = 'paid'
+"""
+
+# Популярные товары прямо из БД - пока модель строится
+POPULAR_QUERY = """
+    SELECT p.id as product_id, p.name as product_name,
+           c.name as category_name, b.name as brand_name,
+           p.price, SUM(oi.quantity) as quantity
+    FROM orders o
+    JOIN order_items oi ON o.id = oi.order_id
+    JOIN products p ON oi.product_id = p.id
+    JOIN categories c ON p.category_id = c.id
+    JOIN brands b ON p.brand_id = b.id
+    WHERE o.status = 'paid'
+    GROUP BY p.id, c.name, b.name
+    ORDER BY quantity DESC, p.id
+    LIMIT %s
+"""
+
+# Описание товаров-соседей из индекса, пока модель строится
+ITEMS_QUERY = """
+    SELECT p.id as product_id, p.name as product_name,
+           c.name as category_name, b.name as brand_name, p.price
+    FROM products p
+    JOIN categories c ON p.category_id = c.id
+    JOIN brands b ON p.brand_id = b.id
+    WHERE p.id = ANY(%s)
+"""
+
+# Сколько популярных товаров запрашивать из БД до готовности модели
+POPULAR_FALLBACK_SIZE = 50
+
+# Сколько популярных товаров готовить для выдачи при построении среза
+POPULAR_LIST_SIZE = 100
+
+# Сколько последних ID заказов перечитывать при дообучении: транзакции фиксируются
+# не в порядке выдачи orders.id, и заказ с меньшим ID может появиться позже
+ORDER_ID_LOOKBACK = 1000
+
+# Описание товара в item_features
+ITEM_COLUMNS = ['product_id', 'category_id', 'brand_id', 'volume', 'strength', 'price',
+                'product_name', 'category_name', 'brand_name']
+
+# Версия формата сохраненного среза; срез другого формата не загружается
+SNAPSHOT_FORMAT = 1
+
+# Столбцы таблиц среза, которые хранятся строками (цена - чтобы сохранить Decimal)
+TEXT_COLUMNS = ('product_name', 'category_name', 'brand_name', 'price')
+
+# Номера срезов в процессе: по ним кэш рекомендаций узнает о замене модели
+_generations = itertools.count(1)
+
+
+class InteractionAccumulator:
+    """
+    Потоковая агрегация позиций заказов по парам пользователь-товар.
+
+    add() принимает пачку позиций массивами, сворачивает ее по парам и
+    откладывает; когда отложенного становится вдвое больше уже свернутого,
+    все пачки сливаются в одну. Память пропорциональна числу различных
+    пар, а не длине истории заказов.
+    """
+
+    # Меньше этого числа пар пачки не сливаются
+    COMPACT_MIN = 1 << 16
+
     def __init__(self):
-        self.user_item_matrix = None
-        self.item_features = None
-        self.user_similarity = None
-        self.item_similarity = None
-        self.popular_items = None
-        
-    def get_db_connection(self):
-        """Создание соединения с базой данных"""
-        return psycopg2.connect(
-            dbname=os.getenv("DB_NAME", "alcohol_shop"),
-            user=os.getenv("DB_USER", "postgres"),
-            password=os.getenv("DB_PASSWORD", "123"),
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432")
+        self._keys = []
+        self._totals = []
+        self._counts = []
+        self._compacted = 0
+        self._pending = 0
+        self.rows = 0
+        self.last_order_id = 0
+        self._recent_orders = set()
+
+    def add(self, order_ids, user_ids, product_ids, quantities):
+        """Учет пачки позиций заказов (массивы одинаковой длины)"""
+        # ID пользователя и товара (SERIAL, 32 бита) упаковываются в один ключ
+        keys, inverse = np.unique((user_ids.astype(np.int64) << 32) | product_ids.astype(np.int64),
+                                  return_inverse=True)
+        self._keys.append(keys)
+        self._totals.append(np.bincount(inverse, weights=quantities, minlength=len(keys)))
+        self._counts.append(np.bincount(inverse, minlength=len(keys)).astype(np.float64))
+        self._pending += len(keys)
+        self.rows += len(order_ids)
+        if self._pending > max(self.COMPACT_MIN, 2 * self._compacted):
+            self._compact()
+
+        order_ids = np.unique(order_ids)
+        self.last_order_id = max(self.last_order_id, int(order_ids[-1]))
+        threshold = self.last_order_id - ORDER_ID_LOOKBACK
+        self._recent_orders.update(order_ids[order_ids > threshold].tolist())
+        if len(self._recent_orders) > 2 * ORDER_ID_LOOKBACK:
+            self._recent_orders = {order_id for order_id in self._recent_orders if order_id > threshold}
+
+    def _compact(self):
+        if len(self._keys) > 1:
+            keys, inverse = np.unique(np.concatenate(self._keys), return_inverse=True)
+            self._totals = [np.bincount(inverse, weights=np.concatenate(self._totals), minlength=len(keys))]
+            self._counts = [np.bincount(inverse, weights=np.concatenate(self._counts), minlength=len(keys))]
+            self._keys = [keys]
+        self._compacted = self._pending = len(self._keys[0]) if self._keys else 0
+
+    def result(self):
+        """
+        Returns:
+            (user_ids, product_ids, totals, counts) по различным парам
+        """
+        self._compact()
+        if not self._keys:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0), np.empty(0)
+        keys = self._keys[0]
+        return keys >> 32, keys & 0xFFFFFFFF, self._totals[0], self._counts[0]
+
+    @property
+    def recent_orders(self):
+        threshold = self.last_order_id - ORDER_ID_LOOKBACK
+        return frozenset(order_id for order_id in self._recent_orders if order_id > threshold)
+
+
+class RecommenderModel:
+    """
+    Неизменяемый срез обученной модели.
+
+    Содержит отображения ID -> строка/столбец, разреженную матрицу
+    пользователь-товар (CSR), нормированные строки пользователей, top-k
+    соседей товаров и справочники для выдачи. Срез не меняется после
+    построения: дообучение собирает новый срез, а RecommendationSystem
+    заменяет ссылку на него одним присваиванием, поэтому запрос, взявший
+    срез, видит согласованные данные до конца.
+    """
+
+    # Массивы и CSR-матрицы среза: сохраняются в .npy и открываются через mmap
+    ARRAYS = ('user_ids', 'item_ids')
+    MATRICES = ('user_item_matrix', 'counts', 'user_vectors', 'item_neighbors')
+    TABLES = ('item_features', 'popular_items', 'catalog')
+
+    def __init__(self, user_ids, user_index, item_ids, item_index, user_item_matrix, counts, item_neighbors,
+                 item_features, popular_items, item_info, catalog=None,
+                 last_order_id=0, recent_orders=frozenset(), updated_items=frozenset(),
+                 user_vectors=None, built_at=None, ann=None, user_ann=None):
+        """
+        Args:
+            user_ids, item_ids: ID пользователей и товаров в порядке строк и столбцов матрицы
+            user_index, item_index: обратные отображения ID -> номер строки/столбца
+            user_item_matrix: среднее количество на покупку по парам пользователь-товар (CSR)
+            counts: число покупок по парам пользователь-товар (CSR той же структуры)
+            item_neighbors: top-k соседей каждого товара (CSR: строка - товар, значения - схожесть)
+            item_features: DataFrame описаний купленных товаров
+            popular_items: DataFrame популярности по product_id
+            item_info: описание товара для выдачи по product_id
+            catalog: DataFrame всех товаров каталога (в том числе без заказов)
+            last_order_id: последний учтенный orders.id
+            recent_orders: уже учтенные заказы окна ORDER_ID_LOOKBACK
+            updated_items: товары, соседи которых изменились после загрузки индекса
+            user_vectors: нормированные строки user_item_matrix (вычисляются, если не заданы)
+            built_at: время построения среза
+            ann: параметры RandomProjectionLSH для приближенного поиска соседей или None
+            user_ann: готовый LSH-индекс пользователей (строится по ann, если не задан)
+        """
+        self.user_ids = user_ids
+        self.user_index = user_index
+        self.item_ids = item_ids
+        self.item_index = item_index
+        self.user_item_matrix = user_item_matrix
+        self.counts = counts
+        # После L2-нормировки скалярное произведение строк равно косинусной схожести
+        if user_vectors is None:
+            user_vectors = normalize(user_item_matrix, norm='l2', axis=1)
+        self.user_vectors = user_vectors
+        # Приближенный режим: индекс ближайших пользователей строится вместе со срезом
+        self.ann = ann
+        if ann and user_ann is None:
+            user_ann = RandomProjectionLSH(**ann).fit(user_vectors)
+        self.user_ann = user_ann
+        self.item_neighbors = item_neighbors
+        self.item_features = item_features
+        self.popular_items = popular_items
+        self.item_info = item_info
+        self.catalog = catalog
+        self.last_order_id = last_order_id
+        self.recent_orders = recent_orders
+        self.updated_items = updated_items
+        self.built_at = built_at or datetime.now()
+        self.generation = next(_generations)
+        # Популярные товары для выдачи готовятся один раз на срез
+        self.popular = _popular_records(popular_items.head(POPULAR_LIST_SIZE))
+
+    @property
+    def version(self):
+        """Имя версии среза: время построения и последний учтенный заказ"""
+        return f"{self.built_at:%Y%m%d%H%M%S}-{self.last_order_id}"
+
+    @classmethod
+    def from_orders(cls, orders_data, catalog, n_neighbors, ann=None):
+        """
+        Построение среза по всей истории заказов
+
+        Args:
+            orders_data: DataFrame со столбцами запроса ORDERS_QUERY
+            catalog: DataFrame всех товаров (product_id, category_id, brand_id, volume,
+                strength, price, product_name, category_name, brand_name) или None
+            n_neighbors: сколько ближайших товаров хранить для каждого товара
+            ann: параметры RandomProjectionLSH или None для точного поиска соседей
+        """
+        pairs = orders_data.groupby(['user_id', 'product_id'])['quantity'].agg(['sum', 'count'])
+
+        # Граница для дообучения (в синтетических данных без order_id дообучение начнется с нуля)
+        last_order_id, recent_orders = 0, frozenset()
+        if 'order_id' in orders_data:
+            order_ids = orders_data['order_id'].to_numpy(dtype=np.int64)
+            last_order_id = int(order_ids.max())
+            recent_orders = frozenset(order_ids[order_ids > last_order_id - ORDER_ID_LOOKBACK].tolist())
+
+        # Описание из каталога актуальнее и покрывает товары без заказов
+        products = orders_data[ITEM_COLUMNS] if catalog is None else pd.concat([orders_data[ITEM_COLUMNS], catalog])
+        return cls.from_interactions(
+            pairs.index.get_level_values('user_id').to_numpy(), pairs.index.get_level_values('product_id').to_numpy(),
+            pairs['sum'].to_numpy(dtype=np.float64), pairs['count'].to_numpy(dtype=np.float64),
+            products, n_neighbors, catalog, last_order_id, recent_orders, ann)
+
+    @classmethod
+    def from_interactions(cls, user_ids, product_ids, totals, counts, products, n_neighbors, catalog=None,
+                          last_order_id=0, recent_orders=frozenset(), ann=None):
+        """
+        Построение среза по агрегатам пар пользователь-товар
+
+        Args:
+            user_ids, product_ids: пары пользователь-товар (каждая пара один раз)
+            totals, counts: суммарное количество и число покупок по парам
+            products: DataFrame описаний товаров (столбцы ITEM_COLUMNS); при
+                повторах product_id используется последнее описание
+            n_neighbors: сколько ближайших товаров хранить для каждого товара
+            catalog: DataFrame всех товаров каталога (для соседей по описанию)
+            last_order_id: последний учтенный orders.id
+            recent_orders: уже учтенные заказы окна ORDER_ID_LOOKBACK
+            ann: параметры RandomProjectionLSH или None для точного поиска соседей
+        """
+        # Создаем разреженную матрицу пользователь-товар с целочисленными индексами
+        user_ids, user_pos = np.unique(user_ids, return_inverse=True)
+        item_ids, item_pos = np.unique(product_ids, return_inverse=True)
+        user_index = {int(user_id): idx for idx, user_id in enumerate(user_ids)}
+        item_index = {int(item_id): idx for idx, item_id in enumerate(item_ids)}
+
+        # Повторные покупки товара усредняются, как раньше в pivot_table (aggfunc='mean')
+        shape = (len(user_ids), len(item_ids))
+        totals = sparse.csr_matrix((totals, (user_pos, item_pos)), shape=shape)
+        counts = sparse.csr_matrix((counts, (user_pos, item_pos)), shape=shape)
+        user_item_matrix = _mean_matrix(totals, counts)
+        # Ближайшие товары по косинусной схожести столбцов
+        item_neighbors = top_k_item_neighbors(user_item_matrix, n_neighbors, ann=ann)
+
+        # Сохраняем информацию о купленных товарах
+        products = products.drop_duplicates('product_id', keep='last')
+        item_features = products[products['product_id'].isin(item_ids)]
+
+        # Вычисляем популярные товары: суммарное количество по столбцам матрицы
+        quantity = np.rint(np.asarray(totals.sum(axis=0)).ravel()).astype(np.int64)
+        popular_items = pd.DataFrame({'quantity': quantity}, index=pd.Index(item_ids, name='product_id')).join(
+            item_features.set_index('product_id')[['product_name', 'category_name', 'brand_name', 'price']],
+            how='inner'
+        ).sort_values('quantity', ascending=False, kind='stable')
+
+        # Справочник товаров для выдачи, чтобы не фильтровать item_features на каждый запрос
+        item_info = _build_item_info(products)
+
+        return cls(user_ids, user_index, item_ids, item_index, user_item_matrix, counts, item_neighbors,
+                   item_features, popular_items, item_info, catalog, last_order_id, recent_orders, ann=ann)
+
+    def with_orders(self, new_orders, n_neighbors):
+        """
+        Новый срез с учетом новых позиций заказов, без полного пересчета
+
+        Новые пользователи и товары добавляются в конец отображений, суммы и
+        число покупок складываются с прежними, а соседи пересчитываются только
+        для товаров из новых заказов: схожесть остальных пар товаров от них не
+        меняется. У прочих товаров обновляются оценки соседства с затронутыми
+        товарами; если затронутый товар выбыл из их top-k, освободившееся место
+        заполнится при следующем полном построении. В приближенном режиме коды
+        LSH пересчитываются только у пользователей из новых заказов.
+        Отмененные после учета заказы остаются в модели до полного построения.
+
+        Args:
+            new_orders: DataFrame со столбцами запроса ORDERS_QUERY
+            n_neighbors: сколько ближайших товаров хранить для каждого товара
+        """
+        # Новые ID добавляются в конец, прежние строки и столбцы сохраняют номера
+        user_ids, user_index, user_pos = _extend_index(
+            self.user_ids, self.user_index, new_orders['user_id'].to_numpy())
+        item_ids, item_index, item_pos = _extend_index(
+            self.item_ids, self.item_index, new_orders['product_id'].to_numpy())
+        shape = (len(user_ids), len(item_ids))
+
+        # Суммы восстанавливаются из средних: у user_item_matrix и counts одна структура
+        totals = self.user_item_matrix.copy()
+        totals.data *= self.counts.data
+        delta_totals, delta_counts = _interactions(new_orders, user_pos, item_pos, shape)
+        totals = _resized(totals, shape) + delta_totals
+        counts = _resized(self.counts, shape) + delta_counts
+        totals.sort_indices()
+        counts.sort_indices()
+        user_item_matrix = _mean_matrix(totals, counts)
+        user_vectors = normalize(user_item_matrix, norm='l2', axis=1)
+        user_ann = self.user_ann.with_rows(user_vectors, np.unique(user_pos)) if self.user_ann else None
+
+        touched = np.unique(item_pos)
+        item_neighbors = refresh_item_neighbors(user_item_matrix, self.item_neighbors, touched, n_neighbors)
+
+        # Справочники товаров и популярность
+        item_features = pd.concat([self.item_features, new_orders[ITEM_COLUMNS]]).drop_duplicates()
+        # Количество прибавляется к уже известным товарам, новые товары дописываются один раз
+        added = _aggregate_popular(new_orders)
+        known = added.index.isin(self.popular_items.index)
+        popular_items = self.popular_items.copy()
+        popular_items['quantity'] = popular_items['quantity'].add(added.loc[known, 'quantity'], fill_value=0) \
+            .astype(self.popular_items['quantity'].dtype)
+        popular_items = pd.concat([popular_items, added.loc[~known, popular_items.columns]])
+        popular_items = popular_items.sort_values('quantity', ascending=False, kind='stable')
+        item_info = {**self.item_info, **_build_item_info(new_orders)}
+
+        order_ids = new_orders['order_id'].to_numpy(dtype=np.int64)
+        last_order_id = max(self.last_order_id, int(order_ids.max()))
+        recent_orders = frozenset(
+            order_id for order_id in self.recent_orders.union(order_ids.tolist())
+            if order_id > last_order_id - ORDER_ID_LOOKBACK
+        )
+
+        return RecommenderModel(user_ids, user_index, item_ids, item_index, user_item_matrix, counts,
+                                item_neighbors, item_features, popular_items, item_info, self.catalog,
+                                last_order_id, recent_orders,
+                                self.updated_items | frozenset(item_ids[touched].tolist()),
+                                user_vectors=user_vectors, ann=self.ann, user_ann=user_ann)
+
+    def save(self, path, n_neighbors):
+        """
+        Сохранение среза в каталог path без pickle
+
+        Массивы и части CSR-матриц (data, indices, indptr) пишутся в
+        отдельные .npy, таблицы товаров и популярности - в .npz по столбцам,
+        остальное - в meta.json.
+
+        Args:
+            path: каталог среза (создается)
+            n_neighbors: с каким числом соседей построен срез
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        for name in self.MATRICES:
+            matrix = getattr(self, name)
+            for part in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(path, f'{name}.{part}.npy'), getattr(matrix, part))
+        np.save(os.path.join(path, 'updated_items.npy'), np.array(sorted(self.updated_items), dtype=np.int64))
+        for name in self.TABLES:
+            table = getattr(self, name)
+            if table is None:
+                continue
+            if name == 'popular_items':
+                table = table.rename_axis('product_id').reset_index()
+            np.savez(os.path.join(path, f'{name}.npz'), **_table_arrays(table))
+
+        meta = {
+            'format': SNAPSHOT_FORMAT,
+            'version': self.version,
+            'built_at': self.built_at.isoformat(),
+            'n_neighbors': n_neighbors,
+            'ann': self.ann,
+            'users': len(self.user_ids),
+            'items': len(self.item_ids),
+            'interactions': int(self.counts.nnz),
+            'last_order_id': self.last_order_id,
+            'recent_orders': sorted(self.recent_orders)
+        }
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Загрузка среза, сохраненного save()
+
+        CSR-матрицы собираются поверх открытых через mmap массивов без
+        копирования, поэтому процессы, открывшие один срез, делят его
+        страницы через кэш ОС. В памяти процесса строятся только словари
+        ID -> номер и таблицы товаров.
+
+        Args:
+            path: каталог среза
+            mmap: открыть массивы через mmap вместо чтения в память
+
+        Returns:
+            (срез, meta)
+        """
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Неподдерживаемый формат среза: {meta.get('format')}")
+
+        def array(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None,
+                           allow_pickle=False)
+
+        user_ids, item_ids = array('user_ids'), array('item_ids')
+        shapes = {'user_item_matrix': (len(user_ids), len(item_ids)), 'counts': (len(user_ids), len(item_ids)),
+                  'user_vectors': (len(user_ids), len(item_ids)), 'item_neighbors': (len(item_ids), len(item_ids))}
+        matrices = {
+            name: sparse.csr_matrix(
+                (array(f'{name}.data'), array(f'{name}.indices'), array(f'{name}.indptr')),
+                shape=shapes[name], copy=False)
+            for name in cls.MATRICES
+        }
+
+        tables = {}
+        for name in cls.TABLES:
+            table_path = os.path.join(path, f'{name}.npz')
+            tables[name] = _table_from_arrays(np.load(table_path, allow_pickle=False)) \
+                if os.path.exists(table_path) else None
+        popular_items = tables['popular_items'].set_index('product_id')
+        item_features, catalog = tables['item_features'], tables['catalog']
+        described = item_features if catalog is None else pd.concat([item_features, catalog])
+
+        model = cls(
+            user_ids, {int(user_id): idx for idx, user_id in enumerate(user_ids)},
+            item_ids, {int(item_id): idx for idx, item_id in enumerate(item_ids)},
+            matrices['user_item_matrix'], matrices['counts'], matrices['item_neighbors'],
+            item_features, popular_items, _build_item_info(described), catalog,
+            meta['last_order_id'], frozenset(meta['recent_orders']),
+            frozenset(array('updated_items').tolist()),
+            user_vectors=matrices['user_vectors'],
+            built_at=datetime.fromisoformat(meta['built_at']),
+            ann=meta.get('ann')
         )
+        return model, meta
+
+
+class RecommendationSystem:
+    def __init__(self, n_neighbors=None, snapshot_path=None, snapshot_keep=None, chunk_size=None, ann=None):
+        """
+        Args:
+            n_neighbors: сколько ближайших товаров хранить для каждого товара
+            snapshot_path: каталог сохраненных срезов модели ('' - не сохранять и не загружать)
+            snapshot_keep: сколько последних версий среза хранить
+            chunk_size: по сколько строк истории заказов читать при построении
+            ann: приближенный поиск соседей пользователей и товаров (RandomProjectionLSH);
+                True - с параметрами из окружения, словарь - параметры LSH,
+                False - точный поиск; по умолчанию RECOMMENDER_ANN
+        """
+        self.n_neighbors = n_neighbors or int(os.getenv("RECOMMENDER_ITEM_NEIGHBORS", "50"))
+        self.snapshot_path = snapshot_path if snapshot_path is not None \
+            else os.getenv("RECOMMENDER_SNAPSHOT_PATH", "models/recommender")
+        self.snapshot_keep = snapshot_keep or int(os.getenv("RECOMMENDER_SNAPSHOT_KEEP", "3"))
+        self.chunk_size = chunk_size or int(os.getenv("RECOMMENDER_LOAD_CHUNK_SIZE", "50000"))
+        if ann is None:
+            ann = os.getenv("RECOMMENDER_ANN", "0") == "1"
+        if ann is True:
+            ann = {
+                'n_tables': int(os.getenv("RECOMMENDER_ANN_TABLES", "16")),
+                'n_bits': int(os.getenv("RECOMMENDER_ANN_BITS", "12")),
+                'probes': os.getenv("RECOMMENDER_ANN_PROBES", "1") == "1"
+            }
+        # Параметры RandomProjectionLSH или None (точный режим)
+        self.ann = ann or None
+        # Сколько ближайших пользователей учитывать в приближенном режиме
+        self.ann_user_neighbors = int(os.getenv("RECOMMENDER_ANN_USER_NEIGHBORS", "100"))
+        # Текущий срез модели (RecommenderModel); None, пока первое построение не завершилось
+        self.model = None
+        # Предвычисленный индекс соседей (ItemNeighborIndex), если загружен
+        self.neighbor_index = None
+        # Популярные товары из БД на время построения модели
+        self._fallback_popular = None
+        # Построение и дообучение выполняются по одному
+        self._update_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.model is not None
+
+    @property
+    def generation(self):
+        """Номер текущего среза (0, пока модель не построена)"""
+        model = self.model
+        return model.generation if model is not None else 0
+
+    @property
+    def last_order_id(self):
+        model = self.model
+        return model.last_order_id if model is not None else 0
+
+    def get_db_connection(self):
+        """Получение соединения с базой данных из общего пула"""
+        return get_pool().getconn()
+
+    def release_db_connection(self, conn):
+        """Возврат соединения в пул"""
+        get_pool().putconn(conn)
 
     def prepare_data(self):
-        """Подготовка данных для рекомендательной системы"""
+        """
+        Подготовка данных для рекомендательной системы
+
+        История заказов читается именованным (серверным) курсором пачками по
+        chunk_size строк и сразу сворачивается по парам пользователь-товар
+        (InteractionAccumulator), описания товаров берутся из каталога.
+        """
+        accumulator = InteractionAccumulator()
         conn = self.get_db_connection()
         try:
-            # Получаем историю заказов
-            orders_query = """
-                SELECT o.user_id, oi.product_id, oi.quantity, o.created_at,
-                       p.category_id, p.brand_id, p.volume, p.strength,
+            # Описание всех товаров каталога - для выдачи и соседей по признакам
+            catalog_query = """
+                SELECT p.id as product_id, p.category_id, p.brand_id, p.volume, p.strength,
                        p.price, p.name as product_name,
                        c.name as category_name,
                        b.name as brand_name
-                FROM orders o
-                JOIN order_items oi ON o.id = oi.order_id
-                JOIN products p ON oi.product_id = p.id
+                FROM products p
                 JOIN categories c ON p.category_id = c.id
                 JOIN brands b ON p.brand_id = b.id
-                WHERE o.status = 'paid'
-                ORDER BY o.created_at
             """
-            
+
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(orders_query)
-                orders_data = pd.DataFrame(cursor.fetchall())
-            
-            if orders_data.empty:
-                raise ValueError("Нет данных о заказах в базе данных")
-            
-            print(f"Загружено записей о заказах: {len(orders_data)}")
-            
-            # Создаем матрицу пользователь-товар
-            self.user_item_matrix = orders_data.pivot_table(
-                index='user_id',
-                columns='product_id',
-                values='quantity',
-                fill_value=0
-            )
-            
-            # Сохраняем информацию о товарах
-            self.item_features = orders_data[['product_id', 'category_id', 'brand_id', 
-                                            'volume', 'strength', 'price', 'product_name',
-                                            'category_name', 'brand_name']].drop_duplicates()
-            
-            # Вычисляем популярные товары
-            self.popular_items = orders_data.groupby('product_id').agg({
-                'quantity': 'sum',
-                'product_name': 'first',
-                'category_name': 'first',
-                'brand_name': 'first',
-                'price': 'first'
-            }).sort_values('quantity', ascending=False)
-            
-            return True
-            
+                cursor.execute(catalog_query)
+                catalog = pd.DataFrame(cursor.fetchall(), columns=ITEM_COLUMNS)
+
+            # Получаем историю заказов
+            with conn.cursor(name='recommender_interactions') as cursor:
+                cursor.itersize = self.chunk_size
+                cursor.execute(INTERACTIONS_QUERY)
+                while True:
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        break
+                    chunk = np.array(rows, dtype=np.int64)
+                    accumulator.add(chunk[:, 0], chunk[:, 1], chunk[:, 2], chunk[:, 3])
         finally:
-            conn.close()
+            self.release_db_connection(conn)
+
+        if not accumulator.rows:
+            raise ValueError("Нет данных о заказах в базе данных")
+
+        print(f"Загружено записей о заказах: {accumulator.rows}")
+        user_ids, product_ids, totals, counts = accumulator.result()
+        self.model = RecommenderModel.from_interactions(
+            user_ids, product_ids, totals, counts, catalog, self.n_neighbors, catalog,
+            accumulator.last_order_id, accumulator.recent_orders, self.ann)
+        return True
+
+    def prepare_from_orders(self, orders_data, catalog=None):
+        """
+        Построение модели по истории заказов и замена текущего среза
+
+        Args:
+            orders_data: DataFrame со столбцами запроса ORDERS_QUERY
+            catalog: DataFrame всех товаров (product_id, category_id, brand_id, volume,
+                strength, price, product_name, category_name, brand_name)
+        """
+        self.model = RecommenderModel.from_orders(orders_data, catalog, self.n_neighbors, self.ann)
+        return True
 
     def compute_similarities(self):
-        """Вычисление матриц схожести"""
-        if self.user_item_matrix is None:
+        """
+        Пересчет соседей товаров текущего среза (например, после изменения n_neighbors)
+
+        Полные матрицы пользователи x пользователи и товары x товары не строятся:
+        строки пользователей нормируются, и схожесть с конкретным пользователем
+        считается при запросе рекомендаций, а для товаров сохраняются только
+        n_neighbors ближайших соседей. Обычно соседи строятся вместе со срезом
+        в prepare_data().
+        """
+        model = self.model
+        if model is None:
             raise ValueError("Сначала выполните prepare_data()")
-        
-        # Вычисляем схожесть пользователей
-        self.user_similarity = cosine_similarity(self.user_item_matrix)
-        
-        # Вычисляем схожесть товаров
-        self.item_similarity = cosine_similarity(self.user_item_matrix.T)
-        
+
+        self.model = RecommenderModel(
+            model.user_ids, model.user_index, model.item_ids, model.item_index,
+            model.user_item_matrix, model.counts,
+            top_k_item_neighbors(model.user_item_matrix, self.n_neighbors, ann=self.ann),
+            model.item_features, model.popular_items, model.item_info, model.catalog,
+            model.last_order_id, model.recent_orders, user_vectors=model.user_vectors, ann=self.ann,
+            user_ann=model.user_ann if model.ann == self.ann else None)
+
         print("Матрицы схожести вычислены")
 
+    def build(self):
+        """
+        Полное построение модели по БД (выполняется фоновым потоком RecommenderUpdater)
+
+        Построенный срез сохраняется в snapshot_path для быстрого старта
+        других процессов.
+
+        Returns:
+            количество учтенных позиций заказов
+        """
+        with self._update_lock:
+            self.prepare_data()
+            if self.snapshot_path:
+                try:
+                    self.save_snapshot()
+                except OSError as e:
+                    logger.error("Не удалось сохранить срез модели рекомендаций: %s", e)
+            return int(self.model.counts.sum())
+
+    def save_snapshot(self, path=None):
+        """
+        Сохранение текущего среза новой версией в каталоге срезов
+
+        Версия пишется во временный каталог и переименовывается, затем файл
+        CURRENT атомарно переключается на нее; старые версии сверх
+        snapshot_keep удаляются (процессы, открывшие их через mmap, продолжают
+        работать: файлы остаются доступны до закрытия).
+
+        Returns:
+            имя сохраненной версии
+        """
+        path = path or self.snapshot_path
+        model = self.model
+        if model is None:
+            raise ValueError("Сначала выполните prepare_data()")
+
+        version_path = os.path.join(path, model.version)
+        if not os.path.exists(version_path):
+            temp_path = os.path.join(path, f'.{model.version}.{os.getpid()}')
+            model.save(temp_path, self.n_neighbors)
+            try:
+                os.rename(temp_path, version_path)
+            except OSError:
+                # Ту же версию уже сохранил другой процесс
+                shutil.rmtree(temp_path, ignore_errors=True)
+                if not os.path.exists(version_path):
+                    raise
+
+        current_temp = os.path.join(path, f'.CURRENT.{os.getpid()}')
+        with open(current_temp, 'w', encoding='utf-8') as f:
+            f.write(model.version)
+        os.replace(current_temp, os.path.join(path, 'CURRENT'))
+
+        versions = sorted(name for name in os.listdir(path)
+                          if not name.startswith('.') and os.path.isdir(os.path.join(path, name)))
+        for name in versions[:-self.snapshot_keep]:
+            if name != model.version:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+        return model.version
+
+    def load_snapshot(self, path=None, mmap=True):
+        """
+        Загрузка последней сохраненной версии среза вместо построения по БД
+
+        Returns:
+            True, если срез найден и загружен
+        """
+        path = path or self.snapshot_path
+        current = os.path.join(path, 'CURRENT') if path else None
+        if not current or not os.path.exists(current):
+            return False
+        with open(current, encoding='utf-8') as f:
+            version = f.read().strip()
+        model, meta = RecommenderModel.load(os.path.join(path, version), mmap=mmap)
+        if meta.get('n_neighbors') != self.n_neighbors:
+            logger.warning("Срез %s построен с n_neighbors=%s, нужно %s - не используется",
+                           version, meta.get('n_neighbors'), self.n_neighbors)
+            return False
+        if meta.get('ann') != self.ann:
+            logger.warning("Срез %s построен с ann=%s, нужно %s - не используется",
+                           version, meta.get('ann'), self.ann)
+            return False
+        self.model = model
+        return True
+
+    def update_from_db(self):
+        """
+        Дообучение по оплаченным заказам, появившимся после last_order_id
+
+        Если модель еще не построена, сначала загружается сохраненный срез
+        (тогда дообучение догоняет заказы, оформленные после его построения),
+        а без среза выполняется полное построение.
+
+        Returns:
+            количество учтенных позиций заказов
+        """
+        if self.model is None:
+            loaded = False
+            if self.snapshot_path:
+                try:
+                    loaded = self.load_snapshot()
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error("Не удалось загрузить срез модели рекомендаций: %s", e)
+            if not loaded:
+                return self.build()
+
+        with self._update_lock:
+            conn = self.get_db_connection()
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute(ORDERS_QUERY, (max(self.last_order_id - ORDER_ID_LOOKBACK, 0),))
+                    new_orders = pd.DataFrame(cursor.fetchall())
+            finally:
+                self.release_db_connection(conn)
+
+            if new_orders.empty:
+                return 0
+            new_orders = new_orders[~new_orders['order_id'].isin(self.model.recent_orders)]
+            return self.update_from_orders(new_orders)
+
+    def update_from_orders(self, new_orders):
+        """
+        Учет новых позиций заказов без полного пересчета модели
+
+        Новый срез собирается RecommenderModel.with_orders(), запросы тем
+        временем обслуживаются прежним.
+
+        Args:
+            new_orders: DataFrame со столбцами запроса ORDERS_QUERY
+
+        Returns:
+            количество учтенных позиций заказов
+        """
+        if new_orders.empty:
+            return 0
+        if self.model is None:
+            raise ValueError("Сначала выполните prepare_data()")
+        self.model = self.model.with_orders(new_orders, self.n_neighbors)
+        return len(new_orders)
+
     def get_user_recommendations(self, user_id, n_recommendations=5):
         """
         Получение рекомендаций для пользователя
-        
+
         Args:
             user_id: ID пользователя
             n_recommendations: количество рекомендаций
         """
-        if self.user_similarity is None:
-            self.compute_similarities()
-        
-        if user_id not in self.user_item_matrix.index:
-            # Если пользователь новый, возвращаем популярные товары
+        # Срез берется один раз: дообучение может заменить его во время запроса
+        model = self.model
+        if model is None or user_id not in model.user_index:
+            # Если модель еще строится или пользователь новый, возвращаем популярные товары
             return self.get_popular_recommendations(n_recommendations)
-        
+
         # Получаем индекс пользователя
-        user_idx = self.user_item_matrix.index.get_loc(user_id)
-        
-        # Получаем похожих пользователей
-        similar_users = self.user_similarity[user_idx]
-        
-        # Получаем товары, которые пользователь еще не покупал
-        user_items = set(self.user_item_matrix.columns[self.user_item_matrix.iloc[user_idx] > 0])
-        all_items = set(self.user_item_matrix.columns)
-        new_items = all_items - user_items
-        
-        if not new_items:
+        user_idx = model.user_index[user_id]
+
+        # Товары, которые пользователь уже покупал, исключаются из выдачи
+        purchased = model.user_item_matrix[user_idx].indices
+        n_candidates = len(model.item_ids) - len(purchased)
+        if n_candidates == 0:
             return self.get_popular_recommendations(n_recommendations)
-        
-        # Вычисляем предсказанные оценки для новых товаров
-        predictions = []
-        for item in new_items:
-            item_idx = self.user_item_matrix.columns.get_loc(item)
-            # Используем оценки похожих пользователей
-            item_ratings = self.user_item_matrix.iloc[:, item_idx]
-            pred_rating = np.sum(similar_users * item_ratings) / np.sum(np.abs(similar_users))
-            predictions.append((item, pred_rating))
-        
-        # Сортируем по предсказанной оценке
-        predictions.sort(key=lambda x: x[1], reverse=True)
-        
-        # Формируем рекомендации
-        recommendations = []
-        for item_id, _ in predictions[:n_recommendations]:
-            item_info = self.item_features[self.item_features['product_id'] == item_id].iloc[0]
-            recommendations.append({
-                'product_id': item_id,
-                'name': item_info['product_name'],
-                'category': item_info['category_name'],
-                'brand': item_info['brand_name'],
-                'price': item_info['price']
-            })
-        
-        return recommendations
+
+        if model.user_ann is not None:
+            # Приближенный режим: только ближайшие пользователи из LSH-индекса;
+            # сам пользователь (схожесть 1) входит в норму, как в точном режиме
+            neighbors, similarity = model.user_ann.query(user_idx, self.ann_user_neighbors)
+            norm = 1.0 + similarity.sum()
+            predictions = model.user_item_matrix[neighbors].T @ similarity
+        else:
+            # Схожесть считается только с пользователями, у которых есть общие товары,
+            # предсказания - произведением разреженной строки схожести на матрицу оценок
+            similar_users = model.user_vectors @ model.user_vectors[user_idx].T
+            norm = abs(similar_users).sum()
+            predictions = (similar_users.T @ model.user_item_matrix).toarray().ravel()
+        if norm > 0:
+            predictions /= norm
+        predictions[purchased] = -np.inf
+
+        top = self._top_k(predictions, min(n_recommendations, n_candidates))
+        return [self._describe_item(model, model.item_ids[idx]) for idx in top]
+
+    @staticmethod
+    def _top_k(scores, k):
+        """Индексы k наибольших значений по убыванию (argpartition + сортировка только k)"""
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    @staticmethod
+    def _describe_item(model, item_id, **extra):
+        item_id = int(item_id)
+        info = model.item_info[item_id]
+        return {
+            'product_id': item_id,
+            'name': info['name'],
+            'category': info['category'],
+            'brand': info['brand'],
+            'price': info['price'],
+            **extra
+        }
+
+    def load_neighbor_index(self, path):
+        """
+        Подключение предвычисленного индекса соседей (item_neighbors.py)
+
+        Returns:
+            True, если индекс найден и загружен
+        """
+        if not os.path.exists(os.path.join(path, 'product_ids.npy')):
+            return False
+        self.neighbor_index = ItemNeighborIndex.load(path)
+        return True
 
     def get_similar_items(self, product_id, n_recommendations=5):
         """
         Получение похожих товаров
-        
+
+        Сначала используется предвычисленный индекс (O(K) на запрос), затем
+        соседи из текущего среза модели; для товаров без истории заказов
+        похожие подбираются по описанию (категория, бренд, объем, крепость).
+        Пока модель строится, соседи берутся только из индекса, а описания
+        товаров - одним запросом к БД.
+
         Args:
             product_id: ID товара
             n_recommendations: количество рекомендаций
         """
-        if self.item_similarity is None:
-            self.compute_similarities()
-        
-        if product_id not in self.user_item_matrix.columns:
+        model = self.model
+        if model is None:
+            if self.neighbor_index is None:
+                raise ValueError("Модель рекомендаций еще не построена")
+            return self._similar_from_index(product_id, n_recommendations)
+
+        # Для товаров, дообученных после построения индекса, индекс устарел
+        neighbors = None
+        if self.neighbor_index is not None and product_id not in model.updated_items:
+            neighbors = self.neighbor_index.neighbors(product_id, n_recommendations)
+
+        if not neighbors and product_id in model.item_index:
+            # Соседи товара уже отобраны при построении среза
+            row = model.item_neighbors[model.item_index[product_id]]
+            order = np.argsort(-row.data, kind='stable')[:n_recommendations]
+            neighbors = list(zip(model.item_ids[row.indices[order]], row.data[order]))
+
+        if not neighbors and model.catalog is not None and product_id in model.item_info:
+            ids, scores = content_neighbors(model.catalog, [product_id], n_recommendations)
+            neighbors = [(item_id, score) for item_id, score in zip(ids[0], scores[0]) if item_id >= 0]
+
+        if neighbors is None:
             raise ValueError("Товар не найден")
-        
-        # Получаем индекс товара
-        item_idx = self.user_item_matrix.columns.get_loc(product_id)
-        
-        # Получаем схожесть с другими товарами
-        item_similarities = self.item_similarity[item_idx]
-        
-        # Получаем индексы самых похожих товаров (исключая сам товар)
-        similar_indices = np.argsort(item_similarities)[::-1][1:n_recommendations+1]
-        
+
         # Формируем рекомендации
-        recommendations = []
-        for idx in similar_indices:
-            item_id = self.user_item_matrix.columns[idx]
-            item_info = self.item_features[self.item_features['product_id'] == item_id].iloc[0]
-            recommendations.append({
-                'product_id': item_id,
-                'name': item_info['product_name'],
-                'category': item_info['category_name'],
-                'brand': item_info['brand_name'],
-                'price': item_info['price'],
-                'similarity': item_similarities[idx]
-            })
-        
-        return recommendations
+        return [self._describe_item(model, item_id, similarity=float(similarity))
+                for item_id, similarity in neighbors if int(item_id) in model.item_info]
+
+    def _similar_from_index(self, product_id, n_recommendations):
+        neighbors = self.neighbor_index.neighbors(product_id, n_recommendations)
+        if neighbors is None:
+            raise ValueError("Товар не найден")
+        if not neighbors:
+            return []
+
+        conn = self.get_db_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(ITEMS_QUERY, ([item_id for item_id, _ in neighbors],))
+                rows = {row['product_id']: row for row in cursor.fetchall()}
+        finally:
+            self.release_db_connection(conn)
+        # Товары, удаленные после построения индекса, пропускаются
+        return [{
+            'product_id': item_id,
+            'name': rows[item_id]['product_name'],
+            'category': rows[item_id]['category_name'],
+            'brand': rows[item_id]['brand_name'],
+            'price': rows[item_id]['price'],
+            'similarity': float(similarity)
+        } for item_id, similarity in neighbors if item_id in rows]
 
     def get_popular_recommendations(self, n_recommendations=5):
         """
         Получение популярных товаров
-        
+
+        Пока модель строится, популярность берется одним агрегирующим
+        запросом к БД.
+
         Args:
             n_recommendations: количество рекомендаций
         """
-        if self.popular_items is None:
-            raise ValueError("Сначала выполните prepare_data()")
-        
-        recommendations = []
-        for idx, row in self.popular_items.head(n_recommendations).iterrows():
-            recommendations.append({
-                'product_id': idx,
+        model = self.model
+        if model is None:
+            return self._popular_from_db(n_recommendations)
+        if n_recommendations > POPULAR_LIST_SIZE:
+            return _popular_records(model.popular_items.head(n_recommendations))
+        return model.popular[:n_recommendations]
+
+    def _popular_from_db(self, n_recommendations):
+        if self._fallback_popular is None or n_recommendations > POPULAR_FALLBACK_SIZE:
+            conn = self.get_db_connection()
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute(POPULAR_QUERY, (max(n_recommendations, POPULAR_FALLBACK_SIZE),))
+                    rows = cursor.fetchall()
+            finally:
+                self.release_db_connection(conn)
+            self._fallback_popular = [{
+                'product_id': int(row['product_id']),
                 'name': row['product_name'],
                 'category': row['category_name'],
                 'brand': row['brand_name'],
                 'price': row['price'],
-                'popularity': row['quantity']
-            })
-        
-        return recommendations
+                'popularity': int(row['quantity'])
+            } for row in rows]
+        return self._fallback_popular[:n_recommendations]
 
     def get_category_recommendations(self, category_id, n_recommendations=5):
         """
         Получение рекомендаций по категории
-        
+
         Args:
             category_id: ID категории
             n_recommendations: количество рекомендаций
         """
-        if self.popular_items is None:
+        model = self.model
+        if model is None:
             raise ValueError("Сначала выполните prepare_data()")
-        
+
         # Получаем популярные товары в категории
-        category_items = self.item_features[self.item_features['category_id'] == category_id]
-        category_popular = self.popular_items[self.popular_items.index.isin(category_items['product_id'])]
-        
-        recommendations = []
-        for idx, row in category_popular.head(n_recommendations).iterrows():
-            recommendations.append({
-                'product_id': idx,
-                'name': row['product_name'],
-                'category': row['category_name'],
-                'brand': row['brand_name'],
-                'price': row['price'],
-                'popularity': row['quantity']
-            })
-        
-        return recommendations
+        category_items = model.item_features[model.item_features['category_id'] == category_id]
+        category_popular = model.popular_items[model.popular_items.index.isin(category_items['product_id'])]
+
+        return _popular_records(category_popular.head(n_recommendations))
+
+
+def top_k_item_neighbors(user_item_matrix, k, block_bytes=32 * 1024 * 1024, ann=None):
+    """
+    Top-k соседей каждого товара без построения полной матрицы товары x товары
+
+    Схожесть считается блоками строк так, чтобы плотный блок занимал
+    не больше block_bytes; в результат попадают только соседи с
+    положительной схожестью, сам товар исключается. С параметрами ann
+    соседи ищутся приближенно среди кандидатов RandomProjectionLSH:
+    время растет с числом товаров линейно, а не квадратично.
+    """
+    n_items = user_item_matrix.shape[1]
+    item_vectors = normalize(user_item_matrix.T.tocsr(), norm='l2', axis=1)
+    k = min(k, n_items - 1)
+    if k <= 0:
+        return sparse.csr_matrix((n_items, n_items))
+    if ann:
+        return RandomProjectionLSH(**ann).fit(item_vectors).neighbors(k)
+
+    item_vectors_t = item_vectors.T.tocsr()
+
+    block_size = max(1, block_bytes // (8 * n_items))
+    rows, cols, values = [], [], []
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+        block = (item_vectors[start:stop] @ item_vectors_t).toarray()
+        block[np.arange(stop - start), np.arange(start, stop)] = 0
+        neighbors = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        similarity = np.take_along_axis(block, neighbors, axis=1)
+        keep = similarity > 0
+        rows.append(np.nonzero(keep)[0] + start)
+        cols.append(neighbors[keep])
+        values.append(similarity[keep])
+
+    return sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_items, n_items)
+    )
+
+
+def refresh_item_neighbors(user_item_matrix, item_neighbors, touched, k):
+    """
+    Top-k соседей после изменения столбцов touched
+
+    Для затронутых товаров соседи считаются заново; у остальных товаров
+    заменяются оценки затронутых товаров, остальные соседи сохраняются.
+    """
+    n_items = user_item_matrix.shape[1]
+    k = min(k, n_items - 1)
+    if k <= 0:
+        return sparse.csr_matrix((n_items, n_items))
+
+    item_vectors = normalize(user_item_matrix.T.tocsr(), norm='l2', axis=1)
+    # Схожесть затронутых товаров со всеми: ненулевая только у товаров с общими покупателями
+    similarity = (item_vectors[touched] @ item_vectors.T).tocoo()
+    touched_rows = touched[similarity.row]
+    not_self = touched_rows != similarity.col
+
+    old = _resized(item_neighbors, (n_items, n_items)).tocoo()
+    is_touched = np.zeros(n_items, dtype=bool)
+    is_touched[touched] = True
+    kept = ~is_touched[old.row] & ~is_touched[old.col]
+    reverse = not_self & ~is_touched[similarity.col]
+
+    rows = np.concatenate([old.row[kept], touched_rows[not_self], similarity.col[reverse]])
+    cols = np.concatenate([old.col[kept], similarity.col[not_self], touched_rows[reverse]])
+    values = np.concatenate([old.data[kept], similarity.data[not_self], similarity.data[reverse]])
+    return _top_k_per_row(rows, cols, values, k, (n_items, n_items))
+
+
+def _top_k_per_row(rows, cols, values, k, shape):
+    """CSR из k наибольших положительных значений каждой строки"""
+    order = np.lexsort((-values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = (rank < k) & (values > 0)
+    return sparse.csr_matrix((values[keep], (rows[keep], cols[keep])), shape=shape)
+
+
+def _popular_records(popular_items):
+    """Строки popular_items в формате выдачи (ID и популярность - int, а не numpy)"""
+    return [{
+        'product_id': int(product_id),
+        'name': name,
+        'category': category,
+        'brand': brand,
+        'price': price,
+        'popularity': int(quantity)
+    } for product_id, name, category, brand, price, quantity in zip(
+        popular_items.index, popular_items['product_name'], popular_items['category_name'],
+        popular_items['brand_name'], popular_items['price'], popular_items['quantity'])]
+
+
+def _table_arrays(table):
+    """Столбцы таблицы как массивы без object dtype (для np.savez без pickle)"""
+    arrays = {}
+    for column in table.columns:
+        if column in TEXT_COLUMNS:
+            arrays[column] = np.array([str(value) for value in table[column]], dtype=str)
+        else:
+            arrays[column] = pd.to_numeric(table[column], errors='coerce').to_numpy()
+    return arrays
+
+
+def _table_from_arrays(arrays):
+    table = pd.DataFrame({column: arrays[column] for column in arrays.files})
+    for column in TEXT_COLUMNS:
+        if column in table:
+            table[column] = table[column].tolist()
+    if 'price' in table:
+        table['price'] = [Decimal(price) for price in table['price']]
+    return table
+
+
+def _interactions(orders_data, user_pos, item_pos, shape):
+    """Суммы количеств и число покупок по парам пользователь-товар (CSR)"""
+    quantities = orders_data['quantity'].to_numpy(dtype=np.float64)
+    totals = sparse.coo_matrix((quantities, (user_pos, item_pos)), shape=shape).tocsr()
+    counts = sparse.coo_matrix((np.ones_like(quantities), (user_pos, item_pos)), shape=shape).tocsr()
+    return totals, counts
+
+
+def _mean_matrix(totals, counts):
+    """Среднее количество на покупку; у totals и counts одна и та же структура"""
+    matrix = totals.copy()
+    matrix.data /= counts.data
+    return matrix
+
+
+def _aggregate_popular(orders_data):
+    return orders_data.groupby('product_id').agg({
+        'quantity': 'sum',
+        'product_name': 'first',
+        'category_name': 'first',
+        'brand_name': 'first',
+        'price': 'first'
+    })
+
+
+def _build_item_info(item_features):
+    """Описание товара для выдачи по product_id"""
+    items = item_features.drop_duplicates('product_id', keep='last')
+    return {
+        int(product_id): {'name': name, 'category': category, 'brand': brand, 'price': price}
+        for product_id, name, category, brand, price in zip(
+            items['product_id'], items['product_name'], items['category_name'],
+            items['brand_name'], items['price'])
+    }
+
+
+def _extend_index(ids, index, values):
+    """Добавление новых ID в конец массива и словаря; возвращает позиции values"""
+    new_ids = pd.unique(np.array([value for value in values if int(value) not in index], dtype=ids.dtype))
+    if len(new_ids):
+        index = {**index, **{int(value): len(ids) + offset for offset, value in enumerate(new_ids)}}
+        ids = np.concatenate([ids, new_ids])
+    positions = np.fromiter((index[int(value)] for value in values), dtype=np.intp, count=len(values))
+    return ids, index, positions
+
+
+def _resized(matrix, shape):
+    resized = matrix.copy()
+    resized.resize(shape)
+    return resized
+
 
 def main():
     # Создание и инициализация системы рекомендаций
@@ -0,0 +1,150 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class RecommenderUpdater:
+    """
+    Фоновое построение и дообучение рекомендательной системы.
+
+    Сразу после запуска поток строит первый срез модели (до этого
+    рекомендации отдаются по популярности), при ошибке повторяя попытку
+    через retry_interval секунд. Затем раз в interval секунд вызывается
+    recommender.update_from_db(), а срез модели сохраняется на диск не чаще
+    раза в snapshot_interval секунд;
+    notify() (после оформления заказа) будит его раньше, но не чаще
+    одного раза в min_interval секунд, так что поток заказов сливается
+    в редкие обновления. Обработчики запросов при этом не ждут: notify()
+    только выставляет флаг.
+    """
+
+    def __init__(self, recommender, interval=None, min_interval=None, retry_interval=None, snapshot_interval=None):
+        """
+        Args:
+            recommender: RecommendationSystem, которую нужно строить и дообучать
+            interval: период дообучения в секундах
+            min_interval: минимальная пауза между дообучениями по notify()
+            retry_interval: пауза перед повтором неудачного первого построения
+            snapshot_interval: как часто сохранять дообученный срез модели
+        """
+        self.recommender = recommender
+        self.interval = interval or float(os.getenv("RECOMMENDER_UPDATE_INTERVAL", "300"))
+        self.min_interval = min_interval if min_interval is not None \
+            else float(os.getenv("RECOMMENDER_UPDATE_MIN_INTERVAL", "5"))
+        self.retry_interval = retry_interval or float(os.getenv("RECOMMENDER_BUILD_RETRY_INTERVAL", "30"))
+        self.snapshot_interval = snapshot_interval or float(os.getenv("RECOMMENDER_SNAPSHOT_INTERVAL", "3600"))
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._pid = None
+        self._updates = 0
+        self._rows = 0
+        self._failed = 0
+        self._last_update_at = None
+        self._last_duration = None
+        self._last_run = 0.0
+        self._last_snapshot = time.monotonic()
+        self._snapshots = 0
+
+    def start(self):
+        """Запуск фонового потока (повторный вызов ничего не делает)"""
+        self._ensure_worker()
+
+    def notify(self):
+        """Появились новые заказы: дообучить в ближайшее время"""
+        self._ensure_worker()
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        if self._worker is not None and self._pid == os.getpid():
+            self._worker.join(timeout)
+
+    def run_once(self):
+        """Одно дообучение в текущем потоке; возвращает число учтенных позиций заказов"""
+        started = time.monotonic()
+        self._last_run = started
+        try:
+            rows = self.recommender.update_from_db()
+        except Exception as e:
+            with self._lock:
+                self._failed += 1
+            logger.error("Не удалось обновить модель рекомендаций: %s", e)
+            return 0
+        with self._lock:
+            self._updates += 1
+            self._rows += rows
+            self._last_update_at = datetime.now().isoformat(timespec='seconds')
+            self._last_duration = time.monotonic() - started
+        if rows and self.recommender.snapshot_path and \
+                time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            self._save_snapshot()
+        return rows
+
+    def _save_snapshot(self):
+        self._last_snapshot = time.monotonic()
+        try:
+            self.recommender.save_snapshot()
+        except Exception as e:
+            logger.error("Не удалось сохранить срез модели рекомендаций: %s", e)
+            return
+        with self._lock:
+            self._snapshots += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'updates': self._updates,
+                'rows': self._rows,
+                'failed': self._failed,
+                'last_update_at': self._last_update_at,
+                'last_duration': self._last_duration,
+                'ready': self.recommender.ready,
+                'version': self.recommender.model.version if self.recommender.ready else None,
+                'snapshots': self._snapshots,
+                'last_order_id': self.recommender.last_order_id,
+                'interval': self.interval,
+                'min_interval': self.min_interval
+            }
+
+    def _ensure_worker(self):
+        # Поток запускается лениво в каждом процессе (после fork он не наследуется)
+        if self._pid == os.getpid() and self._worker is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._worker is not None:
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='recommender-updater', daemon=True)
+            self._pid = os.getpid()
+            self._worker.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if not self.recommender.ready:
+                # Первый срез строится сразу; пока его нет, повторяем чаще обычного
+                self._wake.clear()
+                self.run_once()
+                if not self.recommender.ready:
+                    self._wake.wait(self.retry_interval)
+                continue
+            self._wake.wait(self.interval)
+            if self._stopping.is_set():
+                break
+            # Заказы, пришедшие во время паузы, попадут в это же обновление
+            pause = self._last_run + self.min_interval - time.monotonic()
+            if pause > 0 and self._stopping.wait(pause):
+                break
+            self._wake.clear()
+            self.run_once()
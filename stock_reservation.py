@@ -0,0 +1,128 @@
+import logging
+import os
+import random
+import re
+import time
+
+from psycopg2 import errors
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых транзакцию можно безопасно повторить целиком
+RETRYABLE_ERRORS = (errors.SerializationFailure, errors.DeadlockDetected, errors.LockNotAvailable)
+
+# CHECK (stock >= 0) таблицы products; под этим же именем ошибку поднимает trg_decrease_stock
+STOCK_CONSTRAINT = 'products_stock_check'
+# ID товара в описании ошибки: DETAIL триггера или первый столбец строки, нарушившей CHECK
+STOCK_DETAIL_PATTERNS = (re.compile(r'product_id = (\d+)'), re.compile(r'Failing row contains \((\d+),'))
+
+
+class InsufficientStockError(Exception):
+    """Остатка товара не хватает для заказа"""
+
+    def __init__(self, product_id, product_name=None, requested=None, available=None):
+        target = product_name or product_id
+        super().__init__(f"Insufficient stock for {target}" if target is not None else "Insufficient stock")
+        self.product_id = product_id
+        self.product_name = product_name
+        self.requested = requested
+        self.available = available
+
+
+class StockConflictError(Exception):
+    """Не удалось зарезервировать товар из-за конкурентных заказов даже после повторов"""
+
+
+def reserve_stock(cursor, requested):
+    """
+    Резервирование остатков под заказ внутри текущей транзакции
+
+    Строки товаров блокируются в порядке product_id (SELECT ... FOR UPDATE), поэтому
+    параллельные заказы на одни и те же товары выстраиваются в очередь, а не
+    взаимоблокируются. Само списание выполняет триггер trg_decrease_stock
+    при вставке order_items, пока блокировки удерживаются.
+
+    Args:
+        cursor: курсор транзакции заказа (RealDictCursor)
+        requested: словарь {product_id: количество}
+    """
+    product_ids = sorted(requested)
+    cursor.execute("""
+        SELECT id, name, stock FROM products
+        WHERE id = ANY(%s)
+        ORDER BY id
+        FOR UPDATE
+    """, (product_ids,))
+    locked = {row['id']: row for row in cursor.fetchall()}
+
+    for product_id in product_ids:
+        product = locked.get(product_id)
+        available = product['stock'] if product else 0
+        if available < requested[product_id]:
+            raise InsufficientStockError(product_id, product['name'] if product else None,
+                                         requested[product_id], available)
+    return locked
+
+
+def run_in_transaction(conn, work, retries=None, lock_timeout_ms=None):
+    """
+    Выполнение work(cursor) в транзакции с повтором при конфликтах
+
+    При SerializationFailure, DeadlockDetected и LockNotAvailable транзакция
+    откатывается и повторяется с экспоненциальной задержкой. Любая другая ошибка
+    откатывает транзакцию и пробрасывается; нарушение CHECK по остатку
+    (products_stock_check, в том числе из триггера) превращается в
+    InsufficientStockError с ID товара, остальные нарушения CHECK
+    пробрасываются как есть.
+
+    Args:
+        conn: соединение запроса
+        work: функция, получающая курсор; ее результат возвращается после commit
+        retries: число повторов (по умолчанию STOCK_RESERVATION_RETRIES)
+        lock_timeout_ms: сколько ждать блокировку строки (по умолчанию STOCK_LOCK_TIMEOUT_MS)
+    """
+    if retries is None:
+        retries = int(os.getenv("STOCK_RESERVATION_RETRIES", "3"))
+    if lock_timeout_ms is None:
+        lock_timeout_ms = int(os.getenv("STOCK_LOCK_TIMEOUT_MS", "2000"))
+
+    attempt = 0
+    while True:
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", (f'{lock_timeout_ms}ms',))
+                result = work(cursor)
+            conn.commit()
+            return result
+        except RETRYABLE_ERRORS as e:
+            conn.rollback()
+            if attempt >= retries:
+                raise StockConflictError(str(e)) from e
+            attempt += 1
+            delay = 0.01 * (2 ** attempt) * (1 + random.random())
+            logger.warning("Конфликт при резервировании (%s), повтор %s через %.3f с",
+                           type(e).__name__, attempt, delay)
+            time.sleep(delay)
+        except errors.CheckViolation as e:
+            conn.rollback()
+            if e.diag.constraint_name != STOCK_CONSTRAINT:
+                raise
+            raise InsufficientStockError(stock_violation_product(e)) from e
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def stock_violation_product(error):
+    """ID товара из ошибки нарушения остатка или None, если его нет в описании"""
+    detail = error.diag.message_detail or ''
+    for pattern in STOCK_DETAIL_PATTERNS:
+        match = pattern.search(detail)
+        if match:
+            return int(match.group(1))
+    return None
@@ -0,0 +1,82 @@
+"""
+Обучение модели цен для запуска по расписанию (cron).
+
+Полное обучение строит лес заново по всей истории цен; --incremental
+дообучает активную версию из реестра: добавляет деревья, обученные на
+записях price_history, появившихся после ее обучения (по changed_at).
+Дообучение пропускается (skipped), пока новых записей меньше
+PRICE_MODEL_MIN_NEW_ROWS, а новая версия не публикуется (rejected), если
+ее R² на последних записях истории ниже, чем у прежней.
+Каждый запуск печатает режим, число строк, время обучения, пиковую
+память процесса и R² (поле r2_scope - на чем он измерен) и дописывает
+их строкой JSON в журнал.
+
+Запуск: python train_price_model.py --incremental
+cron:   0 3 * * * cd /app && python train_price_model.py --incremental
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from price_prediction import PricePredictor
+
+# Загрузка переменных окружения
+load_dotenv()
+
+
+def peak_memory_mb():
+    """Пиковая резидентная память процесса, МБ (ru_maxrss в Linux - в КБ)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--incremental', action='store_true',
+                        help='дообучить активную версию на новых записях истории цен')
+    parser.add_argument('--n-jobs', type=int, help='потоков обучения (по умолчанию PRICE_MODEL_N_JOBS)')
+    parser.add_argument('--log', default=os.getenv("PRICE_MODEL_TRAIN_LOG", "models/price_training.jsonl"),
+                        help='журнал запусков (JSON Lines); пустая строка - не писать')
+    args = parser.parse_args()
+
+    started_at = datetime.now()
+    started = time.perf_counter()
+    predictor = PricePredictor(n_jobs=args.n_jobs)
+    stats = predictor.train(incremental=args.incremental)
+    stats = {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        **stats,
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'peak_memory_mb': round(peak_memory_mb(), 1)
+    }
+
+    print(f"\nРежим: {stats['mode']}, строк: {stats['rows']}")
+    if stats['mode'] != 'skipped':
+        print(f"Деревьев: {stats['trees']}, потоков: {stats['n_jobs']}")
+        print(f"Время обучения: {stats['fit_seconds']:.2f} с (всего {stats['total_seconds']:.2f} с)")
+        if stats['r2_scope'] == 'all_rows':
+            print(f"R² (вся история): обучение {stats['r2_train']:.3f}, проверка {stats['r2_test']:.3f}")
+        else:
+            if stats['r2_train'] is not None:
+                print(f"R² (новые строки): обучение {stats['r2_train']:.3f}")
+            print(f"R² (последние записи): проверка {stats['r2_test']:.3f}, "
+                  f"прежняя версия {stats['r2_previous']:.3f}")
+        if stats['mode'] == 'rejected':
+            print("Новая версия не опубликована: R² ниже, чем у прежней")
+    print(f"Пиковая память: {stats['peak_memory_mb']:.1f} МБ")
+    print(f"Версия: {stats['version']}")
+
+    if args.log:
+        os.makedirs(os.path.dirname(args.log) or '.', exist_ok=True)
+        with open(args.log, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(stats, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()